@@ -10,9 +10,15 @@
 Now you can use the dataset class by specifying flag '--dataset_mode dummy'.
 See our template dataset class 'template_dataset.py' for more details.
 """
+import random
 import importlib
+import itertools
+import numpy as np
 import torch.utils.data
-from data.base_dataset import BaseDataset
+import torch.multiprocessing
+from data.base_dataset import BaseDataset, BatchedMaskTransform, collate_batched
+from data.pair_sampler import PairSampler
+from util.distributed import is_distributed, get_rank, get_world_size
 
 
 def find_dataset_using_name(dataset_name):
@@ -72,22 +78,218 @@ class CustomDatasetDataLoader():
         dataset_class = find_dataset_using_name(opt.dataset_mode)
         self.dataset = dataset_class(opt)
         print("dataset [%s] was created" % type(self.dataset).__name__)
+        if opt.batched_augment and not self.dataset.batched_transforms:
+            raise NotImplementedError('dataset [%s] does not support --batched_augment' % type(self.dataset).__name__)
+        if opt.stream_dataset and is_distributed():
+            raise ValueError('--stream_dataset cannot be used with multi-process training: the processes would see different datasets')
+        if opt.stream_dataset and opt.pair_sampling in ('balanced', 'stratified'):
+            raise ValueError('--stream_dataset cannot be used with --pair_sampling %s: the classes of the B images are not known yet' % opt.pair_sampling)
+        self.sampler = None
+        self.streaming = isinstance(self.dataset, torch.utils.data.IterableDataset)  # shuffled and split by the dataset itself
+        if not self.streaming and hasattr(self.dataset, 'B_size') and opt.pair_sampling != 'random':  # draw the (A, B) pairs of unaligned datasets
+            B_classes = self.dataset.get_B_classes() if opt.pair_sampling != 'uniform' and not opt.serial_batches else None
+            self.sampler = PairSampler(self.dataset.A_size, self.dataset.B_size, opt.pair_sampling, B_classes, opt.serial_batches,
+                                       opt.pair_seed, get_world_size(), get_rank())
+        elif not self.streaming and is_distributed():  # every process loads its own shard of the dataset
+            self.sampler = torch.utils.data.distributed.DistributedSampler(self.dataset, shuffle=not opt.serial_batches)
+        if opt.sharing_strategy:
+            torch.multiprocessing.set_sharing_strategy(opt.sharing_strategy)
+        num_workers = int(opt.num_threads)
+        workers_options = {}
+        if num_workers > 0:  # the DataLoader rejects prefetch_factor and persistent_workers without worker processes
+            workers_options['worker_init_fn'] = worker_init_fn
+            if opt.prefetch_factor > 0:
+                workers_options['prefetch_factor'] = opt.prefetch_factor
+            # keep the RAM tier of the image cache between epochs; new workers see the images found by --stream_dataset
+            # and the epoch of streaming datasets
+            if (opt.persistent_workers or self.dataset.image_cache is not None) and not opt.stream_dataset and not self.streaming:
+                workers_options['persistent_workers'] = True
+        self.device = torch.device('cuda:{}'.format(opt.gpu_ids[0])) if len(opt.gpu_ids) > 0 else torch.device('cpu')
+        self.skip_sampler = None  # fast-forwards the sampler, see <skip>
+        if not self.streaming:
+            sampler = self.sampler
+            if sampler is None:
+                sampler = torch.utils.data.SequentialSampler(self.dataset) if opt.serial_batches else torch.utils.data.RandomSampler(self.dataset)
+            self.skip_sampler = SkipSampler(sampler)
+        self.skip_batches, self.on_skipped = 0, None
         self.dataloader = torch.utils.data.DataLoader(
             self.dataset,
             batch_size=opt.batch_size,
-            shuffle=not opt.serial_batches,
-            num_workers=int(opt.num_threads))
+            sampler=self.skip_sampler,
+            num_workers=num_workers,
+            pin_memory=opt.pin_memory and self.device.type == 'cuda',
+            drop_last=opt.drop_last,
+            collate_fn=collate_batched if opt.batched_augment else None,
+            **workers_options)
 
     def load_data(self):
         return self
 
+    def set_epoch(self, epoch):
+        """Set the epoch, so that the data (and the shards of a multi-process training) are shuffled differently at every epoch
+
+        The dataset is also refreshed, e.g., to use the images found since the last epoch with --stream_dataset.
+        """
+        self.dataset.refresh()
+        if self.streaming:
+            self.dataset.set_epoch(epoch)
+        if isinstance(self.sampler, PairSampler):
+            self.sampler.set_sizes(self.dataset.A_size, self.dataset.B_size)
+        if self.sampler is not None:
+            self.sampler.set_epoch(epoch)
+
     def __len__(self):
-        """Return the number of data in the dataset"""
-        return min(len(self.dataset), self.opt.max_dataset_size)
+        """Return the number of data in the dataset (in the shard of this process, in a multi-process training)"""
+        size = min(len(self.sampler) if self.sampler is not None else len(self.dataset), self.opt.max_dataset_size)
+        return size - size % self.opt.batch_size if self.opt.drop_last else size
+
+    def skip(self, num_batches, on_skipped=None):
+        """Start the next epoch after its first <num_batches> batches, e.g., to resume an interrupted epoch.
+
+        The sampler skips their indices, so that they are neither loaded nor augmented; <on_skipped> is then called
+        before the first batch is loaded (e.g., to restore the random state of the interrupted epoch). Streaming
+        datasets have no sampler: their first batches are still read, but not augmented.
+        """
+        self.skip_batches, self.on_skipped = num_batches, on_skipped
 
     def __iter__(self):
         """Return a batch of data"""
-        for i, data in enumerate(self.dataloader):
+        skip_batches, on_skipped = self.skip_batches, self.on_skipped
+        self.skip_batches, self.on_skipped = 0, None
+        if skip_batches > 0 and self.skip_sampler is not None:
+            self.skip_sampler.skip(skip_batches * self.opt.batch_size, on_skipped)
+        loader = DevicePrefetcher(self.dataloader, self.device) if self.opt.device_prefetch else self.dataloader
+        for i, data in enumerate(loader, skip_batches if self.skip_sampler is not None else 0):
             if i * self.opt.batch_size >= self.opt.max_dataset_size:
                 break
+            if i < skip_batches:  # streaming datasets: the batches read before the interrupted iteration are dropped
+                if i == skip_batches - 1 and on_skipped is not None:
+                    on_skipped()
+                continue
+            if self.opt.batched_augment:
+                data = self.augment(data)
+            yield data
+
+    def augment(self, data):
+        """Apply the batched transforms of the dataset; the uint8 images (and masks) are moved to the GPU first, if any."""
+        for key, transform in self.dataset.batched_transforms.items():
+            imgs = self._to_device(data[key])
+            if isinstance(transform, BatchedMaskTransform):  # the image and its mask <key>_label are transformed together
+                data[key], data[key + '_label'] = transform(imgs, self._to_device(data[key + '_label']), data[key + '_params'])
+            else:
+                data[key] = transform(imgs, data[key + '_params'])
+        return data
+
+    def _to_device(self, imgs):
+        """Move a batch of uint8 images (a tensor, or a list of tensors of different sizes) to the GPU, if any."""
+        if self.device.type != 'cuda':
+            return imgs
+        return [img.to(self.device, non_blocking=True) for img in imgs] if isinstance(imgs, list) else imgs.to(self.device, non_blocking=True)
+
+
+class SkipSampler(torch.utils.data.Sampler):
+    """Wrap a sampler, so that an epoch can start after its first indices without loading them (see <CustomDatasetDataLoader.skip>)"""
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.start = 0
+        self.on_start = None
+
+    def skip(self, start, on_start=None):
+        """Skip the first <start> indices of the next epoch, then call <on_start> before returning the next index."""
+        self.start, self.on_start = start, on_start
+
+    def __len__(self):
+        return len(self.sampler)
+
+    def __iter__(self):
+        start, on_start = self.start, self.on_start
+        self.start, self.on_start = 0, None
+        indices = iter(self.sampler)  # the random draws of the wrapped sampler are the same as without skipping
+        if start > 0:
+            next(itertools.islice(indices, start - 1, None), None)
+            if on_start is not None:
+                on_start()
+        yield from indices
+
+
+def worker_init_fn(worker_id):
+    """Initialize a data loading worker.
+
+    The python and numpy random generators are seeded from the seed torch gives to the worker,
+    which differs between the workers and is drawn from the random state of the main process at every epoch
+    (so that the data augmentation is reproducible, e.g., when resuming a training).
+    Each worker uses a single thread: the parallelism comes from the number of workers.
+    """
+    seed = torch.initial_seed() % 2 ** 32
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.set_num_threads(1)
+
+
+def to_device(data, device, non_blocking=False):
+    """Move the tensors of a batch (nested in dicts and lists) to <device>."""
+    if isinstance(data, torch.Tensor):
+        return data.to(device, non_blocking=non_blocking)
+    if isinstance(data, dict):
+        return {k: to_device(v, device, non_blocking) for k, v in data.items()}
+    if isinstance(data, list):
+        return [to_device(v, device, non_blocking) for v in data]
+    return data
+
+
+def _record_stream(data, stream):
+    """Mark the tensors of a batch as used by <stream>, so that their memory is not reused before it is done with them."""
+    if isinstance(data, torch.Tensor):
+        data.record_stream(stream)
+    elif isinstance(data, dict):
+        for v in data.values():
+            _record_stream(v, stream)
+    elif isinstance(data, list):
+        for v in data:
+            _record_stream(v, stream)
+
+
+class DevicePrefetcher():
+    """Iterate over the batches of a data loader, copying the next batch to the GPU while the current one is processed.
+
+    The copies run on a separate CUDA stream; they are only asynchronous if the batches are in pinned memory (--pin_memory).
+    The batches are returned on the GPU, so that the <.to(self.device)> of the models are no-ops.
+    On CPU, the batches are returned unchanged.
+    """
+
+    def __init__(self, loader, device):
+        """Initialize the prefetcher
+
+        Parameters:
+            loader (iterable) -- the data loader
+            device (torch.device) -- the device the batches are copied to
+        """
+        self.loader = loader
+        self.device = device
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        if self.device.type != 'cuda':
+            yield from self.loader
+            return
+        stream = torch.cuda.Stream(self.device)
+        current_stream = torch.cuda.current_stream(self.device)
+        batches = iter(self.loader)
+
+        def preload():
+            data = next(batches, None)
+            if data is not None:
+                with torch.cuda.stream(stream):
+                    data = to_device(data, self.device, non_blocking=True)
+            return data
+
+        next_data = preload()
+        while next_data is not None:
+            current_stream.wait_stream(stream)  # the copy of the batch is done before the models use it
+            data = next_data
+            _record_stream(data, current_stream)
+            next_data = preload()               # start copying the next batch
             yield data
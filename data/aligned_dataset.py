@@ -1,7 +1,5 @@
 import os.path
-from data.base_dataset import BaseDataset, get_params, get_transform
-from data.image_folder import make_dataset
-from PIL import Image
+from data.base_dataset import BaseDataset, get_params, get_transform, to_uint8_tensor, BatchedTransform
 
 
 class AlignedDataset(BaseDataset):
@@ -19,10 +17,13 @@ class AlignedDataset(BaseDataset):
         """
         BaseDataset.__init__(self, opt)
         self.dir_AB = os.path.join(opt.dataroot, opt.phase)  # get the image directory
-        self.AB_paths = sorted(make_dataset(self.dir_AB, opt.max_dataset_size))  # get image paths
+        self.AB_paths = self.find_images(self.dir_AB)  # get image paths
         assert(self.opt.load_size >= self.opt.crop_size)   # crop_size should be smaller than the size of loaded image
         self.input_nc = self.opt.output_nc if self.opt.direction == 'BtoA' else self.opt.input_nc
         self.output_nc = self.opt.input_nc if self.opt.direction == 'BtoA' else self.opt.output_nc
+        if opt.batched_augment:
+            self.batched_transforms = {'A': BatchedTransform(self.opt, grayscale=(self.input_nc == 1)),
+                                       'B': BatchedTransform(self.opt, grayscale=(self.output_nc == 1))}
 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
@@ -38,12 +39,12 @@ class AlignedDataset(BaseDataset):
         """
         # read a image given a random integer index
         AB_path = self.AB_paths[index]
-        AB = Image.open(AB_path).convert('RGB')
         # split AB image into A and B
-        w, h = AB.size
-        w2 = int(w / 2)
-        A = AB.crop((0, 0, w2, h))
-        B = AB.crop((w2, 0, w, h))
+        A, B = self.load_image(AB_path, split=True)
+        if self.opt.batched_augment:  # the same transformation is applied later to A and B of the whole batch
+            transform_params = get_params(self.opt, A.size)
+            return {'A': to_uint8_tensor(A), 'B': to_uint8_tensor(B), 'A_paths': AB_path, 'B_paths': AB_path,
+                    'A_params': transform_params, 'B_params': transform_params}
 
         # apply the same transform to both A and B
         transform_params = get_params(self.opt, A.size)
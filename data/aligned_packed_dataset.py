@@ -0,0 +1,67 @@
+import os.path
+from data.base_dataset import BaseDataset, get_params, get_transform, to_uint8_tensor, BatchedTransform
+from data.packed_folder import PackedImageFolder
+from PIL import Image
+
+
+class AlignedPackedDataset(BaseDataset):
+    """A dataset class for paired image dataset stored in a packed, memory-mapped folder.
+
+    It is the packed counterpart of 'aligned' dataset: it requires a packed folder '/path/to/data/train_packed'
+    holding the {A,B} image pairs, created once with
+        python datasets/pack_dataset.py --dataroot /path/to/data --folders train
+    You can train the model with the dataset flag '--dataroot /path/to/data --dataset_mode aligned_packed'.
+    """
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        BaseDataset.__init__(self, opt)
+        self.dir_AB = os.path.join(opt.dataroot, opt.phase + '_packed')  # get the packed image directory
+        self.AB_images = PackedImageFolder(self.dir_AB, opt.max_dataset_size)
+        assert(self.opt.load_size >= self.opt.crop_size)   # crop_size should be smaller than the size of loaded image
+        self.input_nc = self.opt.output_nc if self.opt.direction == 'BtoA' else self.opt.input_nc
+        self.output_nc = self.opt.input_nc if self.opt.direction == 'BtoA' else self.opt.output_nc
+        if opt.batched_augment:
+            self.batched_transforms = {'A': BatchedTransform(self.opt, grayscale=(self.input_nc == 1)),
+                                       'B': BatchedTransform(self.opt, grayscale=(self.output_nc == 1))}
+
+    def __getitem__(self, index):
+        """Return a data point and its metadata information.
+
+        Parameters:
+            index - - a random integer for data indexing
+
+        Returns a dictionary that contains A, B, A_paths and B_paths
+            A (tensor) - - an image in the input domain
+            B (tensor) - - its corresponding image in the target domain
+            A_paths (str) - - original image paths
+            B_paths (str) - - original image paths (same as A_paths)
+        """
+        # read the AB image from the memory-mapped shard and split it into A and B
+        AB = self.AB_images.get_array(index)
+        w2 = int(AB.shape[1] / 2)
+        AB_path = self.AB_images.paths[index]
+        if self.opt.batched_augment:  # the same transformation is applied later to A and B of the whole batch
+            transform_params = get_params(self.opt, (w2, AB.shape[0]))
+            return {'A': to_uint8_tensor(AB[:, :w2]), 'B': to_uint8_tensor(AB[:, w2:]), 'A_paths': AB_path, 'B_paths': AB_path,
+                    'A_params': transform_params, 'B_params': transform_params}
+        A = Image.fromarray(AB[:, :w2])
+        B = Image.fromarray(AB[:, w2:])
+
+        # apply the same transform to both A and B
+        transform_params = get_params(self.opt, A.size)
+        A_transform = get_transform(self.opt, transform_params, grayscale=(self.input_nc == 1))
+        B_transform = get_transform(self.opt, transform_params, grayscale=(self.output_nc == 1))
+
+        A = A_transform(A)
+        B = B_transform(B)
+
+        return {'A': A, 'B': B, 'A_paths': AB_path, 'B_paths': AB_path}
+
+    def __len__(self):
+        """Return the total number of images in the dataset."""
+        return len(self.AB_images)
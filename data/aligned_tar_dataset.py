@@ -0,0 +1,55 @@
+import os.path
+from data.base_dataset import get_params, get_transform, to_uint8_tensor, BatchedTransform, split_image
+from data.tar_shards import TarShardDataset, TarShardFolder, decode_image, get_sample_file
+
+
+class AlignedTarDataset(TarShardDataset):
+    """A dataset class streaming a paired image dataset from tar shards.
+
+    It is the streaming counterpart of 'aligned' dataset: it requires a tar shard folder '/path/to/data/train_tar'
+    holding the {A,B} image pairs, created once with
+        python datasets/make_tar_shards.py --dataroot /path/to/data --folders train
+    You can train the model with the dataset flag '--dataroot /path/to/data --dataset_mode aligned_tar'.
+    """
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        TarShardDataset.__init__(self, opt)
+        self.dir_AB = os.path.join(opt.dataroot, opt.phase + '_tar')  # get the tar shard directory
+        self.folders = {'AB': TarShardFolder(self.dir_AB, opt.max_dataset_size)}
+        assert(self.opt.load_size >= self.opt.crop_size)   # crop_size should be smaller than the size of loaded image
+        self.input_nc = self.opt.output_nc if self.opt.direction == 'BtoA' else self.opt.input_nc
+        self.output_nc = self.opt.input_nc if self.opt.direction == 'BtoA' else self.opt.output_nc
+        if opt.batched_augment:
+            self.batched_transforms = {'A': BatchedTransform(self.opt, grayscale=(self.input_nc == 1)),
+                                       'B': BatchedTransform(self.opt, grayscale=(self.output_nc == 1))}
+
+    def make_item(self, samples):
+        """Return a data point and its metadata information.
+
+        Parameters:
+            samples (dict) -- a sample of the AB shard folder
+
+        Returns a dictionary that contains A, B, A_paths and B_paths
+            A (tensor) - - an image in the input domain
+            B (tensor) - - its corresponding image in the target domain
+            A_paths (str) - - original image paths
+            B_paths (str) - - original image paths (same as A_paths)
+        """
+        AB_path = samples['AB']['path'].decode()
+        # split AB image into A and B
+        A, B = split_image(decode_image(get_sample_file(samples['AB'], 'img')))
+        transform_params = get_params(self.opt, A.size)
+        if self.opt.batched_augment:  # the same transformation is applied later to A and B of the whole batch
+            return {'A': to_uint8_tensor(A), 'B': to_uint8_tensor(B), 'A_paths': AB_path, 'B_paths': AB_path,
+                    'A_params': transform_params, 'B_params': transform_params}
+
+        # apply the same transform to both A and B
+        A_transform = get_transform(self.opt, transform_params, grayscale=(self.input_nc == 1))
+        B_transform = get_transform(self.opt, transform_params, grayscale=(self.output_nc == 1))
+
+        return {'A': A_transform(A), 'B': B_transform(B), 'A_paths': AB_path, 'B_paths': AB_path}
@@ -2,7 +2,12 @@
 
 It also includes common transformation functions (e.g., get_transform, __scale_width), which can be later used in subclasses.
 """
+import os
 import random
+import hashlib
+import functools
+import multiprocessing
+from collections import OrderedDict
 import numpy as np
 import torch.utils.data as data
 from PIL import Image
@@ -10,6 +15,8 @@ import torchvision.transforms as transforms
 from abc import ABC, abstractmethod
 import torchvision.transforms.functional as F
 import torch
+from torch.utils.data.dataloader import default_collate
+from data.image_folder import make_dataset
 
 class BaseDataset(data.Dataset, ABC):
     """This class is an abstract base class (ABC) for datasets.
@@ -29,6 +36,11 @@ class BaseDataset(data.Dataset, ABC):
         """
         self.opt = opt
         self.root = opt.dataroot
+        self.batched_transforms = {}  # {key: BatchedTransform} applied after collation when --batched_augment is set
+        if opt.image_cache_mb > 0 or opt.image_cache_dir:
+            self.image_cache = ImageCache(opt.image_cache_mb, opt.image_cache_dir, opt.image_cache_disk_mb)
+        else:
+            self.image_cache = None
 
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -60,6 +72,211 @@ class BaseDataset(data.Dataset, ABC):
         """
         pass
 
+    def find_images(self, dir):
+        """Return the sorted paths of the images of <dir> and its subdirectories.
+
+        With --dataset_manifest_dir, the listing of the directories is cached in a manifest.
+        With --stream_dataset, the paths are returned in the order of the scan, which goes on in the background;
+        the dataset then grows at every epoch (see <refresh>).
+        """
+        paths = make_dataset(dir, self.opt.max_dataset_size, self.opt.dataset_manifest_dir, self.opt.stream_dataset)
+        return paths.wait() if self.opt.stream_dataset else sorted(paths)
+
+    def refresh(self):
+        """Update the dataset at the beginning of every epoch, e.g., with the images found since by --stream_dataset."""
+        pass
+
+    def get_pair_indices(self, index):
+        """Return the indices of the A and B images of an unaligned data point.
+
+        Parameters:
+            index -- an (index_A, index_B) pair drawn by <PairSampler>, or an integer
+
+        With an integer (e.g., --pair_sampling random), the A image is index % A_size and the B image is drawn
+        at random, or is index % B_size with --serial_batches.
+        """
+        if isinstance(index, (tuple, list)):
+            return index[0], index[1]
+        if self.opt.serial_batches:   # make sure index is within then range
+            index_B = index % self.B_size
+        else:   # randomize the index for domain B to avoid fixed pairs.
+            index_B = random.randint(0, self.B_size - 1)
+        return index % self.A_size, index_B
+
+    def get_B_classes(self):
+        """Return the class of every B image of an unaligned dataset, used by --pair_sampling balanced and stratified."""
+        raise NotImplementedError('dataset [%s] does not provide the classes of its B images' % type(self).__name__)
+
+    def load_image(self, path, split=False):
+        """Load an RGB image.
+
+        Parameters:
+            path (str)   -- the image path
+            split (bool) -- if True, split the image into its left (A) and right (B) halves, as in 'aligned' datasets
+
+        Returns a PIL image, or a tuple (A, B) of PIL images if split.
+        If the image cache is enabled (--image_cache_mb / --image_cache_dir), the images are also resized
+        with <resize_image>, and the decoded-and-resized pixels are cached; the resize in <get_transform> is then a no-op.
+        """
+        if self.image_cache is None:
+            img = Image.open(path).convert('RGB')
+            return split_image(img) if split else img
+
+        key = '%s|%s|%d|%s' % (path, self.opt.preprocess, self.opt.load_size, split)
+        arrays = self.image_cache.get(key)
+        if arrays is None:
+            img = Image.open(path).convert('RGB')
+            imgs = split_image(img) if split else (img,)
+            arrays = [np.asarray(resize_image(self.opt, img), dtype=np.uint8) for img in imgs]
+            self.image_cache.put(key, arrays)
+        imgs = tuple(Image.fromarray(array) for array in arrays)
+        return imgs if split else imgs[0]
+
+
+class ImageCache():
+    """An LRU cache of decoded images (uint8 numpy arrays), with a RAM budget and an optional on-disk spill tier.
+
+    The RAM tier lives in each process, i.e., in each data loading worker (with --num_threads > 0 the workers are kept
+    alive between epochs); its budget is per process. The disk tier is shared by all the workers: entries are written
+    atomically as .npz files named by the hash of their key, and the least recently used ones are deleted
+    when the directory grows beyond its budget. Hit and miss counters are shared by all the processes.
+    """
+
+    def __init__(self, ram_mb, disk_dir='', disk_mb=10240):
+        """Initialize the cache.
+
+        Parameters:
+            ram_mb (int)   -- the RAM budget of each process, in MB (0 disables the RAM tier)
+            disk_dir (str) -- the directory of the disk tier ('' disables the disk tier)
+            disk_mb (int)  -- the budget of the disk tier, in MB
+        """
+        self.ram_bytes = ram_mb * 1024 * 1024
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_mb * 1024 * 1024
+        self.ram = OrderedDict()  # key -> list of arrays, from the least to the most recently used
+        self.ram_used = 0
+        self.ram_hits = multiprocessing.Value('l', 0)
+        self.disk_hits = multiprocessing.Value('l', 0)
+        self.misses = multiprocessing.Value('l', 0)
+        self.disk_used = multiprocessing.Value('l', 0)
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self.disk_used.value = sum(size for _, _, size in self._disk_entries())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['ram'] = OrderedDict()  # every worker starts with an empty RAM tier
+        state['ram_used'] = 0
+        return state
+
+    def get(self, key):
+        """Return the cached list of arrays for <key>, or None."""
+        arrays = self.ram.get(key)
+        if arrays is not None:
+            self.ram.move_to_end(key)
+            self._count(self.ram_hits)
+            return arrays
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with np.load(path) as entry:
+                    arrays = [entry['arr_%d' % i] for i in range(len(entry.files))]
+                os.utime(path)  # mark as recently used
+            except (OSError, ValueError, KeyError):  # not cached, or evicted/being written by another worker
+                arrays = None
+            if arrays is not None:
+                self._put_ram(key, arrays)
+                self._count(self.disk_hits)
+                return arrays
+        self._count(self.misses)
+        return None
+
+    def put(self, key, arrays):
+        """Cache a list of arrays for <key>."""
+        self._put_ram(key, arrays)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp_path = '%s.%d.tmp' % (path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, *arrays)
+            nbytes = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+            with self.disk_used.get_lock():
+                self.disk_used.value += nbytes
+                if self.disk_used.value > self.disk_bytes:
+                    self._evict_disk()
+
+    def stats(self):
+        """Return a dictionary of the hit/miss counters of all the processes."""
+        ram_hits, disk_hits, misses = self.ram_hits.value, self.disk_hits.value, self.misses.value
+        total = max(ram_hits + disk_hits + misses, 1)
+        return {'ram_hits': ram_hits, 'disk_hits': disk_hits, 'misses': misses,
+                'hit_rate': (ram_hits + disk_hits) / total, 'disk_mb': self.disk_used.value / 1024 / 1024}
+
+    def reset_stats(self):
+        """Reset the hit/miss counters (e.g., at the beginning of every epoch)."""
+        for counter in (self.ram_hits, self.disk_hits, self.misses):
+            with counter.get_lock():
+                counter.value = 0
+
+    def _count(self, counter):
+        with counter.get_lock():
+            counter.value += 1
+
+    def _put_ram(self, key, arrays):
+        nbytes = sum(array.nbytes for array in arrays)
+        if nbytes > self.ram_bytes or key in self.ram:
+            return
+        self.ram[key] = arrays
+        self.ram_used += nbytes
+        while self.ram_used > self.ram_bytes:  # evict the least recently used entries
+            _, evicted = self.ram.popitem(last=False)
+            self.ram_used -= sum(array.nbytes for array in evicted)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+    def _disk_entries(self):
+        entries = []
+        for entry in os.scandir(self.disk_dir):
+            if entry.name.endswith('.npz'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def _evict_disk(self):
+        """Delete the least recently used files until the disk tier uses at most 90% of its budget (called with the lock held)."""
+        entries = sorted(self._disk_entries())
+        used = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if used <= 0.9 * self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            used -= size
+        self.disk_used.value = used
+
+
+def split_image(AB):
+    """Split an aligned image into its left (A) and right (B) halves."""
+    w, h = AB.size
+    w2 = int(w / 2)
+    return AB.crop((0, 0, w2, h)), AB.crop((w2, 0, w, h))
+
+
+def resize_image(opt, img, method=Image.BICUBIC):
+    """Apply the deterministic resize of <get_transform> (--preprocess resize* and scale_width*) to a PIL image."""
+    if 'resize' in opt.preprocess:
+        return img.resize((opt.load_size, opt.load_size), method)
+    elif 'scale_width' in opt.preprocess:
+        return __scale_width(img, opt.load_size, method)
+    return img
+
 
 def get_params(opt, size):
     w, h = size
@@ -113,6 +330,220 @@ def get_transform(opt, params=None, grayscale=False, method=Image.BICUBIC, conve
     return transforms.Compose(transform_list)
 
 
+def to_uint8_tensor(img):
+    """Convert a PIL image or a (H x W x C) numpy array to a (C x H x W) uint8 tensor, without any scaling."""
+    array = np.array(img, dtype=np.uint8)
+    if array.ndim == 2:
+        array = array[:, :, None]
+    return torch.from_numpy(array).permute(2, 0, 1).contiguous()
+
+
+def collate_batched(batch):
+    """Collate the data points of datasets used with --batched_augment.
+
+    Same as the default collate function, except that images of different sizes are kept as a list of tensors;
+    <BatchedTransform> then resizes them one by one before stacking.
+    """
+    collated = {}
+    for key in batch[0]:
+        values = [d[key] for d in batch]
+        if torch.is_tensor(values[0]) and any(v.shape != values[0].shape for v in values):
+            collated[key] = values
+        else:
+            collated[key] = default_collate(values)
+    return collated
+
+
+class BatchedTransform():
+    """Tensor counterpart of <get_transform> that processes a whole batch at once.
+
+    Datasets return decoded uint8 images together with the params of <get_params>; after collation (and after
+    moving the batch to the GPU, if any) this class applies grayscale conversion, resizing, cropping, flipping
+    and normalization to the batch. Cropping and flipping are a single index gather with per-sample offsets.
+    """
+
+    def __init__(self, opt, grayscale=False):
+        """Initialize the transform.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+            grayscale (bool)   -- if True, convert the images to a single channel
+        """
+        self.opt = opt
+        self.grayscale = grayscale
+
+    def __call__(self, imgs, params):
+        """Transform a batch of images.
+
+        Parameters:
+            imgs (tensor or list) -- uint8 images (N x C x H x W), or a list of (C x H x W) images of different sizes
+            params (dict)         -- the collated params of <get_params>: 'crop_pos' [x (tensor), y (tensor)] and 'flip' (tensor)
+
+        Returns a float tensor (N x C x crop_size x crop_size for cropping modes) normalized to [-1, 1].
+        """
+        x, y = params['crop_pos']
+        flip = params['flip']
+        if isinstance(imgs, (list, tuple)):  # resize the images one by one, then stack them
+            device = imgs[0].device
+            x, y, flip = x.to(device), y.to(device), flip.to(device)
+            imgs = torch.cat([self.transform(img.unsqueeze(0), x[i:i + 1], y[i:i + 1], flip[i:i + 1])
+                              for i, img in enumerate(imgs)])
+        else:
+            device = imgs.device
+            imgs = self.transform(imgs, x.to(device), y.to(device), flip.to(device))
+        return imgs / 127.5 - 1.0  # same as ToTensor + Normalize((0.5, ...), (0.5, ...))
+
+    def get_size(self, h, w):
+        """Return the (height, width) of the resized images, or None if they are not resized."""
+        if 'resize' in self.opt.preprocess:
+            return (self.opt.load_size, self.opt.load_size)
+        elif 'scale_width' in self.opt.preprocess and w != self.opt.load_size:
+            return (int(self.opt.load_size * h / w), self.opt.load_size)
+        elif self.opt.preprocess == 'none':
+            return (int(round(h / 4) * 4), int(round(w / 4) * 4))
+        return None
+
+    def resize(self, imgs):
+        """Convert a (N x C x H x W) uint8 tensor to float values in [0, 255], to grayscale if needed, and resize it."""
+        imgs = imgs.float()
+        if self.grayscale:  # ITU-R 601-2 luma, as PIL 'L' mode
+            weights = torch.tensor([0.299, 0.587, 0.114], device=imgs.device).view(1, 3, 1, 1)
+            imgs = (imgs * weights).sum(dim=1, keepdim=True).round()
+        size = self.get_size(*imgs.shape[2:])
+        if size is not None and size != tuple(imgs.shape[2:]):
+            imgs = torch.nn.functional.interpolate(imgs, size=size, mode='bicubic', align_corners=False, antialias=True)
+            imgs = imgs.clamp(0, 255).round()
+        return imgs
+
+    def transform(self, imgs, x, y, flip):
+        """Resize, crop and flip a (N x C x H x W) uint8 tensor of same-size images; returns float values in [0, 255]."""
+        imgs = self.resize(imgs)
+        h, w = imgs.shape[2:]
+        crop = 'crop' in self.opt.preprocess
+        flip = flip.bool() & (not self.opt.no_flip)
+        if not crop and not flip.any():
+            return imgs
+        th, tw = (min(self.opt.crop_size, h), min(self.opt.crop_size, w)) if crop else (h, w)
+        if not crop:
+            x, y = torch.zeros_like(x), torch.zeros_like(y)
+        # per-sample crop windows; flipping reverses the column indices
+        rows = y.long().view(-1, 1) + torch.arange(th, device=imgs.device)
+        cols = x.long().view(-1, 1) + torch.arange(tw, device=imgs.device)
+        cols = torch.where(flip.view(-1, 1), cols.flip(1), cols)
+        batch = torch.arange(imgs.shape[0], device=imgs.device).view(-1, 1, 1)
+        imgs = imgs.permute(0, 2, 3, 1)[batch, rows.unsqueeze(2), cols.unsqueeze(1)]  # N x th x tw x C
+        return imgs.permute(0, 3, 1, 2).contiguous()
+
+
+def mask_to_tensor(mask):
+    """Convert a PIL mask or a (H x W) numpy array to a (1 x H x W) tensor of labels.
+
+    Masks stay in uint8 if their labels fit (e.g., 'L' and 'P' PIL images); the models convert them to long at the losses.
+    """
+    array = np.asarray(mask)
+    if array.dtype != np.uint8:
+        array = array.astype(np.int64)
+    return torch.from_numpy(np.array(array[None], copy=True))
+
+
+def get_seg_params(opt, size):
+    """Draw the crop position, flip and rotation of an image and its mask, as <get_transform_seg>, for <BatchedMaskTransform>.
+
+    Parameters:
+        opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        size (tuple)       -- the (width, height) of the image
+
+    Returns a dictionary with 'crop_pos' (x, y), 'flip' (bool) and 'rot' (number of counter-clockwise quarter turns).
+    """
+    w, h = (opt.load_size, opt.load_size) if 'resize' in opt.preprocess else size
+    x = random.randint(0, max(0, w - opt.crop_size))
+    y = random.randint(0, max(0, h - opt.crop_size))
+    flip = not opt.no_flip and random.random() < 0.5
+    rot = 0 if opt.no_rotate else random.randrange(4)
+    return {'crop_pos': (x, y), 'flip': flip, 'rot': rot}
+
+
+class BatchedMaskTransform(BatchedTransform):
+    """Tensor counterpart of <get_transform_seg> that transforms a batch of images and their masks at once.
+
+    Datasets return decoded uint8 images and masks together with the params of <get_seg_params>. After collation,
+    every sample gets one crop + flip + quarter turn, applied to the image and to its mask by the same index gather;
+    for masks, the gather also performs the nearest-neighbor resize (as PIL), so that they are read once and stay in uint8.
+    """
+
+    def __call__(self, imgs, masks, params):
+        """Transform a batch of images and their masks.
+
+        Parameters:
+            imgs (tensor or list)  -- uint8 images (N x C x H x W), or a list of (C x H x W) images of different sizes
+            masks (tensor or list) -- uint8 (or long) masks (N x 1 x H x W), or a list of (1 x H x W) masks
+            params (dict)          -- the collated params of <get_seg_params>
+
+        Returns the images, normalized to [-1, 1], and the masks, with the same dtype.
+        """
+        x, y = params['crop_pos']
+        flip, rot = params['flip'], params['rot']
+        if isinstance(imgs, (list, tuple)):  # transform the images one by one, then stack them
+            device = imgs[0].device
+            x, y, flip, rot = x.to(device), y.to(device), flip.to(device), rot.to(device)
+            pairs = [self.transform_pair(img.unsqueeze(0), mask.unsqueeze(0), x[i:i + 1], y[i:i + 1], flip[i:i + 1], rot[i:i + 1])
+                     for i, (img, mask) in enumerate(zip(imgs, masks))]
+            imgs, masks = torch.cat([p[0] for p in pairs]), torch.cat([p[1] for p in pairs])
+        else:
+            device = imgs.device
+            imgs, masks = self.transform_pair(imgs, masks, x.to(device), y.to(device), flip.to(device), rot.to(device))
+        return imgs / 127.5 - 1.0, masks
+
+    def get_size(self, h, w):
+        """Return the size of the resized images: get_transform_seg only resizes with --preprocess resize*."""
+        return (self.opt.load_size, self.opt.load_size) if 'resize' in self.opt.preprocess else None
+
+    def transform_pair(self, imgs, masks, x, y, flip, rot):
+        """Resize, crop, flip and rotate same-size images (N x C x H x W, uint8) and masks (N x 1 x H x W); returns images in [0, 255]."""
+        n, _, mask_h, mask_w = masks.shape
+        imgs = self.resize(imgs)
+        h, w = imgs.shape[2:]
+        th, tw = (min(self.opt.crop_size, h), min(self.opt.crop_size, w)) if 'crop' in self.opt.preprocess else (h, w)
+        if 'crop' not in self.opt.preprocess:
+            x, y = torch.zeros_like(x), torch.zeros_like(y)
+        device = imgs.device
+        # source pixel (in the crop) of every output pixel, for each quarter turn: a counter-clockwise rotation around the
+        # center, as PIL's rotate; the pixels coming from outside of a non-square crop are filled with 0
+        dy = torch.arange(th, device=device, dtype=torch.float32).view(-1, 1) + 0.5 - th / 2
+        dx = torch.arange(tw, device=device, dtype=torch.float32).view(1, -1) + 0.5 - tw / 2
+        dy, dx = dy.expand(th, tw), dx.expand(th, tw)
+        turns = [(dy, dx), (dx, -dy), (-dy, -dx), (-dx, dy)]  # (row, column) offsets of the source pixels
+        src_rows = torch.stack([(r + th / 2).floor() for r, _ in turns]).long()[rot.long()]  # N x th x tw
+        src_cols = torch.stack([(c + tw / 2).floor() for _, c in turns]).long()[rot.long()]
+        valid = (src_rows >= 0) & (src_rows < th) & (src_cols >= 0) & (src_cols < tw)
+        src_cols = torch.where(flip.bool().view(-1, 1, 1), tw - 1 - src_cols, src_cols)
+        rows = (y.long().view(-1, 1, 1) + src_rows).clamp(0, h - 1)
+        cols = (x.long().view(-1, 1, 1) + src_cols).clamp(0, w - 1)
+        batch = torch.arange(n, device=device).view(-1, 1, 1)
+
+        imgs = imgs.permute(0, 2, 3, 1)[batch, rows, cols]  # N x th x tw x C
+        imgs = torch.where(valid.unsqueeze(3), imgs, torch.zeros((), device=device)).permute(0, 3, 1, 2).contiguous()
+        if (h, w) != (mask_h, mask_w):  # nearest-neighbor resize of the masks: the source pixel of every resized pixel
+            rows = torch.tensor(_nearest_indices(mask_h, h), device=device)[rows]
+            cols = torch.tensor(_nearest_indices(mask_w, w), device=device)[cols]
+        masks = masks[:, 0][batch, rows, cols]
+        masks = torch.where(valid, masks, torch.zeros((), dtype=masks.dtype, device=device)).unsqueeze(1)
+        return imgs, masks
+
+
+@functools.lru_cache(maxsize=None)
+def _nearest_indices(in_size, out_size):
+    """Return the source pixel of every pixel of a nearest-neighbor resize from <in_size> to <out_size> pixels.
+
+    The coordinates are accumulated in double precision as in PIL, so that the ties are broken the same way.
+    """
+    scale, coord, indices = in_size / out_size, in_size / out_size * 0.5, []
+    for _ in range(out_size):
+        indices.append(min(int(coord), in_size - 1))
+        coord += scale
+    return indices
+
+
 def __make_power_2(img, base, method=Image.BICUBIC):
     ow, oh = img.size
     h = int(round(oh / base) * base)
@@ -202,10 +633,18 @@ class ComposeMask(transforms.Compose):
         >>> ])
     """
 
-    def __call__(self, img,mask):
+    def __call__(self, img, mask, bbox=None):
+        """Transform an image and its mask, and optionally the (xmin, ymin, xmax, ymax) bounding box of the mask.
+
+        If a bounding box is given, it is updated along the geometric transforms and returned as a third value.
+        """
+        if bbox is None:
+            for t in self.transforms:
+                img, mask = t(img, mask)
+            return img, mask
         for t in self.transforms:
-            img,mask = t(img,mask)
-        return img,mask
+            img, mask, bbox = t(img, mask, bbox)
+        return img, mask, bbox
 
 
 class GrayscaleMask(transforms.Grayscale):
@@ -224,7 +663,7 @@ class GrayscaleMask(transforms.Grayscale):
     def __init__(self, num_output_channels=1):
         self.num_output_channels = num_output_channels
 
-    def __call__(self, img, mask):
+    def __call__(self, img, mask, bbox=None):
         """
         Args:
             img (PIL Image): Image to be converted to grayscale.
@@ -232,7 +671,8 @@ class GrayscaleMask(transforms.Grayscale):
         Returns:
             PIL Image: Randomly grayscaled image.
         """
-        return F.to_grayscale(img, num_output_channels=self.num_output_channels),mask
+        img = F.to_grayscale(img, num_output_channels=self.num_output_channels)
+        return (img, mask) if bbox is None else (img, mask, bbox)
 
     def __repr__(self):
         return self.__class__.__name__ + '(num_output_channels={0})'.format(self.num_output_channels)
@@ -250,7 +690,7 @@ class ResizeMask(transforms.Resize):
         interpolation (int, optional): Desired interpolation. Default is
             ``PIL.Image.BILINEAR``
     """
-    def __call__(self, img,mask):
+    def __call__(self, img, mask, bbox=None):
         """
         Args:
             img (PIL Image): Image to be scaled.
@@ -258,7 +698,11 @@ class ResizeMask(transforms.Resize):
         Returns:
             PIL Image: Rescaled image.
         """
-        return F.resize(img, self.size, self.interpolation),F.resize(mask, self.size, Image.NEAREST)
+        in_size = mask.size
+        img, mask = F.resize(img, self.size, self.interpolation), F.resize(mask, self.size, Image.NEAREST)
+        if bbox is None:
+            return img, mask
+        return img, mask, _resize_bbox(bbox, in_size, mask.size)
 
 
 class RandomCropMask(transforms.RandomCrop):
@@ -296,7 +740,7 @@ class RandomCropMask(transforms.RandomCrop):
                 will result in [2, 1, 1, 2, 3, 4, 4, 3]
 
     """
-    def __call__(self, img,mask):
+    def __call__(self, img, mask, bbox=None):
         """
         Args:
             img (PIL Image): Image to be cropped.
@@ -316,7 +760,10 @@ class RandomCropMask(transforms.RandomCrop):
 
         i, j, h, w = self.get_params(img, self.size)
 
-        return F.crop(img, i, j, h, w),F.crop(mask, i, j, h, w)
+        img, mask = F.crop(img, i, j, h, w), F.crop(mask, i, j, h, w)
+        if bbox is None:
+            return img, mask
+        return img, mask, _crop_bbox(bbox, i, j, h, w)
 
 
 class RandomHorizontalFlipMask(transforms.RandomHorizontalFlip):
@@ -326,7 +773,7 @@ class RandomHorizontalFlipMask(transforms.RandomHorizontalFlip):
         p (float): probability of the image being flipped. Default value is 0.5
     """
 
-    def __call__(self, img, mask):
+    def __call__(self, img, mask, bbox=None):
         """
         Args:
             img (PIL Image): Image to be flipped.
@@ -335,8 +782,10 @@ class RandomHorizontalFlipMask(transforms.RandomHorizontalFlip):
             PIL Image: Randomly flipped image.
         """
         if random.random() < self.p:
-            return F.hflip(img),F.hflip(mask)
-        return img,mask
+            img, mask = F.hflip(img), F.hflip(mask)
+            if bbox is not None:
+                bbox = _flip_bbox(bbox, mask.size)
+        return (img, mask) if bbox is None else (img, mask, bbox)
 
 class ToTensorMask(transforms.ToTensor):
     """Convert a ``PIL Image`` or ``numpy.ndarray`` to tensor.
@@ -349,7 +798,7 @@ class ToTensorMask(transforms.ToTensor):
     In the other cases, tensors are returned without scaling.
     """
 
-    def __call__(self, img,mask):
+    def __call__(self, img, mask, bbox=None):
         """
         Args:
             pic (PIL Image or numpy.ndarray): Image to be converted to tensor.
@@ -357,7 +806,11 @@ class ToTensorMask(transforms.ToTensor):
         Returns:
             Tensor: Converted image.
         """
-        return F.to_tensor(img),torch.from_numpy(np.array(mask,dtype=np.int64)).unsqueeze(0)
+        img = F.to_tensor(img)
+        mask = mask_to_tensor(mask)
+        if bbox is None:
+            return img, mask
+        return img, mask, torch.tensor(_exact_bbox(mask[0], bbox), dtype=torch.int64)
 
 class RandomRotationMask(transforms.RandomRotation):
     """Rotate the image by angle.
@@ -393,7 +846,7 @@ class RandomRotationMask(transforms.RandomRotation):
 
         return angle
 
-    def __call__(self, img,mask):
+    def __call__(self, img, mask, bbox=None):
         """
         Args:
             img (PIL Image): Image to be rotated.
@@ -402,8 +855,10 @@ class RandomRotationMask(transforms.RandomRotation):
             PIL Image: Rotated image.
         """
         angle = random.choice([0,90,180,270])
-        
-        return F.rotate(img, angle),F.rotate(mask, angle,fill=(0,))
+        img, mask = F.rotate(img, angle), F.rotate(mask, angle, fill=(0,))
+        if bbox is None:
+            return img, mask
+        return img, mask, _rotate_bbox(bbox, angle, mask.size)
 
 class NormalizeMask(transforms.Normalize):
     """Normalize a tensor image with mean and standard deviation.
@@ -421,7 +876,7 @@ class NormalizeMask(transforms.Normalize):
 
     """
 
-    def __call__(self, tensor_img,tensor_mask):
+    def __call__(self, tensor_img, tensor_mask, bbox=None):
         """
         Args:
             tensor (Tensor): Tensor image of size (C, H, W) to be normalized.
@@ -429,8 +884,94 @@ class NormalizeMask(transforms.Normalize):
         Returns:
             Tensor: Normalized Tensor image.
         """
-        return F.normalize(tensor_img, self.mean, self.std, self.inplace),tensor_mask
+        tensor_img = F.normalize(tensor_img, self.mean, self.std, self.inplace)
+        return (tensor_img, tensor_mask) if bbox is None else (tensor_img, tensor_mask, bbox)
 
 
     def __repr__(self):
         return self.__class__.__name__ + '(mean={0}, std={1})'.format(self.mean, self.std)
+
+
+# Bounding boxes of masks, (xmin, ymin, xmax, ymax) with inclusive pixel coordinates, updated along the mask transforms.
+# The updated box bounds the object, but may be looser than its box, e.g., a crop of an L-shaped object or of two blobs;
+# ToTensorMask scans the transformed mask within the bound only to get the exact box, as models.networks.mask_bbox.
+# Resizing and rotation use the pixel mappings of PIL, computed once per size.
+_EMPTY_BBOX = 'empty'  # the object left the image (e.g., cropped out)
+
+
+def _exact_bbox(mask, bbox):
+    """Return the box of the non-zero pixels of a (H x W) mask, scanning only the pixels of the bounding box <bbox>.
+
+    An empty mask gets the full image box, as models.networks.mask_bbox.
+    """
+    h, w = mask.shape
+    if bbox is not _EMPTY_BBOX:
+        xmin, ymin, xmax, ymax = bbox
+        window = mask[ymin:ymax + 1, xmin:xmax + 1].ne(0)
+        cols, rows = torch.nonzero(window.any(dim=0))[:, 0], torch.nonzero(window.any(dim=1))[:, 0]
+        if len(cols) > 0:
+            return [xmin + int(cols[0]), ymin + int(rows[0]), xmin + int(cols[-1]), ymin + int(rows[-1])]
+    return [0, 0, w - 1, h - 1]
+
+
+def _resize_bbox(bbox, in_size, out_size):
+    if bbox is _EMPTY_BBOX:
+        return bbox
+    xmin, xmax = _resize_extent(bbox[0], bbox[2], in_size[0], out_size[0])
+    ymin, ymax = _resize_extent(bbox[1], bbox[3], in_size[1], out_size[1])
+    if xmin is None or ymin is None:
+        return _EMPTY_BBOX
+    return [xmin, ymin, xmax, ymax]
+
+
+def _resize_extent(low, high, n_in, n_out):
+    """Return the output pixels whose nearest-neighbor source pixel lies in [low, high], as a (first, last) pair."""
+    sources = _nearest_sources(n_in, n_out)
+    kept = np.flatnonzero((low <= sources) & (sources <= high))
+    if len(kept) == 0:
+        return None, None
+    return int(kept[0]), int(kept[-1])
+
+
+@functools.lru_cache(maxsize=64)
+def _nearest_sources(n_in, n_out):
+    """Source pixel of every output pixel for a PIL nearest-neighbor resize from n_in to n_out pixels."""
+    ramp = Image.fromarray(np.arange(n_in, dtype=np.int32)[None, :])
+    return np.array(ramp.resize((n_out, 1), Image.NEAREST))[0]
+
+
+def _crop_bbox(bbox, i, j, h, w):
+    if bbox is _EMPTY_BBOX:
+        return bbox
+    xmin, ymin, xmax, ymax = bbox[0] - j, bbox[1] - i, bbox[2] - j, bbox[3] - i
+    if xmax < 0 or ymax < 0 or xmin > w - 1 or ymin > h - 1:
+        return _EMPTY_BBOX
+    return [max(xmin, 0), max(ymin, 0), min(xmax, w - 1), min(ymax, h - 1)]
+
+
+def _flip_bbox(bbox, size):
+    if bbox is _EMPTY_BBOX:
+        return bbox
+    w = size[0]
+    return [w - 1 - bbox[2], bbox[1], w - 1 - bbox[0], bbox[3]]
+
+
+def _rotate_bbox(bbox, angle, size):
+    """Update a box for a counter-clockwise rotation of the mask around its center, as PIL's rotate."""
+    if bbox is _EMPTY_BBOX or angle % 360 == 0:
+        return bbox
+    src_x, src_y = _rotation_sources(angle, size)
+    inside = (bbox[0] <= src_x) & (src_x <= bbox[2]) & (bbox[1] <= src_y) & (src_y <= bbox[3])
+    cols, rows = np.flatnonzero(inside.any(axis=0)), np.flatnonzero(inside.any(axis=1))
+    if len(cols) == 0:
+        return _EMPTY_BBOX
+    return [int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])]
+
+
+@functools.lru_cache(maxsize=16)
+def _rotation_sources(angle, size):
+    """Source (x, y) pixel of every output pixel for a PIL rotation of an image of <size>; -1 outside of the source."""
+    w, h = size
+    ramp_x = Image.fromarray(np.tile(np.arange(1, w + 1, dtype=np.int32), (h, 1)))
+    ramp_y = Image.fromarray(np.tile(np.arange(1, h + 1, dtype=np.int32)[:, None], (1, w)))
+    return np.array(ramp_x.rotate(angle, Image.NEAREST)) - 1, np.array(ramp_y.rotate(angle, Image.NEAREST)) - 1
@@ -1,6 +1,5 @@
 import os.path
 from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import make_dataset
 from skimage import color  # require skimage
 from PIL import Image
 import numpy as np
@@ -37,7 +36,7 @@ class ColorizationDataset(BaseDataset):
         """
         BaseDataset.__init__(self, opt)
         self.dir = os.path.join(opt.dataroot, opt.phase)
-        self.AB_paths = sorted(make_dataset(self.dir, opt.max_dataset_size))
+        self.AB_paths = self.find_images(self.dir)
         assert(opt.input_nc == 1 and opt.output_nc == 2 and opt.direction == 'AtoB')
         self.transform = get_transform(self.opt, convert=False)
 
@@ -10,6 +10,10 @@ from PIL import Image
 import os
 import os.path
 import glob
+import json
+import hashlib
+import threading
+import numpy as np
 
 IMG_EXTENSIONS = [
     '.jpg', '.JPG', '.jpeg', '.JPEG',
@@ -22,20 +26,139 @@ def is_image_file(filename):
     return any(filename.endswith(extension) for extension in IMG_EXTENSIONS)
 
 
-def make_dataset(dir, max_dataset_size=float("inf")):
-    images = []
-    assert os.path.isdir(dir), '%s is not a valid directory' % dir
+def make_dataset(dir, max_dataset_size=float("inf"), manifest_dir='', stream=False):
+    """Return the paths of the images of <dir> and its subdirectories.
 
-    for root, _, fnames in sorted(os.walk(dir)):
-        for fname in fnames:
-            if is_image_file(fname):
-                path = os.path.join(root, fname)
-                images.append(path)
+    Parameters:
+        dir (str)              -- the image directory
+        max_dataset_size (int) -- the maximum number of paths returned
+        manifest_dir (str)     -- if not empty, cache the listing of the directories in a manifest of this directory (see <scan_images>)
+        stream (bool)          -- if True, return an <ImagePathStream> filled while the directories are scanned
+    """
+    if stream:
+        return ImagePathStream(scan_images(dir, manifest_dir), max_dataset_size)
+    if manifest_dir:
+        images = list(scan_images(dir, manifest_dir, sort_dirs=True))
+    else:
+        images = []
+        assert os.path.isdir(dir), '%s is not a valid directory' % dir
+
+        for root, _, fnames in sorted(os.walk(dir)):
+            for fname in fnames:
+                if is_image_file(fname):
+                    path = os.path.join(root, fname)
+                    images.append(path)
     if max_dataset_size == 'inf':
         max_dataset_size = len(images)
     return images[:min(max_dataset_size, len(images))]
 
-def make_labeled_dataset(dir, max_dataset_size=float("inf")):
+
+def get_manifest_path(dir, manifest_dir):
+    """Return the path of the manifest of the image directory <dir>, in <manifest_dir>."""
+    root = os.path.abspath(dir)
+    return os.path.join(manifest_dir, '%s_%s.json' % (os.path.basename(root), hashlib.md5(root.encode()).hexdigest()[:12]))
+
+
+def scan_images(dir, manifest_dir='', sort_dirs=False):
+    """Yield the paths of the images of <dir> and its subdirectories.
+
+    Parameters:
+        dir (str)          -- the image directory
+        manifest_dir (str) -- if not empty, reuse and update the manifest of <dir> stored in this directory
+        sort_dirs (bool)   -- if True, yield the images once all the directories are scanned, in the order of
+                              sorted(os.walk(dir)); otherwise, yield them during the scan, directory by directory
+
+    The manifest stores the modification time, size, subdirectories and image names of every directory.
+    A directory is listed again only if its modification time or size changed (i.e., entries were added, removed or
+    renamed in it); the other ones only cost one stat, which makes rescanning large (e.g., network) trees fast.
+    The manifest is updated at the end of the scan.
+    """
+    assert os.path.isdir(dir), '%s is not a valid directory' % dir
+    manifest_path = get_manifest_path(dir, manifest_dir) if manifest_dir else None
+    old_dirs = {}
+    if manifest_path is not None and os.path.isfile(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if manifest.get('root') == os.path.abspath(dir):
+            old_dirs = manifest['dirs']
+    new_dirs = {}
+    num_listed = 0
+
+    def scan(rel):  # depth-first scan of the directory <rel> (relative to <dir>); yields (root, image names)
+        nonlocal num_listed
+        root = os.path.join(dir, rel) if rel else dir
+        st = os.stat(root)
+        key = [st.st_mtime_ns, st.st_size]
+        entry = old_dirs.get(rel)
+        if entry is None or entry['stat'] != key:  # list the directory again
+            num_listed += 1
+            subdirs, fnames = [], []
+            with os.scandir(root) as it:
+                for e in it:
+                    if e.is_dir():
+                        if not e.is_symlink():  # as os.walk, do not follow symbolic links to directories
+                            subdirs.append(e.name)
+                    elif is_image_file(e.name):
+                        fnames.append(e.name)
+            entry = {'stat': key, 'dirs': sorted(subdirs), 'files': fnames}
+        new_dirs[rel] = entry
+        yield root, entry['files']
+        for name in entry['dirs']:
+            yield from scan(os.path.join(rel, name) if rel else name)
+
+    walk = sorted(scan('')) if sort_dirs else scan('')
+    for root, fnames in walk:
+        for fname in fnames:
+            yield os.path.join(root, fname)
+
+    if manifest_path is not None and new_dirs != old_dirs:
+        print('image manifest of %s: %d directories, %d listed again' % (dir, len(new_dirs), num_listed))
+        os.makedirs(manifest_dir, exist_ok=True)
+        tmp_path = '%s.%d.tmp' % (manifest_path, os.getpid())  # several processes may update the manifest
+        with open(tmp_path, 'w') as f:
+            json.dump({'root': os.path.abspath(dir), 'dirs': new_dirs}, f)
+        os.replace(tmp_path, manifest_path)
+
+
+class ImagePathStream(list):
+    """A list of image paths, filled by a background thread while the image directory is scanned.
+
+    Its length grows until the scan is done, so that a training can start on the images found so far.
+    It is pickled as a plain list of the paths found so far.
+    """
+
+    def __init__(self, paths, max_dataset_size=float("inf")):
+        """Start filling the list
+
+        Parameters:
+            paths (iterable)       -- the image paths, e.g., <scan_images>
+            max_dataset_size (int) -- stop after this number of paths
+        """
+        list.__init__(self)
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._fill, args=(paths, max_dataset_size), daemon=True)
+        self.thread.start()
+
+    def _fill(self, paths, max_dataset_size):
+        try:
+            for path in paths:
+                if len(self) >= max_dataset_size:
+                    break
+                self.append(path)
+        finally:
+            self.done.set()
+
+    def wait(self, num=1):
+        """Wait until the list holds at least <num> paths, or the scan is done."""
+        while len(self) < num and not self.done.wait(0.01):
+            pass
+        return self
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def make_labeled_dataset(dir, max_dataset_size=float("inf"), manifest_dir=''):
     images = []
     labels = []
     alllabels = {}
@@ -47,7 +170,10 @@ def make_labeled_dataset(dir, max_dataset_size=float("inf")):
     #        if is_image_file(fname):
     #            path = os.path.join(root, fname)
     #            images.append(path)
-    all_files = glob.glob(dir + '/*/*.*')
+    if manifest_dir:  # the images of the subdirectories of dir, listed with the manifest
+        all_files = [path for path in scan_images(dir, manifest_dir, sort_dirs=True) if os.path.relpath(path, dir).count(os.sep) == 1]
+    else:
+        all_files = glob.glob(dir + '/*/*.*')
     for img in all_files:
         if is_image_file(img):
             images.append(img)
@@ -61,6 +187,11 @@ def make_labeled_dataset(dir, max_dataset_size=float("inf")):
     #print('labels=',labels)        
     return images[:min(max_dataset_size, len(images))],labels
 
+def make_dir_classes(paths):
+    """Return the class of every image, given by the name of its parent directory (e.g., trainB/<class>/image.png)."""
+    classes = {}
+    return [classes.setdefault(os.path.basename(os.path.dirname(path)), len(classes)) for path in paths]
+
 def make_labeled_mask_dataset(dir,paths, max_dataset_size=float("inf")):
     images = []
     labels = []
@@ -77,6 +208,43 @@ def make_labeled_mask_dataset(dir,paths, max_dataset_size=float("inf")):
     
     return images,labels
 
+def make_labeled_mask_bbox_index(dir, paths, label_paths):
+    """Return the bounding boxes and class histograms of the masks of a labeled mask dataset.
+
+    Parameters:
+        dir (str)          -- the dataset directory (e.g., /path/to/data/trainA)
+        paths (str)        -- the paths file, relative to dir (e.g., '/paths.txt')
+        label_paths (list) -- the mask paths, as returned by <make_labeled_mask_dataset>
+
+    The index is computed once and stored next to the paths file (e.g., /path/to/data/trainA/paths_bbox.json);
+    it is rebuilt when the paths file is newer than the index.
+    Returns two lists: inclusive (xmin, ymin, xmax, ymax) boxes of the non-zero pixels of every mask (the full image
+    box for empty masks), and per-class pixel counts of every mask.
+    """
+    paths_file = dir + paths
+    index_file = os.path.splitext(paths_file)[0] + '_bbox.json'
+    if os.path.isfile(index_file) and os.path.getmtime(index_file) >= os.path.getmtime(paths_file):
+        with open(index_file, 'r') as f:
+            index = json.load(f)
+        if index['label_paths'] == label_paths:
+            return index['bbox'], index['hist']
+
+    print('indexing the bounding boxes of %d masks into %s' % (len(label_paths), index_file))
+    bboxes, hists = [], []
+    for label_path in label_paths:
+        mask = np.array(Image.open(label_path))
+        cols = np.flatnonzero(mask.any(axis=0))
+        rows = np.flatnonzero(mask.any(axis=1))
+        if len(cols) > 0:
+            bboxes.append([int(cols[0]), int(rows[0]), int(cols[-1]), int(rows[-1])])
+        else:
+            bboxes.append([0, 0, mask.shape[1] - 1, mask.shape[0] - 1])
+        hists.append(np.bincount(mask.ravel()).tolist())
+    with open(index_file + '.tmp', 'w') as f:
+        json.dump({'label_paths': label_paths, 'bbox': bboxes, 'hist': hists}, f)
+    os.replace(index_file + '.tmp', index_file)
+    return bboxes, hists
+
 def make_dataset_path(dir,paths, max_dataset_size=float("inf")):
     images = []
     assert os.path.isdir(dir), '%s is not a valid directory' % dir
@@ -0,0 +1,110 @@
+"""A packed, memory-mapped image folder
+
+Packing decodes every image of a folder once and writes its raw RGB pixels (uint8, H x W x 3)
+into a few large shard files, together with an offset index.
+Datasets can then read a sample as a zero-copy view of the memory-mapped shards:
+no JPEG/PNG decoding and no per-file metadata lookup at training time,
+and all the DataLoader workers share the same page cache.
+
+Layout of a packed folder:
+    <packed_dir>/index.json          -- shard names, source image paths and (shard, offset, height, width) per image
+    <packed_dir>/shard_00000.bin     -- concatenated raw pixels
+    <packed_dir>/shard_00001.bin
+    ...
+"""
+import os
+import json
+import numpy as np
+from PIL import Image
+from data.image_folder import make_dataset
+
+INDEX_NAME = 'index.json'
+SHARD_NAME = 'shard_%05d.bin'
+
+
+def pack_folder(dir, packed_dir, shard_size=1024, max_dataset_size=float("inf")):
+    """Decode all the images under <dir> and write them into a packed folder.
+
+    Parameters:
+        dir (str)               -- the image folder to pack (e.g., /path/to/data/trainA)
+        packed_dir (str)        -- the output directory (e.g., /path/to/data/trainA_packed)
+        shard_size (int)        -- the maximum size of a shard file, in MB
+        max_dataset_size (int)  -- the maximum number of images to pack
+
+    Images are stored in the same (sorted) order as the one used by the regular datasets.
+    Returns the number of packed images.
+    """
+    paths = sorted(make_dataset(dir, max_dataset_size))
+    if not os.path.exists(packed_dir):
+        os.makedirs(packed_dir)
+    shard_bytes = shard_size * 1024 * 1024
+
+    shards, entries = [], []
+    shard_file = None
+    offset = 0
+    for path in paths:
+        img = np.asarray(Image.open(path).convert('RGB'), dtype=np.uint8)
+        if shard_file is None or (offset > 0 and offset + img.nbytes > shard_bytes):
+            if shard_file is not None:
+                shard_file.close()
+            shards.append(SHARD_NAME % len(shards))
+            shard_file = open(os.path.join(packed_dir, shards[-1]), 'wb')
+            offset = 0
+        shard_file.write(np.ascontiguousarray(img).tobytes())
+        entries.append([len(shards) - 1, offset, img.shape[0], img.shape[1]])
+        offset += img.nbytes
+    if shard_file is not None:
+        shard_file.close()
+
+    # write the index last, so that an interrupted packing never looks complete
+    index_path = os.path.join(packed_dir, INDEX_NAME)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump({'shards': shards, 'paths': paths, 'entries': entries}, f)
+    os.replace(index_path + '.tmp', index_path)
+    return len(paths)
+
+
+class PackedImageFolder():
+    """Read-only random access to the images of a packed folder.
+
+    The shards are memory-mapped lazily, on first access, so that every DataLoader worker maps them itself
+    (with both 'fork' and 'spawn' start methods) while the operating system shares the underlying pages.
+    """
+
+    def __init__(self, packed_dir, max_dataset_size=float("inf")):
+        """Load the index of a packed folder.
+
+        Parameters:
+            packed_dir (str)        -- a directory written by <pack_folder>
+            max_dataset_size (int)  -- the maximum number of images to expose
+        """
+        index_path = os.path.join(packed_dir, INDEX_NAME)
+        assert os.path.isfile(index_path), '%s is not a packed folder (missing %s); see datasets/pack_dataset.py' % (packed_dir, INDEX_NAME)
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        size = min(max_dataset_size, len(index['paths']))
+        self.packed_dir = packed_dir
+        self.shard_names = index['shards']
+        self.paths = index['paths'][:size]
+        self.entries = index['entries'][:size]
+        self.shards = None
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shards'] = None  # memory maps are re-opened in each worker
+        return state
+
+    def get_array(self, index):
+        """Return the image <index> as a read-only (H x W x 3) uint8 view on the memory-mapped shard."""
+        if self.shards is None:
+            self.shards = [np.memmap(os.path.join(self.packed_dir, name), dtype=np.uint8, mode='r')
+                           for name in self.shard_names]
+        shard, offset, h, w = self.entries[index]
+        return self.shards[shard][offset:offset + h * w * 3].reshape(h, w, 3)
+
+    def get_image(self, index):
+        """Return the image <index> as an RGB PIL image."""
+        return Image.fromarray(self.get_array(index))
@@ -0,0 +1,115 @@
+"""This module implements a sampler that pairs the images of the two domains of unaligned datasets.
+
+Instead of drawing the B image with random.randint inside <__getitem__> (which depends on the random state of every
+data loading worker), the sampler draws the (index_A, index_B) pairs of a whole epoch in the main process,
+from a generator seeded with --pair_seed and the epoch. The pairs are therefore reproducible, and they can be split
+between the processes of a multi-process training.
+
+Both domains are iterated by random permutations: within an epoch of max(A_size, B_size) pairs, every image of the
+smaller domain is used either floor or ceil(max / size) times. The B images are chosen with --pair_sampling:
+    uniform    -- every B image equally often
+    balanced   -- every class of B images equally often (the images of rare classes are repeated)
+    stratified -- every class in proportion to its size, spread evenly over the epoch (every batch holds about the
+                  proportions of the dataset)
+The classes of the B images are given by the dataset (see <BaseDataset.get_B_classes>).
+"""
+import math
+import torch
+import torch.utils.data
+
+
+class PairSampler(torch.utils.data.Sampler):
+    """Sampler of (index_A, index_B) pairs for unaligned datasets"""
+
+    def __init__(self, A_size, B_size, mode='uniform', B_classes=None, serial=False, seed=0, num_replicas=1, rank=0):
+        """Initialize the sampler
+
+        Parameters:
+            A_size (int)       -- the number of A images
+            B_size (int)       -- the number of B images
+            mode (str)         -- how the B images are drawn: uniform | balanced | stratified
+            B_classes (list)   -- the class of every B image; needed by the balanced and stratified modes
+            serial (bool)      -- if True, pair the images in order (index % A_size, index % B_size), as with --serial_batches
+            seed (int)         -- the seed of the random pairs, shared by all the processes
+            num_replicas (int) -- the number of processes of a multi-process training
+            rank (int)         -- the rank of this process
+        """
+        if mode not in ('uniform', 'balanced', 'stratified'):
+            raise ValueError('unknown pair sampling mode [%s]' % mode)
+        if mode != 'uniform' and not serial:
+            if B_classes is None:
+                raise ValueError('--pair_sampling %s needs the classes of the B images' % mode)
+            assert len(B_classes) == B_size, 'got %d B classes for %d B images' % (len(B_classes), B_size)
+        self.A_size = A_size
+        self.B_size = B_size
+        self.mode = mode
+        self.B_classes = torch.as_tensor(B_classes) if B_classes is not None else None
+        self.serial = serial
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.num_samples = math.ceil(max(A_size, B_size) / num_replicas)  # the last pairs are repeated to give every process the same number
+
+    def set_sizes(self, A_size, B_size):
+        """Update the number of images of both domains, e.g., while the dataset is still being scanned"""
+        self.A_size = A_size
+        self.B_size = B_size
+        self.num_samples = math.ceil(max(A_size, B_size) / self.num_replicas)
+
+    def set_epoch(self, epoch):
+        """Set the epoch, which changes the pairs drawn by the sampler"""
+        self.epoch = epoch
+
+    def __len__(self):
+        """Return the number of pairs drawn by this process at every epoch"""
+        return self.num_samples
+
+    def __iter__(self):
+        """Return the (index_A, index_B) pairs of this epoch, for this process"""
+        total = self.num_samples * self.num_replicas
+        if self.serial:
+            index_A = torch.arange(total) % self.A_size
+            index_B = torch.arange(total) % self.B_size
+        else:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            index_A = _permutations(self.A_size, total, generator)
+            if self.mode == 'uniform':
+                index_B = _permutations(self.B_size, total, generator)
+            else:
+                index_B = self._sample_B_by_class(total, generator)
+        shard = slice(self.rank, total, self.num_replicas)
+        return iter(zip(index_A[shard].tolist(), index_B[shard].tolist()))
+
+    def _sample_B_by_class(self, total, generator):
+        """Draw <total> B indices with the balanced or stratified mode."""
+        classes, class_ids = torch.unique(self.B_classes, return_inverse=True)
+        num_classes = len(classes)
+        members = [torch.nonzero(class_ids == c).flatten() for c in range(num_classes)]
+        index_B = torch.empty(total, dtype=torch.long)
+        if self.mode == 'balanced':  # draw a class uniformly for every pair, then an image of the class
+            pair_class = torch.randint(0, num_classes, (total,), generator=generator)
+            for c in range(num_classes):
+                where = torch.nonzero(pair_class == c).flatten()
+                index_B[where] = members[c][_permutations(len(members[c]), len(where), generator)]
+            return index_B
+        # stratified: split <total> in proportion to the class sizes (largest remainders),
+        # and place the k-th of the n images of a class at about (k + u) / n of the epoch
+        quotas = torch.tensor([len(m) for m in members], dtype=torch.float64) * total / self.B_size
+        counts = quotas.floor().long()
+        remainders = torch.argsort(quotas - counts, descending=True)[:total - int(counts.sum())]
+        counts[remainders] += 1
+        images, positions = [], []
+        for c in range(num_classes):
+            n = int(counts[c])
+            images.append(members[c][_permutations(len(members[c]), n, generator)])
+            positions.append((torch.arange(n, dtype=torch.float64) + torch.rand(n, generator=generator, dtype=torch.float64)) / max(n, 1))
+        return torch.cat(images)[torch.argsort(torch.cat(positions))]
+
+
+def _permutations(n, total, generator):
+    """Return <total> indices in [0, n), made of successive random permutations of range(n)."""
+    if total == 0:
+        return torch.empty(0, dtype=torch.long)
+    return torch.cat([torch.randperm(n, generator=generator) for _ in range(math.ceil(total / n))])[:total]
@@ -1,6 +1,4 @@
-from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import make_dataset
-from PIL import Image
+from data.base_dataset import BaseDataset, get_params, get_transform, to_uint8_tensor, BatchedTransform
 
 
 class SingleDataset(BaseDataset):
@@ -16,9 +14,11 @@ class SingleDataset(BaseDataset):
             opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
         """
         BaseDataset.__init__(self, opt)
-        self.A_paths = sorted(make_dataset(opt.dataroot, opt.max_dataset_size))
+        self.A_paths = self.find_images(opt.dataroot)
         input_nc = self.opt.output_nc if self.opt.direction == 'BtoA' else self.opt.input_nc
         self.transform = get_transform(opt, grayscale=(input_nc == 1))
+        if opt.batched_augment:
+            self.batched_transforms = {'A': BatchedTransform(opt, grayscale=(input_nc == 1))}
 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
@@ -31,7 +31,9 @@ class SingleDataset(BaseDataset):
             A_paths(str) - - the path of the image
         """
         A_path = self.A_paths[index]
-        A_img = Image.open(A_path).convert('RGB')
+        A_img = self.load_image(A_path)
+        if self.opt.batched_augment:  # the transformation is applied later to the whole batch
+            return {'A': to_uint8_tensor(A_img), 'A_paths': A_path, 'A_params': get_params(self.opt, A_img.size)}
         A = self.transform(A_img)
         return {'A': A, 'A_paths': A_path}
 
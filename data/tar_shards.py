@@ -0,0 +1,278 @@
+"""Sequential tar shards of samples, for streaming datasets ('--dataset_mode unaligned_tar', 'aligned_tar', 'unaligned_labeled_mask_tar')
+
+Random access to millions of small files is the worst case for object stores, network file systems and spinning disks.
+A tar shard folder stores the samples of an image folder in a few large tar files (in the WebDataset style),
+which the streaming datasets read sequentially, shuffling the samples with a buffer (--shuffle_buffer).
+The shards are split between the processes of a multi-process training and between the data loading workers.
+
+Layout of a tar shard folder:
+    <shard_dir>/shards.json         -- shard names and number of samples per shard
+    <shard_dir>/shard_00000.tar     -- samples stored as consecutive members sharing a key, e.g.,
+                                       00000000.img.jpg (the original image file), 00000000.label.png (its mask),
+                                       00000000.path (the original image path)
+    <shard_dir>/shard_00001.tar
+    ...
+Shard folders are written by <write_tar_shards> (see datasets/make_tar_shards.py).
+"""
+import io
+import os
+import math
+import json
+import random
+import tarfile
+import torch.utils.data
+from PIL import Image
+from data.base_dataset import BaseDataset
+from util.distributed import get_rank, get_world_size
+
+INDEX_NAME = 'shards.json'
+SHARD_NAME = 'shard_%05d.tar'
+
+
+def write_tar_shards(samples, shard_dir, shard_size=256):
+    """Write samples into a tar shard folder.
+
+    Parameters:
+        samples (iterable) -- the samples, as dictionaries {suffix: bytes} (e.g., {'img.jpg': ..., 'path': ...})
+        shard_dir (str)    -- the output directory (e.g., /path/to/data/trainA_tar)
+        shard_size (int)   -- the maximum size of a shard file, in MB
+
+    Returns the number of samples.
+    """
+    if not os.path.exists(shard_dir):
+        os.makedirs(shard_dir)
+    shard_bytes = shard_size * 1024 * 1024
+    shards, counts = [], []
+    tar, size = None, 0
+    for i, sample in enumerate(samples):
+        sample_bytes = sum(len(data) for data in sample.values())
+        if tar is None or (counts[-1] > 0 and size + sample_bytes > shard_bytes):
+            if tar is not None:
+                tar.close()
+            shards.append(SHARD_NAME % len(shards))
+            counts.append(0)
+            tar = tarfile.open(os.path.join(shard_dir, shards[-1]), 'w')
+            size = 0
+        for suffix, data in sample.items():
+            info = tarfile.TarInfo('%08d.%s' % (i, suffix))
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        counts[-1] += 1
+        size += sample_bytes
+    if tar is not None:
+        tar.close()
+
+    # write the index last, so that an interrupted conversion never looks complete
+    index_path = os.path.join(shard_dir, INDEX_NAME)
+    with open(index_path + '.tmp', 'w') as f:
+        json.dump({'shards': shards, 'counts': counts}, f)
+    os.replace(index_path + '.tmp', index_path)
+    return sum(counts)
+
+
+def read_tar_shard(path):
+    """Yield the samples of a tar shard, as dictionaries {suffix: bytes}, reading the file sequentially."""
+    sample, key = {}, None
+    with tarfile.open(path, 'r|') as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            name = os.path.basename(member.name)
+            member_key, _, suffix = name.partition('.')
+            if member_key != key and sample:
+                yield sample
+                sample = {}
+            key = member_key
+            sample[suffix] = tar.extractfile(member).read()
+    if sample:
+        yield sample
+
+
+def shuffle_samples(samples, buffer_size, rng):
+    """Shuffle a stream of samples with a buffer of <buffer_size> samples."""
+    buffer = []
+    for sample in samples:
+        if len(buffer) < buffer_size:
+            buffer.append(sample)
+            continue
+        j = rng.randrange(buffer_size)
+        yield buffer[j]
+        buffer[j] = sample
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+class TarShardFolder():
+    """The index of a tar shard folder, and the split of its samples between the processes and data loading workers."""
+
+    def __init__(self, shard_dir, max_dataset_size=float("inf")):
+        """Load the index of a tar shard folder.
+
+        Parameters:
+            shard_dir (str)         -- a directory written by <write_tar_shards>
+            max_dataset_size (int)  -- the maximum number of samples to read
+        """
+        index_path = os.path.join(shard_dir, INDEX_NAME)
+        assert os.path.isfile(index_path), '%s is not a tar shard folder (missing %s); see datasets/make_tar_shards.py' % (shard_dir, INDEX_NAME)
+        with open(index_path, 'r') as f:
+            index = json.load(f)
+        self.shard_dir = shard_dir
+        self.shards, self.counts = [], []
+        for name, count in zip(index['shards'], index['counts']):  # keep the first <max_dataset_size> samples
+            count = min(count, max_dataset_size - sum(self.counts))
+            if count <= 0:
+                break
+            self.shards.append(name)
+            self.counts.append(count)
+        assert len(self) > 0, '%s has no samples (with --max_dataset_size %s)' % (shard_dir, max_dataset_size)
+
+    def __len__(self):
+        return sum(self.counts)
+
+    def split(self, order, num_units):
+        """Return the part of the samples read by every unit (a data loading worker of a process).
+
+        Parameters:
+            order (list)    -- the order of the shards in this epoch
+            num_units (int) -- the number of units (number of processes x number of data loading workers)
+
+        Returns a list of (shards, offset, stride, count) per unit: the unit reads the samples offset, offset + stride, ...
+        of the shards <shards>, i.e., <count> samples. Units read whole shards when there are enough shards,
+        otherwise they all read all the shards and keep every <num_units>-th sample.
+        """
+        if len(order) >= num_units:
+            return [(order[u::num_units], 0, 1, sum(self.counts[s] for s in order[u::num_units])) for u in range(num_units)]
+        total = len(self)
+        if total >= num_units:
+            return [(order, u, num_units, len(range(u, total, num_units))) for u in range(num_units)]
+        return [(order, 0, 1, total)] * num_units  # fewer samples than units: every unit reads them all
+
+    def read(self, shards, offset=0, stride=1):
+        """Yield the samples offset, offset + stride, ... of <shards>."""
+        i = 0
+        for s in shards:
+            for j, sample in enumerate(read_tar_shard(os.path.join(self.shard_dir, self.shards[s]))):
+                if j >= self.counts[s]:
+                    break
+                if i >= offset and (i - offset) % stride == 0:
+                    yield sample
+                i += 1
+
+
+def decode_image(data, mode='RGB'):
+    """Decode an image file stored in a shard."""
+    img = Image.open(io.BytesIO(data))
+    return img.convert(mode) if mode else img
+
+
+class TarShardDataset(BaseDataset, torch.utils.data.IterableDataset):
+    """A base class for streaming datasets reading tar shard folders.
+
+    A subclass opens its shard folders in <self.folders> (a dictionary {name: TarShardFolder}) and implements
+    <make_item>, which turns a dictionary {name: sample} (one sample of every folder) into a data point.
+    Every epoch, the shards are shuffled, split between the processes and the data loading workers, read sequentially
+    and shuffled with a buffer. The epoch goes through the largest folder; the other ones are cycled.
+    In a multi-process training, every process yields the same number of full batches (repeating a few samples if needed),
+    so that no process waits for the others.
+    """
+
+    def __init__(self, opt):
+        """Initialize the class; save the options and the rank of this process
+
+        Parameters:
+            opt (Option class)-- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        BaseDataset.__init__(self, opt)
+        self.folders = {}
+        self.epoch = 0
+        self.rank = get_rank()
+        self.world_size = get_world_size()
+
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        """Add the options of the streaming datasets."""
+        parser.add_argument('--shuffle_buffer', type=int, default=1000, help='number of samples of the buffer shuffling the stream of samples of every data loading worker')
+        parser.add_argument('--shard_seed', type=int, default=0, help='seed of the order of the shards (combined with the epoch)')
+        return parser
+
+    def make_item(self, samples):
+        """Return a data point, given a dictionary {folder name: sample}."""
+        raise NotImplementedError
+
+    def set_epoch(self, epoch):
+        """Set the epoch, which changes the order of the shards and of the samples"""
+        self.epoch = epoch
+
+    def _plan(self, num_workers):
+        """Return the splits of every folder and the number of samples of every unit, for this epoch."""
+        rng = random.Random(self.opt.shard_seed * 1000003 + self.epoch)  # the same order in every process and worker
+        num_units = self.world_size * num_workers
+        splits = {}
+        for name, folder in self.folders.items():
+            order = list(range(len(folder.shards)))
+            if not self.opt.serial_batches:
+                rng.shuffle(order)
+            splits[name] = folder.split(order, num_units)
+        counts = [max(split[u][3] for split in splits.values()) for u in range(num_units)]
+        if self.world_size > 1:  # give every process the same number of full batches; the units cycle through their samples to fill them
+            batches = [math.ceil(count / self.opt.batch_size) for count in counts]
+            per_process = max(sum(batches[r * num_workers:(r + 1) * num_workers]) for r in range(self.world_size))
+            for r in range(self.world_size):
+                for k in range(per_process - sum(batches[r * num_workers:(r + 1) * num_workers])):
+                    batches[r * num_workers + k % num_workers] += 1
+            counts = [b * self.opt.batch_size for b in batches]
+        return splits, counts
+
+    def __len__(self):
+        """Return the number of samples read by this process in an epoch"""
+        num_workers = max(1, int(self.opt.num_threads))
+        _, counts = self._plan(num_workers)
+        return sum(counts[self.rank * num_workers:(self.rank + 1) * num_workers])
+
+    def __getitem__(self, index):
+        raise TypeError('dataset [%s] is a streaming dataset; it can only be iterated' % type(self).__name__)
+
+    def __iter__(self):
+        """Yield the data points of this data loading worker"""
+        info = torch.utils.data.get_worker_info()
+        num_workers, worker_id = (info.num_workers, info.id) if info is not None else (1, 0)
+        unit = self.rank * num_workers + worker_id
+        splits, counts = self._plan(num_workers)
+        rng = random.Random((self.opt.shard_seed * 1000003 + self.epoch) * 1009 + unit)
+        streams = {name: self._cycle(self.folders[name], splits[name][unit], rng) for name in self.folders}
+        for _ in range(counts[unit]):
+            yield self.make_item({name: next(stream) for name, stream in streams.items()})
+
+    def _cycle(self, folder, split, rng):
+        """Yield the samples of a unit, shuffled, again and again."""
+        shards, offset, stride, count = split
+        while count > 0:
+            samples = folder.read(shards, offset, stride)
+            yield from samples if self.opt.serial_batches else shuffle_samples(samples, self.opt.shuffle_buffer, rng)
+
+
+def image_folder_samples(paths):
+    """Yield the samples of images, as stored by the streaming datasets: the image file and its path."""
+    for path in paths:
+        with open(path, 'rb') as f:
+            data = f.read()
+        yield {'img' + os.path.splitext(path)[1].lower(): data, 'path': path.encode()}
+
+
+def labeled_mask_samples(img_paths, label_paths):
+    """Yield the samples of images and their masks, as stored by the streaming datasets."""
+    for img_path, label_path in zip(img_paths, label_paths):
+        with open(img_path, 'rb') as f:
+            img = f.read()
+        with open(label_path, 'rb') as f:
+            label = f.read()
+        yield {'img' + os.path.splitext(img_path)[1].lower(): img, 'label' + os.path.splitext(label_path)[1].lower(): label,
+               'path': img_path.encode()}
+
+
+def get_sample_file(sample, prefix):
+    """Return the file of a sample whose suffix starts with <prefix> (e.g., 'img' for 'img.jpg')."""
+    for suffix, data in sample.items():
+        if suffix.split('.')[0] == prefix:
+            return data
+    raise KeyError('no %s file in the sample (found %s)' % (prefix, ', '.join(sample)))
@@ -1,8 +1,6 @@
 import os.path
-from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import make_dataset
-from PIL import Image
-import random
+from data.base_dataset import BaseDataset, get_params, get_transform, to_uint8_tensor, BatchedTransform
+from data.image_folder import make_dir_classes
 
 
 class UnalignedDataset(BaseDataset):
@@ -26,8 +24,8 @@ class UnalignedDataset(BaseDataset):
         self.dir_A = os.path.join(opt.dataroot, opt.phase + 'A')  # create a path '/path/to/data/trainA'
         self.dir_B = os.path.join(opt.dataroot, opt.phase + 'B')  # create a path '/path/to/data/trainB'
 
-        self.A_paths = sorted(make_dataset(self.dir_A, opt.max_dataset_size))   # load images from '/path/to/data/trainA'
-        self.B_paths = sorted(make_dataset(self.dir_B, opt.max_dataset_size))    # load images from '/path/to/data/trainB'
+        self.A_paths = self.find_images(self.dir_A)   # load images from '/path/to/data/trainA'
+        self.B_paths = self.find_images(self.dir_B)   # load images from '/path/to/data/trainB'
         self.A_size = len(self.A_paths)  # get the size of dataset A
         self.B_size = len(self.B_paths)  # get the size of dataset B
         btoA = self.opt.direction == 'BtoA'
@@ -35,12 +33,15 @@ class UnalignedDataset(BaseDataset):
         output_nc = self.opt.input_nc if btoA else self.opt.output_nc      # get the number of channels of output image
         self.transform_A = get_transform(self.opt, grayscale=(input_nc == 1))
         self.transform_B = get_transform(self.opt, grayscale=(output_nc == 1))
+        if opt.batched_augment:
+            self.batched_transforms = {'A': BatchedTransform(self.opt, grayscale=(input_nc == 1)),
+                                       'B': BatchedTransform(self.opt, grayscale=(output_nc == 1))}
 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
 
         Parameters:
-            index (int)      -- a random integer for data indexing
+            index            -- an (index_A, index_B) pair, or an integer (see <get_pair_indices>)
 
         Returns a dictionary that contains A, B, A_paths and B_paths
             A (tensor)       -- an image in the input domain
@@ -48,14 +49,14 @@ class UnalignedDataset(BaseDataset):
             A_paths (str)    -- image paths
             B_paths (str)    -- image paths
         """
-        A_path = self.A_paths[index % self.A_size]  # make sure index is within then range
-        if self.opt.serial_batches:   # make sure index is within then range
-            index_B = index % self.B_size
-        else:   # randomize the index for domain B to avoid fixed pairs.
-            index_B = random.randint(0, self.B_size - 1)
+        index_A, index_B = self.get_pair_indices(index)
+        A_path = self.A_paths[index_A]
         B_path = self.B_paths[index_B]
-        A_img = Image.open(A_path).convert('RGB')
-        B_img = Image.open(B_path).convert('RGB')
+        A_img = self.load_image(A_path)
+        B_img = self.load_image(B_path)
+        if self.opt.batched_augment:  # the transformation is applied later to the whole batch
+            return {'A': to_uint8_tensor(A_img), 'B': to_uint8_tensor(B_img), 'A_paths': A_path, 'B_paths': B_path,
+                    'A_params': get_params(self.opt, A_img.size), 'B_params': get_params(self.opt, B_img.size)}
         # apply image transformation
         A = self.transform_A(A_img)
         B = self.transform_B(B_img)
@@ -69,3 +70,12 @@ class UnalignedDataset(BaseDataset):
         we take a maximum of
         """
         return max(self.A_size, self.B_size)
+
+    def get_B_classes(self):
+        """Return the class of every B image: the name of its subdirectory of trainB."""
+        return make_dir_classes(self.B_paths)
+
+    def refresh(self):
+        """Update the sizes of the image lists still being scanned with --stream_dataset."""
+        self.A_size = len(self.A_paths)
+        self.B_size = len(self.B_paths)
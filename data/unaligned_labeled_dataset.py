@@ -1,9 +1,7 @@
 import os.path
 #import torchvision.transforms as transforms
 from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import make_dataset, make_labeled_dataset
-from PIL import Image
-import random
+from data.image_folder import make_labeled_dataset, make_dir_classes
 import numpy as np
 
 class UnalignedLabeledDataset(BaseDataset):
@@ -31,12 +29,12 @@ class UnalignedLabeledDataset(BaseDataset):
         self.dir_B = os.path.join(opt.dataroot, opt.phase + 'B')  # create a path '/path/to/data/trainB'
 
         
-        self.A_paths, self.A_label = make_labeled_dataset(self.dir_A, opt.max_dataset_size)   # load images from '/path/to/data/trainA' as well as labels
+        self.A_paths, self.A_label = make_labeled_dataset(self.dir_A, opt.max_dataset_size, opt.dataset_manifest_dir)   # load images from '/path/to/data/trainA' as well as labels
         #print('A_labels list',self.A_label)
         self.A_label = np.array(self.A_label)
         
         #print('A_label',self.A_label)
-        self.B_paths = sorted(make_dataset(self.dir_B, opt.max_dataset_size))    # load images from '/path/to/data/trainB'
+        self.B_paths = self.find_images(self.dir_B)    # load images from '/path/to/data/trainB'
         self.A_size = len(self.A_paths)  # get the size of dataset A
         self.B_size = len(self.B_paths)  # get the size of dataset B
         btoA = self.opt.direction == 'BtoA'
@@ -49,7 +47,7 @@ class UnalignedLabeledDataset(BaseDataset):
         """Return a data point and its metadata information.
 
         Parameters:
-            index (int)      -- a random integer for data indexing
+            index            -- an (index_A, index_B) pair, or an integer (see <get_pair_indices>)
 
         Returns a dictionary that contains A, B, A_paths and B_paths
             A (tensor)       -- an image in the input domain
@@ -57,19 +55,16 @@ class UnalignedLabeledDataset(BaseDataset):
             A_paths (str)    -- image paths
             B_paths (str)    -- image paths
         """
-        A_path = self.A_paths[index % self.A_size]  # make sure index is within then range
-        if self.opt.serial_batches:   # make sure index is within then range
-            index_B = index % self.B_size
-        else:   # randomize the index for domain B to avoid fixed pairs.
-            index_B = random.randint(0, self.B_size - 1)
+        index_A, index_B = self.get_pair_indices(index)
+        A_path = self.A_paths[index_A]
         B_path = self.B_paths[index_B]
-        A_img = Image.open(A_path).convert('RGB')
-        B_img = Image.open(B_path).convert('RGB')
+        A_img = self.load_image(A_path)
+        B_img = self.load_image(B_path)
         # apply image transformation
         A = self.transform_A(A_img)
         B = self.transform_B(B_img)
         # get labels
-        A_label = self.A_label[index]
+        A_label = self.A_label[index_A]
 
         return {'A': A, 'B': B, 'A_paths': A_path, 'B_paths': B_path, 'A_label': A_label}
 
@@ -80,3 +75,11 @@ class UnalignedLabeledDataset(BaseDataset):
         we take a maximum of
         """
         return max(self.A_size, self.B_size)
+
+    def get_B_classes(self):
+        """Return the class of every B image: the name of its subdirectory of trainB."""
+        return make_dir_classes(self.B_paths)
+
+    def refresh(self):
+        """Update the size of the B image list still being scanned with --stream_dataset."""
+        self.B_size = len(self.B_paths)
@@ -1,8 +1,7 @@
 import os.path
 from data.base_dataset import BaseDataset, get_transform
-from data.image_folder import  make_labeled_mask_dataset, make_dataset_path
+from data.image_folder import  make_labeled_mask_dataset, make_dataset_path, make_dir_classes
 from PIL import Image
-import random
 import numpy as np
 import torchvision.transforms as transforms
 import torch
@@ -48,7 +47,7 @@ class UnalignedLabeledMask2Dataset(BaseDataset):
         """Return a data point and its metadata information.
 
         Parameters:
-            index (int)      -- a random integer for data indexing
+            index            -- an (index_A, index_B) pair, or an integer (see <get_pair_indices>)
 
         Returns a dictionary that contains A, B, A_paths and B_paths
             A (tensor)       -- an image in the input domain
@@ -58,13 +57,9 @@ class UnalignedLabeledMask2Dataset(BaseDataset):
             A_label (tensor) -- mask label of image A
         """
     
-        A_img_path = self.A_img_paths[index % self.A_size]  # make sure index is within then range
-        A_label_path = self.A_label_paths[index % self.A_size]
-        
-        if self.opt.serial_batches:   # make sure index is within then range
-            index_B = index % self.B_size
-        else:   # randomize the index for domain B to avoid fixed pairs.
-            index_B = random.randint(0, self.B_size - 1)
+        index_A, index_B = self.get_pair_indices(index)
+        A_img_path = self.A_img_paths[index_A]
+        A_label_path = self.A_label_paths[index_A]
             
         B_img_path = self.B_img_paths[index_B]
 #        B_label_path = self.B_label_paths[index_B]# % self.B_size]
@@ -100,3 +95,7 @@ class UnalignedLabeledMask2Dataset(BaseDataset):
         we take a maximum of
         """
         return max(self.A_size, self.B_size)
+
+    def get_B_classes(self):
+        """Return the class of every B image: the name of its subdirectory of trainB."""
+        return make_dir_classes(self.B_img_paths)
@@ -1,8 +1,7 @@
 import os.path
-from data.base_dataset import BaseDataset, get_transform, get_transform_seg
-from data.image_folder import make_dataset, make_labeled_mask_dataset, make_dataset_path
+from data.base_dataset import BaseDataset, get_transform, get_transform_seg, get_seg_params, to_uint8_tensor, mask_to_tensor, BatchedMaskTransform
+from data.image_folder import make_dataset, make_labeled_mask_dataset, make_dataset_path, make_labeled_mask_bbox_index, make_dir_classes
 from PIL import Image
-import random
 import numpy as np
 import torchvision.transforms as transforms
 import torch
@@ -22,6 +21,20 @@ class UnalignedLabeledMaskDataset(BaseDataset):
     '/path/to/data/testA' and '/path/to/data/testB' during test time.
     """
 
+    @staticmethod
+    def modify_commandline_options(parser, is_train):
+        """Add new dataset-specific options.
+
+        Parameters:
+            parser          -- original option parser
+            is_train (bool) -- whether training phase or test phase. You can use this flag to add training-specific or test-specific options.
+
+        Returns:
+            the modified parser.
+        """
+        parser.add_argument('--mask_bbox_index', action='store_true', help='index the bounding boxes of the masks once (stored next to paths.txt) and return them as A_bbox/B_bbox, updated for the sampled crop, flip and rotation')
+        return parser
+
     def __init__(self, opt):
         """Initialize this dataset class.
 
@@ -37,23 +50,29 @@ class UnalignedLabeledMaskDataset(BaseDataset):
         
         self.dir_A = os.path.join(opt.dataroot, opt.phase + 'A')  # create a path '/path/to/data/trainA'
         self.dir_B = os.path.join(opt.dataroot, opt.phase + 'B')  # create a path '/path/to/data/trainB'
-        if os.path.exists(self.dir_A):
-            self.A_img_paths, self.A_label_paths = make_labeled_mask_dataset(self.dir_A,'/paths.txt', opt.max_dataset_size)   # load images from '/path/to/data/trainA/paths.txt' as well as labels
-        else:
-            self.A_img_paths, self.A_label_paths = make_labeled_mask_dataset(opt.dataroot,'/paths.txt', opt.max_dataset_size)   # load images from '/path/to/data/trainA/paths.txt' as well as labels
+        if not os.path.exists(self.dir_A):
+            self.dir_A = opt.dataroot
+        self.A_img_paths, self.A_label_paths = make_labeled_mask_dataset(self.dir_A,'/paths.txt', opt.max_dataset_size)   # load images from '/path/to/data/trainA/paths.txt' as well as labels
         self.A_size = len(self.A_img_paths)  # get the size of dataset A
+        if opt.mask_bbox_index:  # bounding boxes and class histograms of the masks, computed once
+            self.A_bboxes, self.A_label_hists = make_labeled_mask_bbox_index(self.dir_A, '/paths.txt', self.A_label_paths)
 
         if os.path.exists(self.dir_B):
             self.B_img_paths, self.B_label_paths = make_labeled_mask_dataset(self.dir_B,'/paths.txt', opt.max_dataset_size)    # load images from '/path/to/data/trainB'
             self.B_size = len(self.B_img_paths)  # get the size of dataset B
+            if opt.mask_bbox_index:
+                self.B_bboxes, self.B_label_hists = make_labeled_mask_bbox_index(self.dir_B, '/paths.txt', self.B_label_paths)
 
         self.transform=get_transform_seg(self.opt)
+        if opt.batched_augment:  # the images and their masks are transformed later, by batch
+            assert not opt.mask_bbox_index, '--mask_bbox_index is not supported with --batched_augment'
+            self.batched_transforms = {'A': BatchedMaskTransform(self.opt), 'B': BatchedMaskTransform(self.opt)}
                 
     def __getitem__(self, index):
         """Return a data point and its metadata information.
 
         Parameters:
-            index (int)      -- a random integer for data indexing
+            index            -- an (index_A, index_B) pair, or an integer (see <get_pair_indices>)
 
         Returns a dictionary that contains A, B, A_paths and B_paths
             A (tensor)       -- an image in the input domain
@@ -61,30 +80,47 @@ class UnalignedLabeledMaskDataset(BaseDataset):
             A_paths (str)    -- image paths
             B_paths (str)    -- image paths
             A_label (tensor) -- mask label of image A
+            A_bbox (tensor)  -- (xmin, ymin, xmax, ymax) bounding box of A_label, with --mask_bbox_index
         """
     
-        A_img_path = self.A_img_paths[index % self.A_size]  # make sure index is within then range
-        A_label_path = self.A_label_paths[index % self.A_size]
+        if hasattr(self, 'B_img_paths'):
+            index_A, index_B = self.get_pair_indices(index)
+        else:
+            index_A = index[0] if isinstance(index, (tuple, list)) else index % self.A_size
+        A_img_path = self.A_img_paths[index_A]
+        A_label_path = self.A_label_paths[index_A]
 
         A_img = Image.open(A_img_path).convert('RGB')
         A_label = Image.open(A_label_path)
-       
-        A,A_label = self.transform(A_img,A_label)
+
+        if self.opt.batched_augment:  # uint8 images and masks, with the params of their transformation
+            item = {'A': to_uint8_tensor(A_img), 'A_label': mask_to_tensor(A_label), 'A_paths': A_img_path,
+                    'A_params': get_seg_params(self.opt, A_img.size)}
+            if hasattr(self, 'B_img_paths'):
+                B_img = Image.open(self.B_img_paths[index_B]).convert('RGB')
+                item.update({'B': to_uint8_tensor(B_img), 'B_label': mask_to_tensor(Image.open(self.B_label_paths[index_B])),
+                             'B_paths': self.B_img_paths[index_B], 'B_params': get_seg_params(self.opt, B_img.size)})
+            return item
+
+        if self.opt.mask_bbox_index:
+            A, A_label, A_bbox = self.transform(A_img, A_label, self.A_bboxes[index_A])
+        else:
+            A,A_label = self.transform(A_img,A_label)
 
         if hasattr(self,'B_img_paths') :
-            if self.opt.serial_batches:   # make sure index is within then range
-                index_B = index % self.B_size
-            else:   # randomize the index for domain B to avoid fixed pairs.
-                index_B = random.randint(0, self.B_size - 1)
-            
             B_img_path = self.B_img_paths[index_B]
             B_label_path = self.B_label_paths[index_B]# % self.B_size]
             B_label = Image.open(B_label_path)
             B_img = Image.open(B_img_path).convert('RGB')
             
+            if self.opt.mask_bbox_index:
+                B, B_label, B_bbox = self.transform(B_img, B_label, self.B_bboxes[index_B])
+                return {'A': A, 'B': B, 'A_paths': A_img_path, 'B_paths': B_img_path, 'A_label': A_label, 'B_label': B_label, 'A_bbox': A_bbox, 'B_bbox': B_bbox}
             B,B_label = self.transform(B_img,B_label)
         
             return {'A': A, 'B': B, 'A_paths': A_img_path, 'B_paths': B_img_path, 'A_label': A_label, 'B_label': B_label}
+        elif self.opt.mask_bbox_index:
+            return {'A': A, 'A_paths': A_img_path, 'A_label': A_label, 'A_bbox': A_bbox}
         else:
             return {'A': A, 'A_paths': A_img_path,'A_label': A_label}
 
@@ -98,3 +134,10 @@ class UnalignedLabeledMaskDataset(BaseDataset):
             return max(self.A_size, self.B_size)
         else:
             return self.A_size
+
+    def get_B_classes(self):
+        """Return the class of every B image: the most frequent non-zero class of its mask with --mask_bbox_index
+        (0 for empty masks), the name of its subdirectory otherwise."""
+        if self.opt.mask_bbox_index:
+            return [int(np.argmax(hist[1:])) + 1 if sum(hist[1:]) > 0 else 0 for hist in self.B_label_hists]
+        return make_dir_classes(self.B_img_paths)
@@ -0,0 +1,57 @@
+import os.path
+from data.base_dataset import get_transform_seg, get_seg_params, to_uint8_tensor, mask_to_tensor, BatchedMaskTransform
+from data.tar_shards import TarShardDataset, TarShardFolder, decode_image, get_sample_file
+
+
+class UnalignedLabeledMaskTarDataset(TarShardDataset):
+    """
+    This dataset class streams unaligned/unpaired datasets with mask labels from tar shards.
+
+    It is the streaming counterpart of 'unaligned_labeled_mask' dataset: it requires the tar shard folders
+    '/path/to/data/trainA_tar' and (optionally) '/path/to/data/trainB_tar' of the images and masks listed in
+    '/path/to/data/trainA/paths.txt' and '/path/to/data/trainB/paths.txt', created once with
+        python datasets/make_tar_shards.py --dataroot /path/to/data --folders trainA trainB
+    You can train the model with the dataset flag '--dataroot /path/to/data --dataset_mode unaligned_labeled_mask_tar'.
+    """
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        TarShardDataset.__init__(self, opt)
+        self.dir_A = os.path.join(opt.dataroot, opt.phase + 'A_tar')  # create a path '/path/to/data/trainA_tar'
+        self.dir_B = os.path.join(opt.dataroot, opt.phase + 'B_tar')  # create a path '/path/to/data/trainB_tar'
+        self.folders = {'A': TarShardFolder(self.dir_A, opt.max_dataset_size)}
+        if os.path.exists(self.dir_B):
+            self.folders['B'] = TarShardFolder(self.dir_B, opt.max_dataset_size)
+        self.transform = get_transform_seg(self.opt)
+        if opt.batched_augment:  # the images and their masks are transformed later, by batch
+            self.batched_transforms = {name: BatchedMaskTransform(self.opt) for name in self.folders}
+
+    def make_item(self, samples):
+        """Return a data point and its metadata information.
+
+        Parameters:
+            samples (dict) -- a sample of the A (and B) shard folders
+
+        Returns a dictionary that contains A, B, A_paths, B_paths, A_label and B_label (B* only with a B folder)
+            A (tensor)       -- an image in the input domain
+            B (tensor)       -- an image in the target domain
+            A_paths (str)    -- original image paths
+            B_paths (str)    -- original image paths
+            A_label (tensor) -- mask label of image A
+            B_label (tensor) -- mask label of image B
+        """
+        item = {}
+        for domain, sample in samples.items():
+            img = decode_image(get_sample_file(sample, 'img'))
+            label = decode_image(get_sample_file(sample, 'label'), mode=None)
+            if self.opt.batched_augment:
+                item[domain], item[domain + '_label'] = to_uint8_tensor(img), mask_to_tensor(label)
+                item[domain + '_params'] = get_seg_params(self.opt, img.size)
+            else:
+                item[domain], item[domain + '_label'] = self.transform(img, label)
+            item[domain + '_paths'] = sample['path'].decode()
+        return item
@@ -0,0 +1,76 @@
+import os.path
+from data.base_dataset import BaseDataset, get_params, get_transform, to_uint8_tensor, BatchedTransform
+from data.packed_folder import PackedImageFolder
+from data.image_folder import make_dir_classes
+
+
+class UnalignedPackedDataset(BaseDataset):
+    """
+    This dataset class can load unaligned/unpaired datasets from packed, memory-mapped folders.
+
+    It is the packed counterpart of 'unaligned' dataset: it requires two packed folders
+    '/path/to/data/trainA_packed' and '/path/to/data/trainB_packed', created once with
+        python datasets/pack_dataset.py --dataroot /path/to/data --folders trainA trainB
+    You can train the model with the dataset flag '--dataroot /path/to/data --dataset_mode unaligned_packed'.
+    """
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        BaseDataset.__init__(self, opt)
+        self.dir_A = os.path.join(opt.dataroot, opt.phase + 'A_packed')  # create a path '/path/to/data/trainA_packed'
+        self.dir_B = os.path.join(opt.dataroot, opt.phase + 'B_packed')  # create a path '/path/to/data/trainB_packed'
+
+        self.A_images = PackedImageFolder(self.dir_A, opt.max_dataset_size)
+        self.B_images = PackedImageFolder(self.dir_B, opt.max_dataset_size)
+        self.A_size = len(self.A_images)  # get the size of dataset A
+        self.B_size = len(self.B_images)  # get the size of dataset B
+        btoA = self.opt.direction == 'BtoA'
+        input_nc = self.opt.output_nc if btoA else self.opt.input_nc       # get the number of channels of input image
+        output_nc = self.opt.input_nc if btoA else self.opt.output_nc      # get the number of channels of output image
+        self.transform_A = get_transform(self.opt, grayscale=(input_nc == 1))
+        self.transform_B = get_transform(self.opt, grayscale=(output_nc == 1))
+        if opt.batched_augment:
+            self.batched_transforms = {'A': BatchedTransform(self.opt, grayscale=(input_nc == 1)),
+                                       'B': BatchedTransform(self.opt, grayscale=(output_nc == 1))}
+
+    def __getitem__(self, index):
+        """Return a data point and its metadata information.
+
+        Parameters:
+            index            -- an (index_A, index_B) pair, or an integer (see <get_pair_indices>)
+
+        Returns a dictionary that contains A, B, A_paths and B_paths
+            A (tensor)       -- an image in the input domain
+            B (tensor)       -- its corresponding image in the target domain
+            A_paths (str)    -- original image paths
+            B_paths (str)    -- original image paths
+        """
+        index_A, index_B = self.get_pair_indices(index)
+        A_path = self.A_images.paths[index_A]
+        B_path = self.B_images.paths[index_B]
+        # read the images from the memory-mapped shards; no decoding needed
+        if self.opt.batched_augment:  # the transformation is applied later to the whole batch
+            A_array = self.A_images.get_array(index_A)
+            B_array = self.B_images.get_array(index_B)
+            return {'A': to_uint8_tensor(A_array), 'B': to_uint8_tensor(B_array), 'A_paths': A_path, 'B_paths': B_path,
+                    'A_params': get_params(self.opt, A_array.shape[1::-1]), 'B_params': get_params(self.opt, B_array.shape[1::-1])}
+        A = self.transform_A(self.A_images.get_image(index_A))
+        B = self.transform_B(self.B_images.get_image(index_B))
+
+        return {'A': A, 'B': B, 'A_paths': A_path, 'B_paths': B_path}
+
+    def __len__(self):
+        """Return the total number of images in the dataset.
+
+        As we have two datasets with potentially different number of images,
+        we take a maximum of
+        """
+        return max(self.A_size, self.B_size)
+
+    def get_B_classes(self):
+        """Return the class of every B image: the name of its subdirectory of trainB."""
+        return make_dir_classes(self.B_images.paths)
@@ -0,0 +1,58 @@
+import os.path
+from data.base_dataset import get_params, get_transform, to_uint8_tensor, BatchedTransform
+from data.tar_shards import TarShardDataset, TarShardFolder, decode_image, get_sample_file
+
+
+class UnalignedTarDataset(TarShardDataset):
+    """
+    This dataset class streams unaligned/unpaired datasets from tar shards.
+
+    It is the streaming counterpart of 'unaligned' dataset: it requires two tar shard folders
+    '/path/to/data/trainA_tar' and '/path/to/data/trainB_tar', created once with
+        python datasets/make_tar_shards.py --dataroot /path/to/data --folders trainA trainB
+    You can train the model with the dataset flag '--dataroot /path/to/data --dataset_mode unaligned_tar'.
+    The images of both domains are read in independent streams, so that they are paired at random.
+    """
+
+    def __init__(self, opt):
+        """Initialize this dataset class.
+
+        Parameters:
+            opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+        """
+        TarShardDataset.__init__(self, opt)
+        self.dir_A = os.path.join(opt.dataroot, opt.phase + 'A_tar')  # create a path '/path/to/data/trainA_tar'
+        self.dir_B = os.path.join(opt.dataroot, opt.phase + 'B_tar')  # create a path '/path/to/data/trainB_tar'
+        self.folders = {'A': TarShardFolder(self.dir_A, opt.max_dataset_size), 'B': TarShardFolder(self.dir_B, opt.max_dataset_size)}
+        btoA = self.opt.direction == 'BtoA'
+        input_nc = self.opt.output_nc if btoA else self.opt.input_nc       # get the number of channels of input image
+        output_nc = self.opt.input_nc if btoA else self.opt.output_nc      # get the number of channels of output image
+        self.transform_A = get_transform(self.opt, grayscale=(input_nc == 1))
+        self.transform_B = get_transform(self.opt, grayscale=(output_nc == 1))
+        if opt.batched_augment:
+            self.batched_transforms = {'A': BatchedTransform(self.opt, grayscale=(input_nc == 1)),
+                                       'B': BatchedTransform(self.opt, grayscale=(output_nc == 1))}
+
+    def make_item(self, samples):
+        """Return a data point and its metadata information.
+
+        Parameters:
+            samples (dict) -- a sample of the A and B shard folders
+
+        Returns a dictionary that contains A, B, A_paths and B_paths
+            A (tensor)       -- an image in the input domain
+            B (tensor)       -- an image in the target domain
+            A_paths (str)    -- original image paths
+            B_paths (str)    -- original image paths
+        """
+        A_path = samples['A']['path'].decode()
+        B_path = samples['B']['path'].decode()
+        A_img = decode_image(get_sample_file(samples['A'], 'img'))
+        B_img = decode_image(get_sample_file(samples['B'], 'img'))
+        if self.opt.batched_augment:  # the transformation is applied later to the whole batch
+            return {'A': to_uint8_tensor(A_img), 'B': to_uint8_tensor(B_img), 'A_paths': A_path, 'B_paths': B_path,
+                    'A_params': get_params(self.opt, A_img.size), 'B_params': get_params(self.opt, B_img.size)}
+        A = self.transform_A(A_img)
+        B = self.transform_B(B_img)
+
+        return {'A': A, 'B': B, 'A_paths': A_path, 'B_paths': B_path}
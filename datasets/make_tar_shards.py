@@ -0,0 +1,44 @@
+"""Convert image folders into tar shards for '--dataset_mode unaligned_tar', 'aligned_tar' and 'unaligned_labeled_mask_tar'.
+
+Every folder /path/to/data/<folder> is written to /path/to/data/<folder>_tar. The image files are stored as they are
+(no decoding), in the same (sorted) order as the one used by the regular datasets.
+If the folder holds a 'paths.txt' file (the layout of the 'unaligned_labeled_mask' dataset, with one
+'<image path> <mask path>' line per image), the images and masks it lists are stored instead.
+
+Example:
+    CycleGAN (unaligned) data:
+        python datasets/make_tar_shards.py --dataroot ./datasets/maps --folders trainA trainB
+    pix2pix (aligned) data:
+        python datasets/make_tar_shards.py --dataroot ./datasets/facades --folders train
+    Images with masks (trainA/paths.txt, trainB/paths.txt):
+        python datasets/make_tar_shards.py --dataroot /path/to/data --folders trainA trainB
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # make the 'data' package importable
+from data.image_folder import make_dataset, make_labeled_mask_dataset  # noqa: E402
+from data.tar_shards import write_tar_shards, image_folder_samples, labeled_mask_samples  # noqa: E402
+
+parser = argparse.ArgumentParser('convert image folders into tar shards')
+parser.add_argument('--dataroot', type=str, required=True, help='path to images (should have subfolders trainA, trainB, train, etc)')
+parser.add_argument('--folders', type=str, nargs='+', default=['trainA', 'trainB'], help='subfolders of dataroot to convert')
+parser.add_argument('--shard_size', type=int, default=256, help='maximum size of a shard file, in MB')
+parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='maximum number of images converted per folder')
+args = parser.parse_args()
+
+for arg in vars(args):
+    print('[%s] = ' % arg, getattr(args, arg))
+
+for folder in args.folders:
+    dir = os.path.join(args.dataroot, folder)
+    shard_dir = os.path.join(args.dataroot, folder + '_tar')
+    if os.path.isfile(os.path.join(dir, 'paths.txt')):
+        img_paths, label_paths = make_labeled_mask_dataset(dir, '/paths.txt')
+        size = min(args.max_dataset_size, len(img_paths))
+        samples = labeled_mask_samples(img_paths[:size], label_paths[:size])
+    else:
+        samples = image_folder_samples(sorted(make_dataset(dir, args.max_dataset_size)))
+    num_samples = write_tar_shards(samples, shard_dir, args.shard_size)
+    print('folder = %s, wrote %d samples into %s' % (folder, num_samples, shard_dir))
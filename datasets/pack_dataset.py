@@ -0,0 +1,32 @@
+"""Pack image folders into memory-mapped shards for '--dataset_mode unaligned_packed' and '--dataset_mode aligned_packed'.
+
+Every folder /path/to/data/<folder> is decoded once and written to /path/to/data/<folder>_packed.
+
+Example:
+    CycleGAN (unaligned) data:
+        python datasets/pack_dataset.py --dataroot ./datasets/maps --folders trainA trainB
+    pix2pix (aligned) data:
+        python datasets/pack_dataset.py --dataroot ./datasets/facades --folders train
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # make the 'data' package importable
+from data.packed_folder import pack_folder  # noqa: E402
+
+parser = argparse.ArgumentParser('pack image folders into memory-mapped shards')
+parser.add_argument('--dataroot', type=str, required=True, help='path to images (should have subfolders trainA, trainB, train, etc)')
+parser.add_argument('--folders', type=str, nargs='+', default=['trainA', 'trainB'], help='subfolders of dataroot to pack')
+parser.add_argument('--shard_size', type=int, default=1024, help='maximum size of a shard file, in MB')
+parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='maximum number of images packed per folder')
+args = parser.parse_args()
+
+for arg in vars(args):
+    print('[%s] = ' % arg, getattr(args, arg))
+
+for folder in args.folders:
+    dir = os.path.join(args.dataroot, folder)
+    packed_dir = os.path.join(args.dataroot, folder + '_packed')
+    num_imgs = pack_folder(dir, packed_dir, args.shard_size, args.max_dataset_size)
+    print('folder = %s, packed %d images into %s' % (folder, num_imgs, packed_dir))
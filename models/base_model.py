@@ -1,8 +1,13 @@
 import os
+import contextlib
 import torch
 from collections import OrderedDict
 from abc import ABC, abstractmethod
 from . import networks
+from util.image_pool import ImagePool
+from util.checkpoint import Checkpointer, save_atomic, move_to, get_rng_state
+from util.profiler import StepProfiler
+from util.distributed import is_distributed, is_main_process, get_rank, all_gather_object, broadcast_module, all_reduce_gradients
 
 
 class BaseModel(ABC):
@@ -42,6 +47,11 @@ class BaseModel(ABC):
         self.optimizers = []
         self.image_paths = []
         self.metric = 0  # used for learning rate policy 'plateau'
+        self.scalers = {}  # one loss scaler per optimizer 'optimizer_<name>', created in <setup> (see --amp)
+        self.checkpointer = None  # background checkpoint writer, created in <setup> during training
+        self.profiler = None      # step profiler, created in <setup> with --profile
+        self.loss_sums = None     # running sums of the losses on the device, see <accumulate_losses>
+        self.loss_count = 0
 
     @staticmethod
     def modify_commandline_options(parser, is_train):
@@ -83,11 +93,74 @@ class BaseModel(ABC):
         """
         if self.isTrain:
             self.schedulers = [networks.get_scheduler(optimizer, opt) for optimizer in self.optimizers]
-        if not self.isTrain or opt.continue_train:
+            # fp16 gradients need loss scaling; bf16 (CPU) has the range of fp32, so its scalers are pass-through
+            use_scaler = opt.amp and self.device.type == 'cuda'
+            for attr in sorted(vars(self)):
+                if attr.startswith('optimizer_'):
+                    self.scalers[attr[len('optimizer_'):]] = create_grad_scaler(use_scaler)
+            self.checkpointer = Checkpointer(self.save_dir, opt.checkpoint_keep)
+            if opt.profile:
+                self.profiler = StepProfiler(os.path.join(self.save_dir, 'profile_log.jsonl'), self.device)
+        if not self.isTrain or opt.continue_train or opt.resume:
             load_suffix = 'iter_%d' % opt.load_iter if opt.load_iter > 0 else opt.epoch
             self.load_networks(load_suffix)
+        if is_distributed():  # start all the processes from the same weights
+            for name in self.model_names:
+                if isinstance(name, str):
+                    broadcast_module(getattr(self, 'net' + name))
+            batch_norm_nets = [name for name in self.model_names if isinstance(name, str) and
+                               any(isinstance(m, torch.nn.modules.batchnorm._BatchNorm) for m in getattr(self, 'net' + name).modules())]
+            if self.device.type == 'cpu' and batch_norm_nets and is_main_process():
+                print('warning: batch normalization is only synchronized across the processes on GPUs; on CPU, '
+                      'the networks %s normalize with the statistics of the batch of each process' % ', '.join(batch_norm_nets))
         self.print_networks(opt.verbose)
 
+    def timed(self, name):
+        """Return a context manager timing its content as phase <name> of the training step with --profile.
+
+        Use it around the main phases of <optimize_parameters>, e.g., 'with self.timed('backward_G'), self.autocast():'.
+        Optimizer steps are timed by <step_optimizer> as 'step_<name>'.
+        """
+        if self.profiler is None:
+            return contextlib.nullcontext()
+        return self.profiler.phase(name)
+
+    def autocast(self):
+        """Return a context manager running its content in mixed precision with --amp (fp16 on GPU, bf16 on CPU).
+
+        Wrap the forward passes and the loss computations with it, e.g., 'with self.autocast(): self.forward()'.
+        """
+        if not self.opt.amp:
+            return contextlib.nullcontext()
+        dtype = torch.float16 if self.device.type == 'cuda' else torch.bfloat16
+        return torch.autocast(device_type=self.device.type, dtype=dtype)
+
+    def backward_loss(self, loss, name):
+        """Compute the gradients of a loss, scaled by the loss scaler of optimizer 'optimizer_<name>'.
+
+        Use it instead of loss.backward(); it can be called several times before <step_optimizer>.
+        """
+        scaler = self.scalers.get(name)
+        with torch.autocast(device_type=self.device.type, enabled=False) if self.opt.amp else contextlib.nullcontext():
+            (scaler.scale(loss) if scaler is not None else loss).backward()
+
+    def step_optimizer(self, name):
+        """Update the weights with optimizer 'optimizer_<name>'; use it instead of optimizer.step().
+
+        With loss scaling, the step is skipped if the gradients overflowed, and the scale is updated.
+        In a multi-process training, the gradients are averaged across the processes first.
+        """
+        optimizer = getattr(self, 'optimizer_' + name)
+        scaler = self.scalers.get(name)
+        with self.timed('step_' + name):
+            if is_distributed():
+                all_reduce_gradients([p for group in optimizer.param_groups for p in group['params'] if p.requires_grad])
+            if scaler is None:
+                optimizer.step()
+            else:
+                scaler.step(optimizer)
+                scaler.update()
+
     def eval(self):
         """Make models eval mode during test time"""
         for name in self.model_names:
@@ -102,9 +175,36 @@ class BaseModel(ABC):
         It also calls <compute_visuals> to produce additional visualization results
         """
         with torch.no_grad():
-            self.forward()
+            with self.autocast():
+                self.forward()
             self.compute_visuals()
 
+    def generate(self, net, input):
+        """Run a generator on a batch of images; at test time with --tile_size, run it on overlapping tiles.
+
+        Parameters:
+            net (network)  -- the generator
+            input (tensor) -- N x C x H x W input images
+        """
+        if not self.isTrain and self.opt.tile_size > 0:
+            return networks.tiled_forward(net, input, self.opt.tile_size, self.opt.tile_overlap, self.opt.tile_batch_size)
+        return net(input)
+
+    def forward_fused(self, net, inputs):
+        """Run a network on several independent batches at once, and return the output of every batch.
+
+        Parameters:
+            net (network) -- the network
+            inputs (list) -- N_i x C x H x W input batches
+
+        The batches are concatenated, so that small batches use the device better, and the output is split back
+        (the gradients flow to every input). They are run one by one if the network mixes the samples of a batch
+        (see networks.is_per_sample) or if their images have different sizes.
+        """
+        if len(inputs) == 1 or not networks.is_per_sample(net) or any(x.shape[1:] != inputs[0].shape[1:] for x in inputs):
+            return [net(x) for x in inputs]
+        return list(net(torch.cat(inputs)).split([x.shape[0] for x in inputs]))
+
     def compute_visuals(self):
         """Calculate additional output images for visdom and HTML visualization"""
         pass
@@ -132,31 +232,117 @@ class BaseModel(ABC):
                 visual_ret[name] = getattr(self, name)
         return visual_ret
 
+    def accumulate_losses(self):
+        """Add the current losses to their running sums; called in every training iteration.
+
+        The sums stay on the device, so that the iteration does not wait for the values of the losses.
+        """
+        losses = torch.stack([torch.as_tensor(getattr(self, 'loss_' + name), dtype=torch.float32, device=self.device).detach()
+                              for name in self.loss_names if isinstance(name, str)])
+        self.loss_sums = losses if self.loss_sums is None else self.loss_sums + losses
+        self.loss_count += 1
+
     def get_current_losses(self):
-        """Return traning losses / errors. train.py will print out these errors on console, and save them to a file"""
-        errors_ret = OrderedDict()
-        for name in self.loss_names:
-            if isinstance(name, str):
-                errors_ret[name] = float(getattr(self, 'loss_' + name))  # float(...) works for both scalar tensor and float number
-        return errors_ret
+        """Return traning losses / errors. train.py will print out these errors on console, and save them to a file
+
+        The losses are averaged over the iterations accumulated since the last call (see <accumulate_losses>),
+        and read from the device in a single transfer.
+        """
+        if self.loss_count == 0:  # nothing accumulated: the losses of the current iteration
+            self.accumulate_losses()
+        values = (self.loss_sums / self.loss_count).tolist()
+        self.loss_sums, self.loss_count = None, 0
+        return OrderedDict(zip([name for name in self.loss_names if isinstance(name, str)], values))
 
     def save_networks(self, epoch):
-        """Save all the networks to the disk.
+        """Save all the networks (and the loss scalers of --amp) to the disk.
 
         Parameters:
             epoch (int) -- current epoch; used in the file name '%s_net_%s.pth' % (epoch, name)
+
+        During training, the files are written by a background thread; see <util.checkpoint.Checkpointer>.
         """
+        self.write_checkpoint(self.get_network_files(epoch))
+
+    def save_training_state(self, epoch, counters):
+        """Save the networks together with the rest of the training state, so that training can be resumed exactly (see --resume).
+
+        Parameters:
+            epoch (int or str) -- used in the file names: '%s_net_%s.pth' % (epoch, name) and '%s_state.pth' % epoch
+            counters (dict)    -- training loop counters to restore (e.g., epoch, epoch_iter, total_iters, epoch_rng)
+
+        Iteration checkpoints ('iter_<n>') are subject to the retention window of --checkpoint_keep.
+        In a multi-process training, all the processes call it (see <get_training_state>), and the first one writes the files.
+        """
+        files = self.get_network_files(epoch)
+        files['%s_state.pth' % epoch] = self.get_training_state(counters)  # written last: its presence means a complete checkpoint
+        group = epoch if str(epoch).startswith('iter_') else None
+        if is_main_process():
+            self.write_checkpoint(files, group)
+
+    def get_network_files(self, epoch):
+        """Return a dictionary {file name: state_dict} of the networks and the enabled loss scalers."""
+        files = OrderedDict()
         for name in self.model_names:
             if isinstance(name, str):
-                save_filename = '%s_net_%s.pth' % (epoch, name)
-                save_path = os.path.join(self.save_dir, save_filename)
                 net = getattr(self, 'net' + name)
-
-                if len(self.gpu_ids) > 0 and torch.cuda.is_available():
-                    torch.save(net.module.cpu().state_dict(), save_path)
-                    net.cuda(self.gpu_ids[0])
-                else:
-                    torch.save(net.cpu().state_dict(), save_path)
+                if isinstance(net, torch.nn.DataParallel):
+                    net = net.module
+                files['%s_net_%s.pth' % (epoch, name)] = net.state_dict()
+        for name, scaler in self.scalers.items():
+            if scaler.is_enabled():
+                files['%s_scaler_%s.pth' % (epoch, name)] = scaler.state_dict()
+        return files
+
+    def get_training_state(self, counters):
+        """Return the training state that is not stored in the network files.
+
+        It contains the optimizers ('optimizer_<name>' attributes), the learning rate schedulers, the image pools,
+        the random number generators and the given loop counters.
+        In a multi-process training, the random number generator states ('rng' and the 'epoch_rng' counter) of all
+        the processes are gathered into lists, by rank, so that every process draws its own numbers once resumed.
+        """
+        state = dict(counters)
+        state['optimizers'] = {}
+        state['pools'] = {}
+        for attr, value in vars(self).items():
+            if attr.startswith('optimizer_'):
+                state['optimizers'][attr] = value.state_dict()
+            elif isinstance(value, ImagePool):
+                state['pools'][attr] = value.state_dict()
+        state['schedulers'] = [scheduler.state_dict() for scheduler in self.schedulers]
+        state['rng'] = get_rng_state()
+        if is_distributed():
+            state['rng'], state['epoch_rng'] = map(list, zip(*all_gather_object((state['rng'], state.get('epoch_rng')))))
+        return state
+
+    def load_training_state(self, epoch):
+        """Restore the state saved by <save_training_state>, except the networks (see <load_networks>).
+
+        Returns the saved loop counters, together with the saved random number generator states ('rng'),
+        which the caller restores once it reaches the saved position in the epoch.
+        """
+        load_path = os.path.join(self.save_dir, '%s_state.pth' % epoch)
+        print('loading the training state from %s' % load_path)
+        state = torch.load(load_path, map_location='cpu', weights_only=False)
+        for attr, optimizer_state in state.pop('optimizers').items():
+            getattr(self, attr).load_state_dict(optimizer_state)
+        for attr, pool_state in state.pop('pools').items():
+            getattr(self, attr).load_state_dict(move_to(pool_state, self.device))
+        for scheduler, scheduler_state in zip(self.schedulers, state.pop('schedulers')):
+            scheduler.load_state_dict(scheduler_state)
+        if isinstance(state['rng'], list):  # saved by a multi-process training: the random states of this process
+            rank = get_rank() % len(state['rng'])
+            state['rng'], state['epoch_rng'] = state['rng'][rank], state['epoch_rng'][rank]
+        return state
+
+    def write_checkpoint(self, files, group=None):
+        """Write {file name: object} to the save directory, in the background during training."""
+        if self.checkpointer is not None:
+            self.checkpointer.save(files, group)
+        else:
+            for name, obj in files.items():
+                save_atomic(move_to(obj, 'cpu'), os.path.join(self.save_dir, name))
 
     def __patch_instance_norm_state_dict(self, state_dict, module, keys, i=0):
         """Fix InstanceNorm checkpoints incompatibility (prior to 0.4)"""
@@ -197,6 +383,12 @@ class BaseModel(ABC):
                     self.__patch_instance_norm_state_dict(state_dict, net, key.split('.'))
                 net.load_state_dict(state_dict)
 
+        for name, scaler in self.scalers.items():
+            load_path = os.path.join(self.save_dir, '%s_scaler_%s.pth' % (epoch, name))
+            if scaler.is_enabled() and os.path.isfile(load_path):  # checkpoints saved without --amp have no scaler
+                print('loading the loss scaler from %s' % load_path)
+                scaler.load_state_dict(torch.load(load_path))
+
     def print_networks(self, verbose):
         """Print the total number of parameters in the network and (if verbose) network architecture
 
@@ -227,3 +419,10 @@ class BaseModel(ABC):
             if net is not None:
                 for param in net.parameters():
                     param.requires_grad = requires_grad
+
+
+def create_grad_scaler(enabled):
+    """Create a loss scaler for fp16 training; a disabled scaler passes losses and optimizer steps through."""
+    if hasattr(torch.amp, 'GradScaler'):  # PyTorch >= 2.3
+        return torch.amp.GradScaler('cuda', enabled=enabled)
+    return torch.cuda.amp.GradScaler(enabled=enabled)
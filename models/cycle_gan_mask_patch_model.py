@@ -3,10 +3,6 @@ import itertools
 from util.image_pool import ImagePool
 from .base_model import BaseModel
 from . import networks
-from torch.autograd import Variable
-import numpy as np
-import torch.nn.functional as F
-import kornia.geometry.transform as f
 
 class CycleGANMaskPatchModel(BaseModel):
     #def name(self):
@@ -43,6 +39,7 @@ class CycleGANMaskPatchModel(BaseModel):
             parser.add_argument('--disc_full_im', action='store_true', help='use a discriminator for the full image')
             parser.add_argument('--use_context_G', action='store_true', help='use context for generators')
             parser.add_argument('--train_f_s_B', action='store_true', help='if true f_s will be trained not only on domain A but also on domain B')
+            parser.add_argument('--use_disc_patch', action='store_true', help='also train discriminators on the generated mask patches, in addition to the full image discriminators')
         return parser
     
     def __init__(self, opt):
@@ -53,7 +50,7 @@ class CycleGANMaskPatchModel(BaseModel):
                 'D_B_full', 'G_B', 'cycle_B', 'idt_B', 
                 ]
 
-        if opt.use_disc_patch:
+        if self.isTrain and opt.use_disc_patch:
             losses+=['G_A_2','G_B_2','D_A_patch','D_B_patch']
 
         self.loss_names = losses
@@ -78,9 +75,9 @@ class CycleGANMaskPatchModel(BaseModel):
             
         # specify the models you want to save to the disk. The program will call base_model.save_networks and base_model.load_networks
         if self.isTrain:
-            model_names = ['G_A', 'G_B', 'D_A_full', 'D_B_full']
+            self.model_names = ['G_A', 'G_B', 'D_A_full', 'D_B_full']
             if opt.use_disc_patch:
-                model_names += ['D_A_patch', 'D_B_patch']
+                self.model_names += ['D_A_patch', 'D_B_patch']
             #self.model_names = ['f_s']
         else:  # during test time, only load Gs
             self.model_names = ['G_A']
@@ -150,47 +147,20 @@ class CycleGANMaskPatchModel(BaseModel):
         self.full_real_B = input['B' if AtoB else 'A'].to(self.device)
         self.image_paths = input['A_paths' if AtoB else 'B_paths']
 
-        if 'A_label' in input :
+        # crop the bounding box of the masks and resize it to the full image size, for the whole batch at once;
+        # the boxes come from the dataset when indexed (--mask_bbox_index), otherwise from a scan of the masks
+        if 'A_label' in input:
             self.input_A_label = input['A_label'].to(self.device).squeeze(1)
-
-            num_batch = self.input_A_label.shape[0]
-
-            self.real_A = torch.tensor(np.zeros(self.full_real_A.size()),dtype=torch.float).to(self.device)
-            for k in range(num_batch):
-
-                pos_2 = torch.nonzero(self.input_A_label.squeeze(1)[k])                
-                ymin=pos_2[0][0]
-                ymax=pos_2[-1][0]
-                xmin=pos_2[0][1]
-                xmax=pos_2[-1][1]
-
-                size = self.full_real_A.shape[-1]
-                temp=f.resize(self.full_real_A[k,:,ymin:ymax+1,xmin:xmax+1].unsqueeze(0),(size,size))
-                self.real_A[k] = f.resize(self.full_real_A[k,:,ymin:ymax+1,xmin:xmax+1].unsqueeze(0),(self.full_real_A.shape[-1],self.full_real_A.shape[-1])).squeeze(0)
+            self.A_bbox = input['A_bbox'].to(self.device) if 'A_bbox' in input else networks.mask_bbox(self.input_A_label)
+            self.real_A = networks.crop_resize(self.full_real_A, self.A_bbox, self.full_real_A.shape[-1])
 
         if 'B_label' in input:
             self.input_B_label = input['B_label'].to(self.device).squeeze(1)
-
-            num_batch = self.input_B_label.shape[0]
-
-
-            self.real_B = torch.tensor(np.zeros(self.full_real_B.size()),dtype=torch.float).to(self.device)
-            for k in range(num_batch):
-                pos_2 = torch.nonzero(self.input_B_label.squeeze(1)[k])
-                ymin=pos_2[0][0]
-                ymax=pos_2[-1][0]
-                xmin=pos_2[0][1]
-                xmax=pos_2[-1][1]            
-                self.real_B[k] = f.resize(self.full_real_B[k,:,ymin:ymax+1,xmin:xmax+1].unsqueeze(0),(self.full_real_B.shape[-1],self.full_real_B.shape[-1])).squeeze(0)
-
-
+            self.B_bbox = input['B_bbox'].to(self.device) if 'B_bbox' in input else networks.mask_bbox(self.input_B_label)
+            self.real_B = networks.crop_resize(self.full_real_B, self.B_bbox, self.full_real_B.shape[-1])
 
     def forward(self):
-        label_A = self.input_A_label
-        label_A_inv = torch.tensor(np.ones(label_A.size()),dtype=torch.float).to(self.device) - label_A
-        label_A_inv = label_A_inv.unsqueeze(1)
-        label_A_inv = torch.cat ([label_A_inv,label_A_inv,label_A_inv],1)
-        
+        label_A_inv = (1 - self.input_A_label.float()).unsqueeze(1)
         self.real_A_out_mask = self.full_real_A *label_A_inv
 
         if self.opt.use_context_G:
@@ -212,11 +182,7 @@ class CycleGANMaskPatchModel(BaseModel):
 
             if hasattr(self, 'input_B_label'):
                 
-                label_B = self.input_B_label
-                label_B_inv = torch.tensor(np.ones(label_B.size()),dtype=torch.float).to(self.device) - label_B
-                label_B_inv = label_B_inv.unsqueeze(1)
-                label_B_inv = torch.cat ([label_B_inv,label_B_inv,label_B_inv],1)
-                    
+                label_B_inv = (1 - self.input_B_label.float()).unsqueeze(1)
                 self.real_B_out_mask = self.full_real_B *label_B_inv
                 if self.opt.use_context_G:
                     self.fake_A = self.netG_B(torch.cat((self.real_B,self.real_B_out_mask),dim=1))
@@ -224,37 +190,11 @@ class CycleGANMaskPatchModel(BaseModel):
                 else:
                     self.fake_A = self.netG_B(self.real_B)
                     self.rec_B = self.netG_A(self.fake_A)
-            
-
 
-        num_batch = self.input_A_label.shape[0]
-        self.full_fake_B = torch.tensor(np.zeros(self.full_real_B.size()),dtype=torch.float).to(self.device)
-        self.full_fake_A = torch.tensor(np.zeros(self.full_real_A.size()),dtype=torch.float).to(self.device)
-        for k in range(num_batch):
-            pos = torch.nonzero(self.input_A_label[k])
-            ymin=pos[0][0].data
-            ymax=pos[-1][0].data
-            xmin=pos[0][1].data
-            xmax=pos[-1][1].data
-            y_c = ymax - ymin + 1
-            x_c = xmax - xmin + 1
-            fake_B_patch = torch.tensor(np.zeros(self.full_real_B[k].size()),dtype=torch.float).to(self.device)
-            fake_B_patch[:,ymin:ymax+1,xmin:xmax+1] = f.resize(self.fake_B[k].unsqueeze(0),(y_c,x_c)).squeeze(0)
-            self.full_fake_B[k] = fake_B_patch + self.real_A_out_mask[k]
-            
-            pos = np.nonzero(self.input_B_label[k])
-            ymin=pos[0][0].data
-            ymax=pos[-1][0].data
-            xmin=pos[0][1].data
-            xmax=pos[-1][1].data
-            y_c = ymax - ymin + 1
-            x_c = xmax - xmin + 1
-            fake_A_patch = torch.tensor(np.zeros(self.full_real_A[k].size()),dtype=torch.float).to(self.device)
-            fake_A_patch[:,ymin:ymax+1,xmin:xmax+1] = f.resize(self.fake_A[k].unsqueeze(0),(y_c,x_c)).squeeze(0)
-            self.full_fake_A[k] = fake_A_patch + self.real_B_out_mask[k]
-
-        
+                # paste the generated patches back into their boxes
+                self.full_fake_A = networks.paste_resized(self.fake_A, self.B_bbox, self.full_real_A.shape[2:]) + self.real_B_out_mask
 
+        self.full_fake_B = networks.paste_resized(self.fake_B, self.A_bbox, self.full_real_B.shape[2:]) + self.real_A_out_mask
 
     def backward_D_basic(self, netD, real, fake):
         # Real
@@ -266,7 +206,7 @@ class CycleGANMaskPatchModel(BaseModel):
         # Combined loss
         loss_D = (loss_D_real + loss_D_fake) * 0.5
         # backward
-        loss_D.backward()
+        self.backward_loss(loss_D, 'D')
         return loss_D
     
     def backward_D_A_patch(self):
@@ -325,29 +265,33 @@ class CycleGANMaskPatchModel(BaseModel):
         
         lambda_out_mask = self.opt.lambda_out_mask
 
-        self.loss_G.backward()
+        self.backward_loss(self.loss_G, 'G')
 
     def optimize_parameters(self):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
         # forward
-        self.forward()      # compute fake images and reconostruction images.
+        with self.timed('forward'), self.autocast():
+            self.forward()      # compute fake images and reconostruction images.
         # G_A and G_B
         self.set_requires_grad([self.netD_A_full, self.netD_B_full], False)  # Ds require no gradients when optimizing Gs
         if self.opt.use_disc_patch:
             self.set_requires_grad([self.netD_A_patch, self.netD_B_patch], False)
         self.set_requires_grad([self.netG_A, self.netG_B], True)
         self.optimizer_G.zero_grad()  # set G_A and G_B's gradients to zero
-        self.backward_G()             # calculate gradients for G_A and G_B
-        self.optimizer_G.step()       # update G_A and G_B's weights
+        with self.timed('backward_G'), self.autocast():
+            self.backward_G()             # calculate gradients for G_A and G_B
+        self.step_optimizer('G')       # update G_A and G_B's weights
         # D_A and D_B
         self.set_requires_grad([self.netD_A_full, self.netD_B_full], True)
         if self.opt.use_disc_patch:
             self.set_requires_grad([self.netD_A_patch, self.netD_B_patch], True)
         self.optimizer_D.zero_grad()   # set D_A and D_B's gradients to zero
-        self.backward_D_A_full()      # calculate gradients for D_A
-        self.backward_D_B_full()      # calculate graidents for D_B
+        with self.timed('backward_D'), self.autocast():
+            self.backward_D_A_full()      # calculate gradients for D_A
+            self.backward_D_B_full()      # calculate graidents for D_B
         if self.opt.use_disc_patch:
-            self.backward_D_A_patch()      # calculate gradients for D_A
-            self.backward_D_B_patch()      # calculate graidents for D_B
-        self.optimizer_D.step()  # update D_A and D_B's weights
+            with self.timed('backward_D'), self.autocast():
+                self.backward_D_A_patch()      # calculate gradients for D_A
+                self.backward_D_B_patch()      # calculate graidents for D_B
+        self.step_optimizer('D')  # update D_A and D_B's weights
         
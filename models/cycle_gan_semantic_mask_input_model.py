@@ -37,6 +37,7 @@ class CycleGANSemanticMaskInputModel(BaseModel):
             parser.add_argument('--lambda_A', type=float, default=10.0, help='weight for cycle loss (A -> B -> A)')
             parser.add_argument('--lambda_B', type=float, default=10.0, help='weight for cycle loss (B -> A -> B)')
             parser.add_argument('--lambda_identity', type=float, default=0.5, help='use identity mapping. Setting lambda_identity other than 0 has an effect of scaling the weight of the identity mapping loss. For example, if the weight of the identity loss should be 10 times smaller than the weight of the reconstruction loss, please set lambda_identity = 0.1')
+            parser.add_argument('--sem_gate_threshold', type=float, default=networks.SEM_GATE_THRESHOLD, help='the semantic losses are used once the loss of f_s is below this value')
 
         return parser
     
@@ -138,38 +139,45 @@ class CycleGANSemanticMaskInputModel(BaseModel):
         #print('FORWARDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDDD')
         #print(self.netf_s)
         d = 1
-        
+
+        # the prediction of real_A is reused by backward_f_s: each image goes through f_s once per iteration
+        if self.isTrain:
+            self.set_requires_grad([self.netf_s], True)
         self.pred_real_A = self.netf_s(self.real_A)
         self.gt_pred_A = F.log_softmax(self.pred_real_A,dim= d).argmax(dim=d)
-        self.fake_B = self.netG_A(torch.cat((self.real_A,self.gt_pred_A.float().unsqueeze(1)),dim=1))
+        input_A = torch.cat((self.real_A,self.gt_pred_A.float().unsqueeze(1)),dim=1)
+        if not self.isTrain:
+            self.fake_B = self.netG_A(input_A)
+            self.pred_fake_B = self.netf_s(self.fake_B)
+            self.pfB = F.log_softmax(self.pred_fake_B,dim=d)#.argmax(dim=d)
+            self.pfB_max = self.pfB.argmax(dim=d)
+            return
+
+        self.set_requires_grad([self.netf_s], False)  # the other predictions only backpropagate to the generators
+        with torch.no_grad():  # only its argmax is used
+            pred_real_B = self.netf_s(self.real_B)
+        self.gt_pred_B = F.log_softmax(pred_real_B,dim=d).argmax(dim=d)
+        input_B = torch.cat((self.real_B,self.gt_pred_B.float().unsqueeze(1)),dim=1)
+
+        # independent calls to the same generator run as one batch (see forward_fused); the identity images
+        # G_A(B) and G_B(A) are computed here with the others
+        if self.opt.lambda_identity > 0:
+            self.fake_A, self.idt_B = self.forward_fused(self.netG_B, [input_B, input_A])
+        else:
+            self.fake_A = self.netG_B(input_B)
+        self.pred_fake_A = self.netf_s(self.fake_A)
+        self.pfA = F.log_softmax(self.pred_fake_A,dim=d)#.argmax(dim=d)
+        self.pfA_max = self.pfA.argmax(dim=d)
+
+        input_fake_A = torch.cat((self.fake_A,self.pfA.argmax(dim=d).float().unsqueeze(1)),dim=1)
+        if self.opt.lambda_identity > 0:
+            self.fake_B, self.rec_B, self.idt_A = self.forward_fused(self.netG_A, [input_A, input_fake_A, input_B])
+        else:
+            self.fake_B, self.rec_B = self.forward_fused(self.netG_A, [input_A, input_fake_A])
         self.pred_fake_B = self.netf_s(self.fake_B)
         self.pfB = F.log_softmax(self.pred_fake_B,dim=d)#.argmax(dim=d)
         self.pfB_max = self.pfB.argmax(dim=d)
-
-#        print(self.real_A.shape)
-#        print(self.pred_real_A[0,0,0,0])
-#        print(self.pred_real_A.type())
-#        print(self.gt_pred_A.unsqueeze(1).shape)
-#        print(self.gt_pred_A.float().type())
-
-
-
-#        print(torch.cat((self.real_A,self.gt_pred_A.float().unsqueeze(1)),dim=1))
-#        print(torch.cat((self.real_A,self.gt_pred_A.float().unsqueeze(1)),dim=1).shape)
-#        print(torch.cat((self.real_A,self.gt_pred_A.float().unsqueeze(1)),dim=1)[0])
-      
-
-        if self.isTrain:
-            self.rec_A = self.netG_B(torch.cat((self.fake_B,self.pfB.argmax(dim=d).float().unsqueeze(1)),dim=1))
-            
-            pred_real_B = self.netf_s(self.real_B)
-            self.gt_pred_B = F.log_softmax(pred_real_B,dim=d).argmax(dim=d)
-            self.fake_A = self.netG_B(torch.cat((self.real_B,self.gt_pred_B.float().unsqueeze(1)),dim=1))
-            
-            self.pred_fake_A = self.netf_s(self.fake_A)
-            self.pfA = F.log_softmax(self.pred_fake_A,dim=d)#.argmax(dim=d)
-            self.pfA_max = self.pfA.argmax(dim=d)
-            self.rec_B = self.netG_A(torch.cat((self.fake_A,self.pfA.argmax(dim=d).float().unsqueeze(1)),dim=1))
+        self.rec_A = self.netG_B(torch.cat((self.fake_B,self.pfB.argmax(dim=d).float().unsqueeze(1)),dim=1))
 
 
 
@@ -202,23 +210,25 @@ class CycleGANSemanticMaskInputModel(BaseModel):
         # Combined loss
         loss_D = (loss_D_real + loss_D_fake) * 0.5
         # backward
-        loss_D.backward()
+        self.backward_loss(loss_D, 'D')
         return loss_D
     
     def backward_f_s(self):
         #print('backward fs')
         label_A = self.input_A_label
-        # forward only real source image through semantic classifier
-        pred_A = self.netf_s(self.real_A) 
-        self.loss_f_s = self.criterionf_s(pred_A, label_A)#.squeeze(1))
-        self.loss_f_s.backward()
+        # only real source image through semantic classifier, as predicted in forward
+        pred_A = self.pred_real_A
+        self.loss_f_s = self.criterionf_s(pred_A, label_A.long())#.squeeze(1))
+        self.backward_loss(self.loss_f_s, 'f_s')
 
     def backward_D_A(self):
-        fake_B = self.fake_B_pool.query(self.fake_B)
+        with self.timed('pool'):
+            fake_B = self.fake_B_pool.query(self.fake_B)
         self.loss_D_A = self.backward_D_basic(self.netD_A, self.real_B, fake_B)
 
     def backward_D_B(self):
-        fake_A = self.fake_A_pool.query(self.fake_A)
+        with self.timed('pool'):
+            fake_A = self.fake_A_pool.query(self.fake_A)
         self.loss_D_B = self.backward_D_basic(self.netD_B, self.real_A, fake_A)
 
     def backward_G(self):
@@ -228,12 +238,9 @@ class CycleGANSemanticMaskInputModel(BaseModel):
         lambda_B = self.opt.lambda_B
         # Identity loss
         if lambda_idt > 0:
-            # G_A should be identity if real_B is fed.
-            self.idt_A = self.netG_A(torch.cat((self.real_B,self.gt_pred_B.float().unsqueeze(1)),dim=1))
-            
+            # G_A should be identity if real_B is fed (idt_A and idt_B are computed in forward).
             self.loss_idt_A = self.criterionIdt(self.idt_A, self.real_B) * lambda_B * lambda_idt
             # G_B should be identity if real_A is fed.
-            self.idt_B = self.netG_B(torch.cat((self.real_A,self.gt_pred_A.float().unsqueeze(1)),dim=1))
             self.loss_idt_B = self.criterionIdt(self.idt_B, self.real_A) * lambda_A * lambda_idt
         else:
             self.loss_idt_A = 0
@@ -251,7 +258,7 @@ class CycleGANSemanticMaskInputModel(BaseModel):
         self.loss_G = self.loss_G_A + self.loss_G_B + self.loss_cycle_A + self.loss_cycle_B + self.loss_idt_A + self.loss_idt_B
 
         # semantic loss AB
-        self.loss_sem_AB = self.criterionf_s(self.pfB, self.input_A_label)
+        self.loss_sem_AB = self.criterionf_s(self.pfB, self.input_A_label.long())
         #self.loss_sem_AB = self.criterionf_s(self.pred_fake_B, self.gt_pred_A)
 
         # semantic loss BA
@@ -260,33 +267,41 @@ class CycleGANSemanticMaskInputModel(BaseModel):
         
         # only use semantic loss when classifier has reasonably low loss
         #if True:
-        if not hasattr(self, 'loss_f_s') or self.loss_f_s.detach().item() > 1.0:
+        if not hasattr(self, 'loss_f_s'):
             self.loss_sem_AB = 0 * self.loss_sem_AB 
             self.loss_sem_BA = 0 * self.loss_sem_BA 
+        else:  # decided on the device, without waiting for the value of the loss
+            sem_off = self.loss_f_s.detach() > self.opt.sem_gate_threshold
+            self.loss_sem_AB = torch.where(sem_off, 0 * self.loss_sem_AB, self.loss_sem_AB)
+            self.loss_sem_BA = torch.where(sem_off, 0 * self.loss_sem_BA, self.loss_sem_BA)
         #    self.loss_sem_BA = 0 * self.loss_sem_BA
         
         self.loss_G += self.loss_sem_BA + self.loss_sem_AB
-        self.loss_G.backward()
+        self.backward_loss(self.loss_G, 'G')
 
     def optimize_parameters(self):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
         # forward
-        self.forward()      # compute fake images and reconostruction images.
+        with self.timed('forward'), self.autocast():
+            self.forward()      # compute fake images and reconostruction images.
         # G_A and G_B
         self.set_requires_grad([self.netD_A, self.netD_B], False)  # Ds require no gradients when optimizing Gs
         self.set_requires_grad([self.netG_A, self.netG_B], True)
         self.optimizer_G.zero_grad()  # set G_A and G_B's gradients to zero
-        self.backward_G()             # calculate gradients for G_A and G_B
-        self.optimizer_G.step()       # update G_A and G_B's weights
+        with self.timed('backward_G'), self.autocast():
+            self.backward_G()             # calculate gradients for G_A and G_B
+        self.step_optimizer('G')       # update G_A and G_B's weights
         # D_A and D_B
         self.set_requires_grad([self.netD_A, self.netD_B], True)
         self.optimizer_D.zero_grad()   # set D_A and D_B's gradients to zero
-        self.backward_D_A()      # calculate gradients for D_A
-        self.backward_D_B()      # calculate graidents for D_B
-        self.optimizer_D.step()  # update D_A and D_B's weights
+        with self.timed('backward_D'), self.autocast():
+            self.backward_D_A()      # calculate gradients for D_A
+            self.backward_D_B()      # calculate graidents for D_B
+        self.step_optimizer('D')  # update D_A and D_B's weights
         # f_s
         self.set_requires_grad([self.netD_A, self.netD_B], False)
         self.set_requires_grad([self.netf_s], True)
         self.optimizer_f_s.zero_grad()
-        self.backward_f_s()
-        self.optimizer_f_s.step()
+        with self.timed('backward_f_s'), self.autocast():
+            self.backward_f_s()
+        self.step_optimizer('f_s')
@@ -1,6 +1,7 @@
 import torch
 import itertools
 from util.image_pool import ImagePool
+from util.pseudo_label_cache import PseudoLabelCache
 from .base_model import BaseModel
 from . import networks
 from torch.autograd import Variable
@@ -41,6 +42,14 @@ class CycleGANSemanticMaskModel(BaseModel):
             parser.add_argument('--lambda_out_mask', type=float, default=10.0, help='weight for loss out mask')
             parser.add_argument('--loss_out_mask', type=str, default='L1', help='loss mask')
             parser.add_argument('--train_f_s_B', action='store_true', help='if true f_s will be trained not only on domain A but also on domain B')
+            parser.add_argument('--sem_gating', type=str, default='zero', choices=['zero', 'skip'], help='how the semantic losses are turned off while the loss of f_s is above --sem_gate_threshold. zero: they are computed and multiplied by 0 | skip: f_s is not run on the fake images and the semantic losses are not computed; the loss of f_s is checked every --sem_gate_freq iterations')
+            parser.add_argument('--sem_gate_threshold', type=float, default=networks.SEM_GATE_THRESHOLD, help='the semantic losses are used once the loss of f_s is below this value')
+            parser.add_argument('--sem_gate_freq', type=int, default=100, help='with --sem_gating skip, frequency (in iterations) of the check of the loss of f_s')
+            parser.add_argument('--sem_warmup_iters', type=int, default=0, help='number of iterations during which only f_s is trained on the semantic labels: the semantic losses of the generators are skipped')
+            parser.add_argument('--f_s_update_freq', type=int, default=1, help='train f_s every <f_s_update_freq> iterations')
+            parser.add_argument('--f_s_freeze_iters', type=int, default=0, help='if > 0, stop training f_s after this number of iterations; f_s is then frozen (in eval mode) and only predicts pseudo-labels')
+            parser.add_argument('--pseudo_label_cache_size', type=int, default=0, help='if > 0, cache up to this number of pseudo-labels predicted by f_s on the real B images without labels, keyed by image path and augmentation params (needs --batched_augment, or no random augmentation: --preprocess without crop and --no_flip)')
+            parser.add_argument('--pseudo_label_max_age', type=int, default=0, help='number of f_s updates after which a cached pseudo-label is predicted again')
         return parser
     
     def __init__(self, opt):
@@ -137,6 +146,19 @@ class CycleGANSemanticMaskModel(BaseModel):
             self.optimizers.append(self.optimizer_G)
             self.optimizers.append(self.optimizer_D)
             #beniz: not adding optimizers f_s (?)
+            self.num_iters = 0       # number of training iterations, for --sem_warmup_iters and the f_s schedule
+            self.sem_active = False  # whether the semantic losses are computed in this iteration, see <update_sem_gate>
+            self.sem_next_check = 0  # iteration of the next check of the loss of f_s, with --sem_gating skip
+            self.f_s_update = True   # whether f_s is trained in this iteration, see <update_f_s_schedule>
+            self.f_s_frozen = False  # whether f_s is no longer trained, after --f_s_freeze_iters
+            self.f_s_updates = 0     # number of updates of f_s: the version of its cached pseudo-labels
+            self.pseudo_label_cache = None
+            self.B_keys = None       # the keys of the real B images in the pseudo-label cache
+            if opt.pseudo_label_cache_size > 0:
+                if not opt.batched_augment and ('crop' in opt.preprocess or not opt.no_flip):
+                    raise ValueError('--pseudo_label_cache_size needs --batched_augment, which returns the augmentation params of the images, '
+                                     'or no random augmentation (--preprocess without crop and --no_flip)')
+                self.pseudo_label_cache = PseudoLabelCache(opt.pseudo_label_cache_size, opt.pseudo_label_max_age)
 
     def set_input(self, input):
         AtoB = self.opt.direction == 'AtoB'
@@ -151,33 +173,62 @@ class CycleGANSemanticMaskModel(BaseModel):
         if 'B_label' in input:
             self.input_B_label = input['B_label'].to(self.device).squeeze(1) # beniz: unused
             #self.image_paths = input['B_paths'] # Hack!! forcing the labels to corresopnd to B domain
+        elif 'input_B_label' in self.visual_names:  # B images without labels (e.g., unaligned_labeled_mask_2): nothing to display
+            self.visual_names.remove('input_B_label')
+        if self.isTrain and self.pseudo_label_cache is not None and 'B_label' in input:
+            print('warning: the B images have labels, f_s predicts no pseudo-labels: --pseudo_label_cache_size is unused')
+            self.pseudo_label_cache = None
+        if self.isTrain and self.pseudo_label_cache is not None:  # the keys of the pseudo-labels: path and augmentation params
+            key = 'B' if AtoB else 'A'
+            paths = input[key + '_paths']
+            params = input.get(key + '_params')
+            if params is None:  # no random augmentation (see __init__): the path is enough
+                self.B_keys = [(path,) for path in paths]
+            else:  # the params of get_seg_params, or of get_params (without rotation)
+                x, y = params['crop_pos']
+                rot = params['rot'].tolist() if 'rot' in params else [0] * len(paths)
+                self.B_keys = list(zip(paths, x.tolist(), y.tolist(), params['flip'].tolist(), rot))
 
 
     def forward(self):
-        self.fake_B = self.netG_A(self.real_A)
         d = 1
 
         if self.isTrain:
+            # independent calls to the same network run as one batch (see forward_fused); the identity images
+            # G_A(B) and G_B(A) are computed here with the others
+            if self.opt.lambda_identity > 0:
+                self.fake_A, self.idt_B = self.forward_fused(self.netG_B, [self.real_B, self.real_A])
+                self.fake_B, self.rec_B, self.idt_A = self.forward_fused(self.netG_A, [self.real_A, self.fake_A, self.real_B])
+            else:
+                self.fake_A = self.netG_B(self.real_B)
+                self.fake_B, self.rec_B = self.forward_fused(self.netG_A, [self.real_A, self.fake_A])
             self.rec_A = self.netG_B(self.fake_B)
-            
-            self.fake_A = self.netG_B(self.real_B)
-            self.rec_B = self.netG_A(self.fake_A)
-           
-            self.pred_real_A = self.netf_s(self.real_A)
+
+            # the predictions of the real images are reused by backward_f_s: each image goes through f_s once per iteration;
+            # when f_s is not trained, only the pseudo-labels of real_B are needed, by the semantic loss BA without B labels
+            self.gt_pred_A = self.gt_pred_B = None  # otherwise computed for display only, in compute_visuals
+            if self.f_s_update:
+                self.set_requires_grad([self.netf_s], True)
+                if self.opt.train_f_s_B:
+                    self.pred_real_A, self.pred_real_B = self.forward_fused(self.netf_s, [self.real_A, self.real_B])
+                    self.gt_pred_B = F.log_softmax(self.pred_real_B,dim=d).argmax(dim=d)
+                    #self.gt_pred_B = pred_real_B.argmax(dim=d)
+                else:
+                    self.pred_real_A = self.netf_s(self.real_A)
            
             
-            self.gt_pred_A = F.log_softmax(self.pred_real_A,dim= d).argmax(dim=d)
-            #print(self.gt_pred_A.shape)
-            #self.gt_pred_A = self.pred_real_A.argmax(dim=d)
-            
-            pred_real_B = self.netf_s(self.real_B)
-            self.gt_pred_B = F.log_softmax(pred_real_B,dim=d).argmax(dim=d)
-            #self.gt_pred_B = pred_real_B.argmax(dim=d)
-            
-            self.pred_fake_A = self.netf_s(self.fake_A)
-            
-            self.pfA = F.log_softmax(self.pred_fake_A,dim=d)#.argmax(dim=d)
-            self.pfA_max = self.pfA.argmax(dim=d)
+                self.gt_pred_A = F.log_softmax(self.pred_real_A,dim= d).argmax(dim=d)
+                #print(self.gt_pred_A.shape)
+                #self.gt_pred_A = self.pred_real_A.argmax(dim=d)
+            if self.gt_pred_B is None and self.sem_active and not hasattr(self, 'input_B_label'):
+                self.gt_pred_B = self.get_pseudo_labels_B()
+
+            # the predictions of the fake images only backpropagate to the generators
+            self.set_requires_grad([self.netf_s], False)
+            if self.sem_active:
+                self.pred_fake_A, self.pred_fake_B = self.forward_fused(self.netf_s, [self.fake_A, self.fake_B])
+                self.pfA = F.log_softmax(self.pred_fake_A,dim=d)#.argmax(dim=d)
+                self.pfA_max = self.pfA.argmax(dim=d)
 
             if hasattr(self,'criterionMask'):
                 label_A = self.input_A_label
@@ -198,10 +249,74 @@ class CycleGANSemanticMaskModel(BaseModel):
                     self.real_B_out_mask = self.real_B *label_B_inv
                     self.fake_A_out_mask = self.fake_A *label_B_inv
 
-
-        self.pred_fake_B = self.netf_s(self.fake_B)
-        self.pfB = F.log_softmax(self.pred_fake_B,dim=d)#.argmax(dim=d)
-        self.pfB_max = self.pfB.argmax(dim=d)
+        else:
+            self.fake_B = self.netG_A(self.real_A)
+            self.pred_fake_B = self.netf_s(self.fake_B)
+        if not self.isTrain or self.sem_active:
+            self.pfB = F.log_softmax(self.pred_fake_B,dim=d)#.argmax(dim=d)
+            self.pfB_max = self.pfB.argmax(dim=d)
+
+    def update_sem_gate(self):
+        """Decide on the host whether the semantic losses are computed in this iteration.
+
+        They are skipped during the --sem_warmup_iters first iterations. Afterwards, with --sem_gating zero they are
+        always computed, and turned off on the device by the loss of f_s (see <backward_G>); with --sem_gating skip,
+        the loss of f_s is read every --sem_gate_freq iterations, and they are skipped until the next check if it is
+        above --sem_gate_threshold. Once f_s is frozen, its last loss keeps deciding.
+        """
+        if self.f_s_frozen and not hasattr(self, 'loss_f_s'):  # resumed from a state without the last loss of f_s: measure it once
+            with torch.no_grad(), self.autocast():
+                self.loss_f_s = self.criterionf_s(self.netf_s(self.real_A), self.input_A_label.long())
+        if self.num_iters < self.opt.sem_warmup_iters or not hasattr(self, 'loss_f_s'):
+            self.sem_active = False
+        elif self.opt.sem_gating == 'zero':
+            self.sem_active = True
+        elif self.num_iters >= self.sem_next_check:
+            self.sem_active = self.loss_f_s.item() <= self.opt.sem_gate_threshold  # the only synchronization of the gate
+            self.sem_next_check = self.num_iters + self.opt.sem_gate_freq
+
+    def update_f_s_schedule(self):
+        """Decide whether f_s is trained in this iteration: every --f_s_update_freq iterations, until --f_s_freeze_iters.
+
+        Once frozen, f_s is switched to eval mode, so that its pseudo-labels are deterministic and can be cached.
+        """
+        self.f_s_frozen = self.opt.f_s_freeze_iters > 0 and self.num_iters >= self.opt.f_s_freeze_iters
+        if self.f_s_frozen and self.netf_s.training:
+            print('f_s is frozen after %d iterations' % self.num_iters)
+            self.set_requires_grad([self.netf_s], False)
+            self.netf_s.eval()
+            if self.pseudo_label_cache is not None:  # predicted in training mode
+                self.pseudo_label_cache.clear()
+        self.f_s_update = not self.f_s_frozen and self.num_iters % self.opt.f_s_update_freq == 0
+
+    def get_pseudo_labels_B(self):
+        """Return the pseudo-labels of real_B predicted by f_s, served from the pseudo-label cache when possible."""
+        if self.pseudo_label_cache is None:
+            with torch.no_grad():
+                return self.netf_s(self.real_B).argmax(dim=1)
+        labels = self.pseudo_label_cache.get(self.B_keys, self.f_s_updates)
+        missing = [i for i, label in enumerate(labels) if label is None]
+        if missing:
+            with torch.no_grad():
+                predicted = self.netf_s(self.real_B[missing]).argmax(dim=1)
+            dtype = torch.uint8 if self.opt.semantic_nclasses <= 256 else torch.long  # smaller cache entries
+            self.pseudo_label_cache.put([self.B_keys[i] for i in missing], predicted.to(dtype), self.f_s_updates)
+            for i, label in zip(missing, predicted):
+                labels[i] = label
+        return torch.stack([label.long() for label in labels])
+
+    def compute_visuals(self):
+        """Compute the predictions of f_s for display when they were skipped (see --sem_gating and --f_s_update_freq)"""
+        if not self.isTrain:
+            return
+        with torch.no_grad():
+            if self.gt_pred_A is None:
+                self.gt_pred_A = self.netf_s(self.real_A).argmax(dim=1)
+            if self.gt_pred_B is None:
+                self.gt_pred_B = self.get_pseudo_labels_B()
+            if not self.sem_active:
+                self.pfA_max = self.netf_s(self.fake_A).argmax(dim=1)
+                self.pfB_max = self.netf_s(self.fake_B).argmax(dim=1)
 
 
            
@@ -215,27 +330,29 @@ class CycleGANSemanticMaskModel(BaseModel):
         # Combined loss
         loss_D = (loss_D_real + loss_D_fake) * 0.5
         # backward
-        loss_D.backward()
+        self.backward_loss(loss_D, 'D')
         return loss_D
     
     def backward_f_s(self):
         #print('backward fs')
         label_A = self.input_A_label
-        # forward only real source image through semantic classifier
-        pred_A = self.netf_s(self.real_A) 
-        self.loss_f_s = self.criterionf_s(pred_A, label_A)#.squeeze(1))
+        # only real source image through semantic classifier, as predicted in forward
+        pred_A = self.pred_real_A
+        self.loss_f_s = self.criterionf_s(pred_A, label_A.long())#.squeeze(1))
         if self.opt.train_f_s_B:
             label_B = self.input_B_label
-            pred_B = self.netf_s(self.real_B) 
-            self.loss_f_s += self.criterionf_s(pred_B, label_B)#.squeeze(1))
-        self.loss_f_s.backward()
+            pred_B = self.pred_real_B
+            self.loss_f_s += self.criterionf_s(pred_B, label_B.long())#.squeeze(1))
+        self.backward_loss(self.loss_f_s, 'f_s')
 
     def backward_D_A(self):
-        fake_B = self.fake_B_pool.query(self.fake_B)
+        with self.timed('pool'):
+            fake_B = self.fake_B_pool.query(self.fake_B)
         self.loss_D_A = self.backward_D_basic(self.netD_A, self.real_B, fake_B)
 
     def backward_D_B(self):
-        fake_A = self.fake_A_pool.query(self.fake_A)
+        with self.timed('pool'):
+            fake_A = self.fake_A_pool.query(self.fake_A)
         self.loss_D_B = self.backward_D_basic(self.netD_B, self.real_A, fake_A)
 
     def backward_G(self):
@@ -245,12 +362,9 @@ class CycleGANSemanticMaskModel(BaseModel):
         lambda_B = self.opt.lambda_B
         # Identity loss
         if lambda_idt > 0:
-            # G_A should be identity if real_B is fed.
-            self.idt_A = self.netG_A(self.real_B)
-
+            # G_A should be identity if real_B is fed (idt_A and idt_B are computed in forward).
             self.loss_idt_A = self.criterionIdt(self.idt_A, self.real_B) * lambda_B * lambda_idt
             # G_B should be identity if real_A is fed.
-            self.idt_B = self.netG_B(self.real_A)
             self.loss_idt_B = self.criterionIdt(self.idt_B, self.real_A) * lambda_A * lambda_idt
         else:
             self.loss_idt_A = 0
@@ -267,23 +381,28 @@ class CycleGANSemanticMaskModel(BaseModel):
         # combined loss standard cyclegan
         self.loss_G = self.loss_G_A + self.loss_G_B + self.loss_cycle_A + self.loss_cycle_B + self.loss_idt_A + self.loss_idt_B
 
-        # semantic loss AB
-        self.loss_sem_AB = self.criterionf_s(self.pfB, self.input_A_label)
-        #self.loss_sem_AB = self.criterionf_s(self.pred_fake_B, self.gt_pred_A)
-
-        # semantic loss BA
-        if hasattr(self, 'input_B_label'):
-            self.loss_sem_BA = self.criterionf_s(self.pfA, self.input_B_label)#.squeeze(1))
+        if not self.sem_active:  # f_s is warming up or has a high loss: no semantic losses (see update_sem_gate)
+            self.loss_sem_AB = 0
+            self.loss_sem_BA = 0
         else:
-            self.loss_sem_BA = self.criterionf_s(self.pfA, self.gt_pred_B)#.squeeze(1))
-        #self.loss_sem_BA = self.criterionf_s(self.pred_fake_A, self.pfB) # beniz    
-        
-        # only use semantic loss when classifier has reasonably low loss
-        #if True:
-        if not hasattr(self, 'loss_f_s') or self.loss_f_s.detach().item() > 1.0:
-            self.loss_sem_AB = 0 * self.loss_sem_AB 
-            self.loss_sem_BA = 0 * self.loss_sem_BA 
-        self.loss_G += self.loss_sem_BA + self.loss_sem_AB
+            # semantic loss AB
+            self.loss_sem_AB = self.criterionf_s(self.pfB, self.input_A_label.long())
+            #self.loss_sem_AB = self.criterionf_s(self.pred_fake_B, self.gt_pred_A)
+
+            # semantic loss BA
+            if hasattr(self, 'input_B_label'):
+                self.loss_sem_BA = self.criterionf_s(self.pfA, self.input_B_label.long())#.squeeze(1))
+            else:
+                self.loss_sem_BA = self.criterionf_s(self.pfA, self.gt_pred_B)#.squeeze(1))
+            #self.loss_sem_BA = self.criterionf_s(self.pred_fake_A, self.pfB) # beniz    
+
+            # only use semantic loss when classifier has reasonably low loss,
+            # decided on the device, without waiting for the value of the loss
+            if hasattr(self, 'loss_f_s'):
+                sem_off = self.loss_f_s.detach() > self.opt.sem_gate_threshold
+                self.loss_sem_AB = torch.where(sem_off, 0 * self.loss_sem_AB, self.loss_sem_AB)
+                self.loss_sem_BA = torch.where(sem_off, 0 * self.loss_sem_BA, self.loss_sem_BA)
+            self.loss_G += self.loss_sem_BA + self.loss_sem_AB
 
         lambda_out_mask = self.opt.lambda_out_mask
 
@@ -292,27 +411,53 @@ class CycleGANSemanticMaskModel(BaseModel):
             self.loss_mask_BA = self.criterionMask( self.real_B_out_mask, self.fake_A_out_mask) * lambda_out_mask
             self.loss_G += self.loss_mask_AB + self.loss_mask_BA
 
-        self.loss_G.backward()
+        self.backward_loss(self.loss_G, 'G')
 
     def optimize_parameters(self):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
+        self.update_f_s_schedule()  # whether f_s is trained in this iteration
+        self.update_sem_gate()      # whether the semantic losses are computed in this iteration
         # forward
-        self.forward()      # compute fake images and reconostruction images.
+        with self.timed('forward'), self.autocast():
+            self.forward()      # compute fake images and reconostruction images.
         # G_A and G_B
         self.set_requires_grad([self.netD_A, self.netD_B], False)  # Ds require no gradients when optimizing Gs
         self.set_requires_grad([self.netG_A, self.netG_B], True)
         self.optimizer_G.zero_grad()  # set G_A and G_B's gradients to zero
-        self.backward_G()             # calculate gradients for G_A and G_B
-        self.optimizer_G.step()       # update G_A and G_B's weights
+        with self.timed('backward_G'), self.autocast():
+            self.backward_G()             # calculate gradients for G_A and G_B
+        self.step_optimizer('G')       # update G_A and G_B's weights
         # D_A and D_B
         self.set_requires_grad([self.netD_A, self.netD_B], True)
         self.optimizer_D.zero_grad()   # set D_A and D_B's gradients to zero
-        self.backward_D_A()      # calculate gradients for D_A
-        self.backward_D_B()      # calculate graidents for D_B
-        self.optimizer_D.step()  # update D_A and D_B's weights
+        with self.timed('backward_D'), self.autocast():
+            self.backward_D_A()      # calculate gradients for D_A
+            self.backward_D_B()      # calculate graidents for D_B
+        self.step_optimizer('D')  # update D_A and D_B's weights
         # f_s
         self.set_requires_grad([self.netD_A, self.netD_B], False)
-        self.set_requires_grad([self.netf_s], True)
-        self.optimizer_f_s.zero_grad()
-        self.backward_f_s()
-        self.optimizer_f_s.step()
+        if self.f_s_update:
+            self.set_requires_grad([self.netf_s], True)
+            self.optimizer_f_s.zero_grad()
+            with self.timed('backward_f_s'), self.autocast():
+                self.backward_f_s()
+            self.step_optimizer('f_s')
+            self.f_s_updates += 1
+        self.num_iters += 1
+
+    def get_training_state(self, counters):
+        """Return the training state, with the counters of the f_s schedule and of the semantic loss gate, and the last loss of f_s."""
+        state = BaseModel.get_training_state(self, counters)
+        state['num_iters'], state['f_s_updates'] = self.num_iters, self.f_s_updates
+        if hasattr(self, 'loss_f_s'):  # the gate of the semantic losses, fixed once f_s is frozen
+            state['loss_f_s'] = self.loss_f_s.detach()
+        return state
+
+    def load_training_state(self, epoch):
+        """Restore the training state, with the counters of the f_s schedule and of the semantic loss gate, and the last loss of f_s."""
+        state = BaseModel.load_training_state(self, epoch)
+        self.num_iters = state.pop('num_iters', self.num_iters)
+        self.f_s_updates = state.pop('f_s_updates', self.f_s_updates)
+        if 'loss_f_s' in state:
+            self.loss_f_s = state.pop('loss_f_s').to(self.device)
+        return state
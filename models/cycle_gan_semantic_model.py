@@ -37,6 +37,7 @@ class CycleGANSemanticModel(BaseModel):
             parser.add_argument('--lambda_A', type=float, default=10.0, help='weight for cycle loss (A -> B -> A)')
             parser.add_argument('--lambda_B', type=float, default=10.0, help='weight for cycle loss (B -> A -> B)')
             parser.add_argument('--lambda_identity', type=float, default=0.5, help='use identity mapping. Setting lambda_identity other than 0 has an effect of scaling the weight of the identity mapping loss. For example, if the weight of the identity loss should be 10 times smaller than the weight of the reconstruction loss, please set lambda_identity = 0.1')
+            parser.add_argument('--sem_gate_threshold', type=float, default=networks.SEM_GATE_THRESHOLD, help='the semantic losses are used once the loss of the classifier is below this value')
 
         return parser
     
@@ -120,23 +121,31 @@ class CycleGANSemanticModel(BaseModel):
 
 
     def forward(self):
-        self.fake_B = self.netG_A(self.real_A)
+        # independent calls to the same network run as one batch (see forward_fused); the identity images
+        # G_A(B) and G_B(A) are computed here with the others
+        if self.isTrain and self.opt.lambda_identity > 0:
+            self.fake_A, self.idt_B = self.forward_fused(self.netG_B, [self.real_B, self.real_A])
+            self.fake_B, self.rec_B, self.idt_A = self.forward_fused(self.netG_A, [self.real_A, self.fake_A, self.real_B])
+        else:
+            self.fake_A = self.netG_B(self.real_B)
+            self.fake_B, self.rec_B = self.forward_fused(self.netG_A, [self.real_A, self.fake_A])
         self.rec_A = self.netG_B(self.fake_B)
 
-        self.fake_A = self.netG_B(self.real_B)
-        self.rec_B = self.netG_A(self.fake_A)
-
         if self.isTrain:
            # Forward all four images through classifier
-           # Keep predictions from fake images only
            #print('real_A shape=',self.real_A.shape)
            #print('real_A=',self.real_A)
+           # the prediction of real_A is reused by backward_CLS: each real image goes through the classifier once per iteration
+           self.set_requires_grad([self.netCLS], True)
            self.pred_real_A = self.netCLS(self.real_A)
+           with torch.no_grad():  # only its argmax is used, by the semantic loss BA
+               pred_real_B = self.netCLS(self.real_B)
            _,self.gt_pred_A = self.pred_real_A.max(1)
-           pred_real_B = self.netCLS(self.real_B)
            _,self.gt_pred_B = pred_real_B.max(1)
-           self.pred_fake_A = self.netCLS(self.fake_A)
-           self.pred_fake_B = self.netCLS(self.fake_B)
+           # the predictions of the fake images only backpropagate to the generators, in a graph of their own
+           # that backward_G frees
+           self.set_requires_grad([self.netCLS], False)
+           self.pred_fake_A, self.pred_fake_B = self.forward_fused(self.netCLS, [self.fake_A, self.fake_B])
 
            _,self.pfB = self.pred_fake_B.max(1) #beniz: unused ?
         
@@ -151,22 +160,24 @@ class CycleGANSemanticModel(BaseModel):
         # Combined loss
         loss_D = (loss_D_real + loss_D_fake) * 0.5
         # backward
-        loss_D.backward()
+        self.backward_loss(loss_D, 'D')
         return loss_D
     
     def backward_CLS(self):
         label_A = self.input_A_label
-        # forward only real source image through semantic classifier
-        pred_A = self.netCLS(self.real_A) 
+        # only real source image through semantic classifier, as predicted in forward
+        pred_A = self.pred_real_A
         self.loss_CLS = self.criterionCLS(pred_A, label_A)
-        self.loss_CLS.backward()
+        self.backward_loss(self.loss_CLS, 'CLS')
 
     def backward_D_A(self):
-        fake_B = self.fake_B_pool.query(self.fake_B)
+        with self.timed('pool'):
+            fake_B = self.fake_B_pool.query(self.fake_B)
         self.loss_D_A = self.backward_D_basic(self.netD_A, self.real_B, fake_B)
 
     def backward_D_B(self):
-        fake_A = self.fake_A_pool.query(self.fake_A)
+        with self.timed('pool'):
+            fake_A = self.fake_A_pool.query(self.fake_A)
         self.loss_D_B = self.backward_D_basic(self.netD_B, self.real_A, fake_A)
 
     def backward_G(self):
@@ -175,12 +186,9 @@ class CycleGANSemanticModel(BaseModel):
         lambda_B = self.opt.lambda_B
         # Identity loss
         if lambda_idt > 0:
-            # G_A should be identity if real_B is fed.
-            self.idt_A = self.netG_A(self.real_B)
-
+            # G_A should be identity if real_B is fed (idt_A and idt_B are computed in forward).
             self.loss_idt_A = self.criterionIdt(self.idt_A, self.real_B) * lambda_B * lambda_idt
             # G_B should be identity if real_A is fed.
-            self.idt_B = self.netG_B(self.real_A)
             self.loss_idt_B = self.criterionIdt(self.idt_B, self.real_A) * lambda_A * lambda_idt
         else:
             self.loss_idt_A = 0
@@ -210,32 +218,40 @@ class CycleGANSemanticModel(BaseModel):
         
         # only use semantic loss when classifier has reasonably low loss
         #if True:
-        if not hasattr(self, 'loss_CLS') or self.loss_CLS.detach().item() > 1.0:
+        if not hasattr(self, 'loss_CLS'):
             self.loss_sem_AB = 0 * self.loss_sem_AB 
             self.loss_sem_BA = 0 * self.loss_sem_BA 
+        else:  # decided on the device, without waiting for the value of the loss
+            sem_off = self.loss_CLS.detach() > self.opt.sem_gate_threshold
+            self.loss_sem_AB = torch.where(sem_off, 0 * self.loss_sem_AB, self.loss_sem_AB)
+            self.loss_sem_BA = torch.where(sem_off, 0 * self.loss_sem_BA, self.loss_sem_BA)
       
         self.loss_G += self.loss_sem_BA + self.loss_sem_AB
-        self.loss_G.backward()
+        self.backward_loss(self.loss_G, 'G')
 
     def optimize_parameters(self):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
         # forward
-        self.forward()      # compute fake images and reconstruction images.
+        with self.timed('forward'), self.autocast():
+            self.forward()      # compute fake images and reconstruction images.
         # G_A and G_B
         self.set_requires_grad([self.netD_A, self.netD_B], False)  # Ds require no gradients when optimizing Gs
         self.set_requires_grad([self.netG_A, self.netG_B], True)
         self.optimizer_G.zero_grad()  # set G_A and G_B's gradients to zero
-        self.backward_G()             # calculate gradients for G_A and G_B
-        self.optimizer_G.step()       # update G_A and G_B's weights
+        with self.timed('backward_G'), self.autocast():
+            self.backward_G()             # calculate gradients for G_A and G_B
+        self.step_optimizer('G')       # update G_A and G_B's weights
         # D_A and D_B
         self.set_requires_grad([self.netD_A, self.netD_B], True)
         self.optimizer_D.zero_grad()   # set D_A and D_B's gradients to zero
-        self.backward_D_A()      # calculate gradients for D_A
-        self.backward_D_B()      # calculate graidents for D_B
-        self.optimizer_D.step()  # update D_A and D_B's weights
+        with self.timed('backward_D'), self.autocast():
+            self.backward_D_A()      # calculate gradients for D_A
+            self.backward_D_B()      # calculate graidents for D_B
+        self.step_optimizer('D')  # update D_A and D_B's weights
         # CLS
         self.set_requires_grad([self.netD_A, self.netD_B], False)
         self.set_requires_grad([self.netCLS], True)
         self.optimizer_CLS.zero_grad()
-        self.backward_CLS()
-        self.optimizer_CLS.step()
+        with self.timed('backward_CLS'), self.autocast():
+            self.backward_CLS()
+        self.step_optimizer('CLS')
@@ -115,6 +115,8 @@ def init_net(net, init_type='normal', init_gain=0.02, gpu_ids=[]):
     """
     if len(gpu_ids) > 0:
         assert(torch.cuda.is_available())
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            net = torch.nn.SyncBatchNorm.convert_sync_batchnorm(net)  # one GPU per process: batch norm statistics over all the processes
         net.to(gpu_ids[0])
         net = torch.nn.DataParallel(net, gpu_ids)  # multi-GPUs
     init_weights(net, init_type, init_gain=init_gain)
@@ -216,6 +218,10 @@ def define_C(output_nc, ndf, init_type='normal', init_gain=0.02, gpu_ids=[], ncl
     netC = Classifier(output_nc, ndf, nclasses)
     return init_net(netC, init_type, init_gain, gpu_ids)
 
+# default loss of a classifier (define_C) or segmentation network (define_f) below which the semantic models use it,
+# see the --sem_gate_threshold option of the cycle_gan_semantic* models
+SEM_GATE_THRESHOLD = 1.0
+
 def define_f(input_nc, nclasses, init_type='normal', init_gain=0.02, gpu_ids=[]):
     net = VGG16_FCN8s(nclasses,pretrained = False, weights_init =None,output_last_ft=False)
     return init_net(net, init_type, init_gain, gpu_ids)
@@ -334,6 +340,140 @@ def cal_gradient_penalty(netD, real_data, fake_data, device, type='mixed', const
         return 0.0, None
 
 
+def mask_bbox(mask):
+    """Compute the bounding boxes of the non-zero pixels of a batch of masks, with one reduction per axis.
+
+    Parameters:
+        mask (tensor) -- N x H x W masks
+
+    Returns a N x 4 long tensor of inclusive (xmin, ymin, xmax, ymax) boxes; an empty mask gets the full image box.
+    """
+    xmin, xmax = _mask_extent(mask.ne(0).any(dim=1))  # columns holding at least one non-zero pixel
+    ymin, ymax = _mask_extent(mask.ne(0).any(dim=2))  # rows holding at least one non-zero pixel
+    return torch.stack([xmin, ymin, xmax, ymax], dim=1)
+
+
+def _mask_extent(occupied):
+    """Return the first and last True indices of every row of a N x L boolean tensor (0 and L - 1 for empty rows)."""
+    length = occupied.shape[1]
+    empty = ~occupied.any(dim=1)
+    first = occupied.int().argmax(dim=1).masked_fill(empty, 0)
+    last = (length - 1 - occupied.flip(1).int().argmax(dim=1)).masked_fill(empty, length - 1)
+    return first, last
+
+
+def crop_resize(img, boxes, size):
+    """Crop a box out of every image of a batch and resize the crops to size x size, in a single grid_sample call.
+
+    Parameters:
+        img (tensor)   -- N x C x H x W images
+        boxes (tensor) -- N x 4 inclusive (xmin, ymin, xmax, ymax) boxes, as returned by <mask_bbox>
+        size (int)     -- the size of the output crops
+
+    It matches a bilinear F.interpolate(..., align_corners=False) of every crop, and is differentiable w.r.t. img.
+    """
+    H, W = img.shape[2:]
+    boxes = boxes.to(img.dtype)
+    steps = (torch.arange(size, device=img.device, dtype=img.dtype) + 0.5) / size
+    xs = _box_source_coords(steps, boxes[:, 0], boxes[:, 2])  # N x size, in input pixel coordinates
+    ys = _box_source_coords(steps, boxes[:, 1], boxes[:, 3])
+    grid = torch.stack(torch.broadcast_tensors(_normalize_coords(xs, W).unsqueeze(1),
+                                               _normalize_coords(ys, H).unsqueeze(2)), dim=-1)
+    return F.grid_sample(img, grid, mode='bilinear', padding_mode='border', align_corners=False)
+
+
+def paste_resized(patches, boxes, size):
+    """Resize every patch of a batch to its box and paste it into a zero image, in a single grid_sample call.
+
+    Parameters:
+        patches (tensor) -- N x C x h x w patches (e.g., generated from the crops of <crop_resize>)
+        boxes (tensor)   -- N x 4 inclusive (xmin, ymin, xmax, ymax) boxes, as returned by <mask_bbox>
+        size (tuple)     -- the (H, W) size of the output images
+
+    Returns N x C x H x W images, holding the resized patches inside the boxes and zeros outside.
+    """
+    H, W = size
+    h, w = patches.shape[2:]
+    boxes = boxes.to(patches.dtype)
+    xmin, ymin, xmax, ymax = [b.unsqueeze(1) for b in boxes.unbind(1)]
+    xs = torch.arange(W, device=patches.device, dtype=patches.dtype).unsqueeze(0)
+    ys = torch.arange(H, device=patches.device, dtype=patches.dtype).unsqueeze(0)
+    # source coordinates in the patch of every output pixel, as in F.interpolate(patch, (box height, box width))
+    src_x = ((xs - xmin + 0.5) * w / (xmax - xmin + 1) - 0.5).clamp(0, w - 1)
+    src_y = ((ys - ymin + 0.5) * h / (ymax - ymin + 1) - 0.5).clamp(0, h - 1)
+    grid = torch.stack(torch.broadcast_tensors(_normalize_coords(src_x, w).unsqueeze(1),
+                                               _normalize_coords(src_y, h).unsqueeze(2)), dim=-1)
+    inside = ((ys >= ymin) & (ys <= ymax)).unsqueeze(2) & ((xs >= xmin) & (xs <= xmax)).unsqueeze(1)
+    pasted = F.grid_sample(patches, grid, mode='bilinear', padding_mode='border', align_corners=False)
+    return pasted * inside.unsqueeze(1).to(pasted.dtype)
+
+
+def _box_source_coords(steps, low, high):
+    """Pixel coordinates sampled by a bilinear resize of the [low, high] pixel range, for relative output positions <steps>."""
+    low, high = low.unsqueeze(1), high.unsqueeze(1)
+    coords = low + steps.unsqueeze(0) * (high - low + 1) - 0.5
+    return torch.max(torch.min(coords, high), low)
+
+
+def _normalize_coords(coords, length):
+    """Convert pixel coordinates to the [-1, 1] range of grid_sample (align_corners=False)."""
+    return (2 * coords + 1) / length - 1
+
+
+def is_per_sample(net):
+    """Return True if the output of a network for a sample does not depend on the other samples of the batch,
+    i.e., unless the network has batch normalization layers in training mode."""
+    return not any(isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training for m in net.modules())
+
+
+def tiled_forward(net, input, tile_size, overlap=32, tile_batch_size=4):
+    """Run a fully convolutional network on overlapping tiles of a large image and blend the results.
+
+    Parameters:
+        net (network)         -- an image-to-image network whose output has the spatial size of its input
+        input (tensor)        -- N x C x H x W images
+        tile_size (int)       -- the size of the square tiles; it must be a valid input size for <net> (e.g., a multiple of 256 for unet_256)
+        overlap (int)         -- the number of pixels shared by neighbouring tiles, blended with linear ramps
+        tile_batch_size (int) -- the number of tiles processed by the network at once
+
+    The peak memory of the network is bounded by the tile batch, whatever the image size.
+    Images smaller than a tile along an axis are processed whole along that axis.
+    """
+    N, _, H, W = input.shape
+    tile_h, tile_w = min(tile_size, H), min(tile_size, W)
+    ys = _tile_starts(H, tile_h, overlap)
+    xs = _tile_starts(W, tile_w, overlap)
+    weight = _tile_ramp(tile_h, overlap, input).unsqueeze(1) * _tile_ramp(tile_w, overlap, input).unsqueeze(0)
+    positions = [(y, x) for y in ys for x in xs]
+    output = weight_sum = None
+    for i in range(0, len(positions), tile_batch_size):
+        chunk = positions[i:i + tile_batch_size]
+        tiles = torch.cat([input[:, :, y:y + tile_h, x:x + tile_w] for y, x in chunk], 0)
+        results = net(tiles)
+        if output is None:
+            output = results.new_zeros((N, results.shape[1], H, W), dtype=torch.float32)  # accumulated in full precision
+            weight_sum = results.new_zeros((H, W), dtype=torch.float32)
+        for (y, x), result in zip(chunk, results.split(N, 0)):
+            output[:, :, y:y + tile_h, x:x + tile_w] += result.float() * weight
+            weight_sum[y:y + tile_h, x:x + tile_w] += weight
+    return (output / weight_sum).to(results.dtype)
+
+
+def _tile_starts(length, tile, overlap):
+    """Return the start positions of the tiles covering [0, length), with at least <overlap> shared pixels."""
+    stride = max(tile - overlap, 1)
+    starts = list(range(0, length - tile, stride))
+    return starts + [length - tile]
+
+
+def _tile_ramp(tile, overlap, like):
+    """Return the 1D blending weights of a tile: a linear ramp over <overlap> pixels at both ends, 1 inside."""
+    pos = torch.arange(tile, device=like.device, dtype=torch.float32) + 0.5
+    if overlap <= 0:
+        return torch.ones_like(pos)
+    return torch.min(torch.min(pos, tile - pos) / overlap, torch.ones_like(pos))
+
+
 class ResnetGenerator(nn.Module):
     """Resnet-based generator that consists of Resnet blocks between a few downsampling/upsampling operations.
 
@@ -86,20 +86,22 @@ class SegmentationModel(BaseModel):
     
     def backward_f_s(self):
         label_A = self.input_A_label
-        # forward only real source image through semantic classifier
-        pred_A = self.netf_s(self.real_A)
-        self.loss_f_s = self.criterionf_s(pred_A, label_A)#.squeeze(1))
-        self.loss_f_s.backward()
+        # only real source image through semantic classifier, as predicted in forward
+        pred_A = self.pred_real_A
+        self.loss_f_s = self.criterionf_s(pred_A, label_A.long())#.squeeze(1))
+        self.backward_loss(self.loss_f_s, 'f_s')
 
         
     def optimize_parameters(self):
         """Calculate losses, gradients, and update network weights; called in every training iteration"""
 
         # forward
-        self.forward()      # compute fake images and reconostruction images.
+        self.set_requires_grad([self.netf_s], True)
+        with self.timed('forward'), self.autocast():
+            self.forward()      # compute fake images and reconostruction images.
 
         # f_s
-        self.set_requires_grad([self.netf_s], True)
         self.optimizer_f_s.zero_grad()
-        self.backward_f_s()
-        self.optimizer_f_s.step()
+        with self.timed('backward_f_s'), self.autocast():
+            self.backward_f_s()
+        self.step_optimizer('f_s')
@@ -64,8 +64,8 @@ class TemplateModel(BaseModel):
             self.criterionLoss = torch.nn.L1Loss()
             # define and initialize optimizers. You can define one optimizer for each network.
             # If two networks are updated at the same time, you can use itertools.chain to group them. See cycle_gan_model.py for an example.
-            self.optimizer = torch.optim.Adam(self.netG.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
-            self.optimizers = [self.optimizer]
+            self.optimizer_G = torch.optim.Adam(self.netG.parameters(), lr=opt.lr, betas=(opt.beta1, 0.999))
+            self.optimizers = [self.optimizer_G]
 
         # Our program will automatically call <model.setup> to define schedulers, load networks, and print networks
 
@@ -89,11 +89,13 @@ class TemplateModel(BaseModel):
         # caculate the intermediate results if necessary; here self.output has been computed during function <forward>
         # calculate loss given the input and intermediate results
         self.loss_G = self.criterionLoss(self.output, self.data_B) * self.opt.lambda_regression
-        self.loss_G.backward()       # calculate gradients of network G w.r.t. loss_G
+        self.backward_loss(self.loss_G, 'G')       # calculate gradients of network G w.r.t. loss_G
 
     def optimize_parameters(self):
         """Update network weights; it will be called in every training iteration."""
-        self.forward()               # first call forward to calculate intermediate results
-        self.optimizer.zero_grad()   # clear network G's existing gradients
-        self.backward()              # calculate gradients for network G
-        self.optimizer.step()        # update gradients for network G
+        with self.timed('forward'), self.autocast():
+            self.forward()               # first call forward to calculate intermediate results
+        self.optimizer_G.zero_grad()   # clear network G's existing gradients
+        with self.timed('backward'), self.autocast():
+            self.backward()              # calculate gradients for network G
+        self.step_optimizer('G')     # update gradients for network G
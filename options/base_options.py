@@ -41,19 +41,34 @@ class BaseOptions():
         parser.add_argument('--dataset_mode', type=str, default='unaligned', help='chooses how datasets are loaded. [unaligned | aligned | single | colorization]')
         parser.add_argument('--direction', type=str, default='AtoB', help='AtoB or BtoA')
         parser.add_argument('--serial_batches', action='store_true', help='if true, takes images in order to make batches, otherwise takes them randomly')
+        parser.add_argument('--pair_sampling', type=str, default='uniform', help='how the images of the two domains of unaligned datasets are paired at every epoch: every B image equally often, every class of B images equally often, every class in proportion spread over the epoch, or a B image drawn at random by the data loading workers [uniform | balanced | stratified | random]. The classes are the subdirectories of trainB (the mask classes with --mask_bbox_index)')
+        parser.add_argument('--pair_seed', type=int, default=0, help='seed of the pairs of images drawn by --pair_sampling (combined with the epoch)')
         parser.add_argument('--num_threads', default=4, type=int, help='# threads for loading data')
         parser.add_argument('--batch_size', type=int, default=1, help='input batch size')
+        parser.add_argument('--persistent_workers', action='store_true', help='if specified, keep the data loading workers alive between epochs instead of starting new ones every epoch')
+        parser.add_argument('--pin_memory', action='store_true', help='if specified, the data loader returns batches in pinned (page-locked) memory, for faster and asynchronous copies to the GPU')
+        parser.add_argument('--prefetch_factor', type=int, default=0, help='number of batches loaded in advance by each data loading worker; 0 for the default of PyTorch (2)')
+        parser.add_argument('--drop_last', action='store_true', help='if specified, drop the last incomplete batch of every epoch')
+        parser.add_argument('--sharing_strategy', type=str, default='', help='strategy used by the data loading workers to share tensors with the main process [file_descriptor | file_system]; file_system avoids "too many open files" errors. Empty for the default of the platform')
+        parser.add_argument('--device_prefetch', action='store_true', help='if specified, copy the next batch to the GPU on a separate CUDA stream while the current batch is processed. No effect on CPU')
         parser.add_argument('--load_size', type=int, default=286, help='scale images to this size')
         parser.add_argument('--crop_size', type=int, default=256, help='then crop to this size')
         parser.add_argument('--max_dataset_size', type=int, default=float("inf"), help='Maximum number of samples allowed per dataset. If the dataset directory contains more than max_dataset_size, only a subset is loaded.')
         parser.add_argument('--preprocess', type=str, default='resize_and_crop', help='scaling and cropping of images at load time [resize_and_crop | crop | scale_width | scale_width_and_crop | none]')
         parser.add_argument('--no_flip', action='store_true', help='if specified, do not flip the images for data augmentation')
         parser.add_argument('--no_rotate', action='store_true', help='if specified, do not rotate the images for data augmentation')
+        parser.add_argument('--batched_augment', action='store_true', help='if specified, datasets only decode images; resizing, cropping, flipping and normalization are applied to whole batches as tensors (on the GPU if any). [unaligned | aligned | single | unaligned_packed | aligned_packed | unaligned_tar | aligned_tar | unaligned_labeled_mask | unaligned_labeled_mask_tar]')
+        parser.add_argument('--image_cache_mb', type=int, default=0, help='RAM budget (in MB, per data loading worker) of the cache of decoded and resized images. 0 disables it. [unaligned | aligned | single | unaligned_labeled]')
+        parser.add_argument('--image_cache_dir', type=str, default='', help='if specified, the image cache spills to this directory, shared by all the data loading workers')
+        parser.add_argument('--image_cache_disk_mb', type=int, default=10240, help='disk budget of the image cache, in MB; least recently used images are evicted beyond it')
+        parser.add_argument('--dataset_manifest_dir', type=str, default='', help='if specified, the listing of the image directories is cached in manifests in this directory; later runs only list again the directories modified since')
+        parser.add_argument('--stream_dataset', action='store_true', help='if specified, start training while the image directories are still scanned; every epoch uses the images found so far')
         parser.add_argument('--display_winsize', type=int, default=256, help='display window size for both visdom and HTML')
         # additional parameters
         parser.add_argument('--epoch', type=str, default='latest', help='which epoch to load? set to latest to use latest cached model')
         parser.add_argument('--load_iter', type=int, default='0', help='which iteration to load? if load_iter > 0, the code will load models by iter_[load_iter]; otherwise, the code will load models by [epoch]')
         parser.add_argument('--verbose', action='store_true', help='if specified, print more debugging information')
+        parser.add_argument('--amp', action='store_true', help='use automatic mixed precision: fp16 with loss scaling on GPU, bf16 on CPU')
         parser.add_argument('--suffix', default='', type=str, help='customized suffix: opt.name = opt.name + suffix: e.g., {model}_{netG}_size{load_size}')
         parser.add_argument('--semantic_nclasses',default=10,type=int,help='number of classes of the semantic loss classifier')
         self.initialized = True
@@ -16,6 +16,12 @@ class TestOptions(BaseOptions):
         # Dropout and Batchnorm has different behavioir during training and test.
         parser.add_argument('--eval', action='store_true', help='use eval mode during test time.')
         parser.add_argument('--num_test', type=int, default=50, help='how many test images to run')
+        parser.add_argument('--test_batch_size', type=int, default=1, help='number of images per forward pass at test time')
+        parser.add_argument('--test_num_threads', type=int, default=0, help='# threads for loading the test data')
+        parser.add_argument('--num_writers', type=int, default=4, help='# threads for encoding and writing the result images; 0 writes them synchronously')
+        parser.add_argument('--tile_size', type=int, default=0, help='if > 0, run the generators on overlapping tiles of this size, so that the memory does not grow with the image size (use with --preprocess none). It must be a valid input size for --netG')
+        parser.add_argument('--tile_overlap', type=int, default=32, help='number of pixels shared by neighbouring tiles, blended to hide the seams')
+        parser.add_argument('--tile_batch_size', type=int, default=4, help='number of tiles processed by the generator at once')
         # rewrite devalue values
         parser.set_defaults(model='test')
         # To avoid cropping, the load_size should be the same as crop_size
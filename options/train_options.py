@@ -18,12 +18,17 @@ class TrainOptions(BaseOptions):
         parser.add_argument('--display_port', type=int, default=8097, help='visdom port of the web display')
         parser.add_argument('--update_html_freq', type=int, default=1000, help='frequency of saving training results to html')
         parser.add_argument('--print_freq', type=int, default=100, help='frequency of showing training results on console')
+        parser.add_argument('--profile', action='store_true', help='time the phases of every training step (with device synchronization) and report percentiles, images/sec and the data stall ratio every <print_freq> iterations, also in profile_log.jsonl')
+        parser.add_argument('--display_async', action='store_true', help='display and save the training results (visdom and HTML) in a background process, so that training does not wait for them')
         parser.add_argument('--no_html', action='store_true', help='do not save intermediate training results to [opt.checkpoints_dir]/[opt.name]/web/')
         # network saving and loading parameters
         parser.add_argument('--save_latest_freq', type=int, default=5000, help='frequency of saving the latest results')
         parser.add_argument('--save_epoch_freq', type=int, default=5, help='frequency of saving checkpoints at the end of epochs')
         parser.add_argument('--save_by_iter', action='store_true', help='whether saves model by iteration')
         parser.add_argument('--continue_train', action='store_true', help='continue training: load the latest model')
+        parser.add_argument('--dist_backend', type=str, default='', help='torch.distributed backend of a multi-process training started with torchrun: nccl | gloo; by default nccl with GPUs, gloo on CPU')
+        parser.add_argument('--resume', action='store_true', help='resume training exactly where the checkpoint --epoch was saved: networks, optimizers, schedulers, loss scalers, image pools, random generators and counters. Implies --continue_train')
+        parser.add_argument('--checkpoint_keep', type=int, default=3, help='number of iteration checkpoints (see --save_by_iter) to keep on disk; 0 keeps all of them')
         parser.add_argument('--epoch_count', type=int, default=1, help='the starting epoch count, we save the model by <epoch_count>, <epoch_count>+<save_latest_freq>, ...')
         parser.add_argument('--phase', type=str, default='train', help='train, val, test, etc')
         # training parameters
@@ -0,0 +1,231 @@
+"""Benchmark the networks and the training steps of the models on synthetic data, to detect performance regressions.
+
+It measures the latency (median over --iters runs, after --warmup runs), the throughput (images/sec),
+the peak memory and the number of parameters of:
+    - every generator of define_G (forward and backward pass)
+    - every discriminator of define_D (forward and backward pass)
+    - the segmentation network VGG16_FCN8s (define_f)
+    - one <optimize_parameters> step of the cycle_gan, pix2pix, cycle_gan_semantic_mask and cycle_gan_mask_patch models
+Every benchmark runs in a separate process, so that its peak memory is measured on its own; a process that dies
+(e.g., killed when out of memory) or runs longer than --timeout is recorded as failed, and the next benchmarks still run.
+The peak memory is the peak resident memory of the process (over the one after the imports) on CPU,
+and the peak allocated memory on GPU.
+
+Example:
+    Record a baseline:
+        python scripts/benchmark.py --output benchmark_baseline.json
+    Compare against the baseline (the exit code is 1 if a benchmark is slower than --tolerance):
+        python scripts/benchmark.py --baseline benchmark_baseline.json
+    Run the generators only, with smaller images:
+        python scripts/benchmark.py --only netG --size 128
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+from queue import Empty
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # make the repository packages importable
+import torch  # noqa: E402
+from models import networks, create_model  # noqa: E402
+from options.train_options import TrainOptions  # noqa: E402
+
+GENERATORS = ['resnet_9blocks', 'resnet_6blocks', 'unet_128', 'unet_256']
+DISCRIMINATORS = ['basic', 'n_layers', 'pixel']
+MODELS = OrderedDict([  # model -> extra training options
+    ('cycle_gan', []),
+    ('pix2pix', ['--netG', 'unet_256']),
+    ('cycle_gan_semantic_mask', ['--semantic_nclasses', '10']),
+    ('cycle_gan_mask_patch', ['--use_disc_patch']),
+])
+
+
+def network_benchmark(args, device, net, input_nc):
+    """Return a function running a forward and backward pass of <net> on a synthetic batch."""
+    net = net.to(device)
+    input = torch.randn(args.batch_size, input_nc, args.size, args.size, device=device)
+
+    def run():
+        net.zero_grad(set_to_none=True)
+        output = net(input)
+        output = output[0] if isinstance(output, (tuple, list)) else output
+        output.float().mean().backward()
+    return run, net
+
+
+def model_benchmark(args, device, model_name, checkpoints_dir):
+    """Return a function running one <optimize_parameters> step of a model on a synthetic batch."""
+    argv = ['--dataroot', 'none', '--model', model_name, '--checkpoints_dir', checkpoints_dir, '--name', 'benchmark',
+            '--batch_size', str(args.batch_size), '--load_size', str(args.size), '--crop_size', str(args.size)]
+    saved_argv, sys.argv = sys.argv, [sys.argv[0]] + argv + MODELS[model_name]
+    try:
+        opt = TrainOptions().gather_options()
+    finally:
+        sys.argv = saved_argv
+    opt.isTrain = True
+    opt.gpu_ids = [] if device.type == 'cpu' else [torch.cuda.current_device()]
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        model = create_model(opt)
+    shape = (args.batch_size, opt.input_nc, args.size, args.size)
+    data = {'A': torch.randn(shape), 'B': torch.randn(shape), 'A_paths': ['A'] * args.batch_size, 'B_paths': ['B'] * args.batch_size}
+    if model_name in ('cycle_gan_semantic_mask', 'cycle_gan_mask_patch'):
+        nclasses = getattr(opt, 'semantic_nclasses', 2)
+        for domain in ('A', 'B'):  # a label mask holding a square object in the middle of the image
+            label = torch.zeros(args.batch_size, 1, args.size, args.size, dtype=torch.long)
+            label[:, :, args.size // 4:3 * args.size // 4, args.size // 4:3 * args.size // 4] = nclasses - 1
+            data[domain + '_label'] = label
+
+    def run():
+        model.set_input(data)
+        model.optimize_parameters()
+    return run, torch.nn.ModuleList([getattr(model, 'net' + name) for name in model.model_names])
+
+
+def get_benchmarks():
+    """Return the names of all the benchmarks."""
+    return (['netG_' + name for name in GENERATORS] + ['netD_' + name for name in DISCRIMINATORS] +
+            ['f_s_VGG16_FCN8s'] + ['step_' + name for name in MODELS])
+
+
+def run_benchmark(args, name):
+    """Run the benchmark <name> and return its results."""
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    device = torch.device('cuda:%d' % args.gpu_id if args.gpu_id >= 0 else 'cpu')
+    sync = torch.cuda.synchronize if device.type == 'cuda' else (lambda: None)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with tempfile.TemporaryDirectory() as checkpoints_dir:
+        if name.startswith('netG_'):
+            net = networks.define_G(3, 3, 64, name[len('netG_'):], 'instance', False, 'normal', 0.02, [])
+            run, net = network_benchmark(args, device, net, 3)
+        elif name.startswith('netD_'):
+            net = networks.define_D(3, 64, name[len('netD_'):], 5, 'instance', 'normal', 0.02, [])
+            run, net = network_benchmark(args, device, net, 3)
+        elif name == 'f_s_VGG16_FCN8s':
+            run, net = network_benchmark(args, device, networks.define_f(3, 10), 3)
+        else:
+            run, net = model_benchmark(args, device, name[len('step_'):], checkpoints_dir)
+        if device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(device)
+        for _ in range(args.warmup):
+            run()
+        times = []
+        for _ in range(args.iters):
+            sync()
+            start = time.perf_counter()
+            run()
+            sync()
+            times.append(time.perf_counter() - start)
+    if device.type == 'cuda':
+        peak_mb = torch.cuda.max_memory_allocated(device) / 2 ** 20
+    else:  # ru_maxrss is in KB on Linux, in bytes on macOS
+        peak_mb = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start) / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10)
+    latency = sorted(times)[len(times) // 2]
+    return OrderedDict([('latency_ms', latency * 1000), ('min_latency_ms', min(times) * 1000),
+                        ('images_per_sec', args.batch_size / latency), ('peak_memory_mb', peak_mb),
+                        ('params_m', sum(p.numel() for p in net.parameters()) / 1e6)])
+
+
+def _worker(args, name, queue):
+    try:
+        queue.put(run_benchmark(args, name))
+    except Exception as e:
+        queue.put('%s: %s' % (type(e).__name__, e))
+
+
+def wait_result(process, queue, timeout):
+    """Return the result of a benchmark process, or an error message if it died or timed out (<timeout> seconds, 0 for none)."""
+    start = time.time()
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            pass
+        if not process.is_alive():  # the result may have been put just before the process exited
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                return 'the process exited with code %s' % process.exitcode
+        if timeout > 0 and time.time() - start > timeout:
+            process.kill()
+            return 'timed out after %d s' % timeout
+
+
+def compare(results, baseline, tolerance):
+    """Print the changes against the baseline; return the names of the benchmarks slower than <tolerance>, or failed."""
+    regressions = []
+    print('\n%-32s %12s %12s %8s %12s %12s' % ('benchmark', 'baseline ms', 'ms', 'change', 'base mem MB', 'mem MB'))
+    for name, result in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if isinstance(base, str):  # failed in the baseline
+            base = None
+        if isinstance(result, str):  # failed
+            print('%-32s %12s %12s' % (name, '%.1f' % base['latency_ms'] if base is not None else '-', 'failed'))
+            if base is not None:
+                regressions.append(name)
+            continue
+        if base is None:
+            print('%-32s %12s %12.1f' % (name, '-', result['latency_ms']))
+            continue
+        change = result['latency_ms'] / base['latency_ms'] - 1
+        flag = ''
+        if change > tolerance:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        print('%-32s %12.1f %12.1f %+7.1f%% %12.1f %12.1f%s' % (name, base['latency_ms'], result['latency_ms'], 100 * change,
+                                                               base['peak_memory_mb'], result['peak_memory_mb'], flag))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark the networks and training steps on synthetic data')
+    parser.add_argument('--only', type=str, nargs='+', default=[], help='run the benchmarks whose name contains one of these strings (e.g., netG step_cycle_gan)')
+    parser.add_argument('--batch_size', type=int, default=1, help='input batch size')
+    parser.add_argument('--size', type=int, default=256, help='size of the (square) input images')
+    parser.add_argument('--warmup', type=int, default=2, help='number of runs before the measurements')
+    parser.add_argument('--iters', type=int, default=5, help='number of measured runs')
+    parser.add_argument('--threads', type=int, default=4, help='number of CPU threads used by torch')
+    parser.add_argument('--gpu_id', type=int, default=-1, help='gpu id; -1 for CPU')
+    parser.add_argument('--output', type=str, default='', help='save the results to this JSON file (e.g., to record a baseline)')
+    parser.add_argument('--baseline', type=str, default='', help='compare the results with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative latency increase reported as a regression')
+    parser.add_argument('--timeout', type=float, default=600, help='time limit of every benchmark, in seconds; 0 for none')
+    args = parser.parse_args()
+
+    settings = OrderedDict((k, getattr(args, k)) for k in ('batch_size', 'size', 'warmup', 'iters', 'threads', 'gpu_id'))
+    results = OrderedDict([('settings', settings), ('torch', torch.__version__), ('benchmarks', OrderedDict())])
+    ctx = multiprocessing.get_context('spawn')
+    for name in get_benchmarks():
+        if args.only and not any(s in name for s in args.only):
+            continue
+        queue = ctx.Queue()
+        process = ctx.Process(target=_worker, args=(args, name, queue))
+        process.start()
+        result = wait_result(process, queue, args.timeout)
+        process.join()
+        results['benchmarks'][name] = result
+        if isinstance(result, str):  # recorded as failed
+            print('%-32s failed: %s' % (name, result))
+            continue
+        print('%-32s %9.1f ms %9.2f img/s %9.1f MB %8.2fM params' % (name, result['latency_ms'], result['images_per_sec'],
+                                                                    result['peak_memory_mb'], result['params_m']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print('results saved to %s' % args.output)
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline['settings'] != settings:
+            print('warning: the baseline was recorded with different settings: %s' % dict(baseline['settings']))
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('%d regression(s): %s' % (len(regressions), ', '.join(regressions)))
+            sys.exit(1)
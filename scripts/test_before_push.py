@@ -12,6 +12,9 @@ def run(command):
 
 
 if __name__ == '__main__':
+    # unit checks of the data and model utilities
+    run('python scripts/test_units.py')
+
     # download mini datasets
     if not os.path.exists('./datasets/mini'):
         run('bash ./datasets/download_cyclegan_dataset.sh mini')
@@ -34,11 +37,37 @@ if __name__ == '__main__':
     # cyclegan train/test
     run('python train.py --model cycle_gan --name temp_cyclegan --dataroot ./datasets/mini --n_epochs 1 --n_epochs_decay 0 --save_latest_freq 10  --print_freq 1 --display_id -1')
     run('python test.py --model test --name temp_cyclegan --dataroot ./datasets/mini --num_test 1 --model_suffix "_A" --no_dropout')
+    run('python train.py --model cycle_gan --name temp_cyclegan --dataroot ./datasets/mini --n_epochs 2 --n_epochs_decay 0 --save_latest_freq 10 --print_freq 1 --display_id -1 --resume --epoch latest')
+
+    # cyclegan train with batched data augmentation
+    run('python train.py --model cycle_gan --name temp_cyclegan_batched --dataroot ./datasets/mini --batched_augment --batch_size 2 --n_epochs 1 --n_epochs_decay 0 --save_latest_freq 10 --print_freq 1 --display_id -1')
+
+    # cyclegan train with the classes of the B images drawn equally often
+    run('python train.py --model cycle_gan --name temp_cyclegan_balanced --dataroot ./datasets/mini --pair_sampling balanced --pair_seed 1 --n_epochs 1 --n_epochs_decay 0 --save_latest_freq 10 --print_freq 1 --display_id -1')
+
+    # cyclegan train with a manifest of the image folders, while they are scanned
+    run('python train.py --model cycle_gan --name temp_cyclegan_stream --dataroot ./datasets/mini --dataset_manifest_dir ./checkpoints/temp_manifests --stream_dataset --n_epochs 1 --n_epochs_decay 0 --save_latest_freq 10 --print_freq 1 --display_id -1')
+
+    # cyclegan train on packed (memory-mapped) folders
+    run('python datasets/pack_dataset.py --dataroot ./datasets/mini --folders trainA trainB')
+    run('python train.py --model cycle_gan --name temp_cyclegan_packed --dataroot ./datasets/mini --dataset_mode unaligned_packed --n_epochs 1 --n_epochs_decay 0 --save_latest_freq 10 --print_freq 1 --display_id -1')
+
+    # cyclegan train on tar shards, read sequentially
+    run('python datasets/make_tar_shards.py --dataroot ./datasets/mini --folders trainA trainB')
+    run('python train.py --model cycle_gan --name temp_cyclegan_tar --dataroot ./datasets/mini --dataset_mode unaligned_tar --n_epochs 1 --n_epochs_decay 0 --save_latest_freq 10 --print_freq 1 --display_id -1')
 
     # pix2pix train/test
     run('python train.py --model pix2pix --name temp_pix2pix --dataroot ./datasets/mini_pix2pix --n_epochs 1 --n_epochs_decay 5 --save_latest_freq 10 --display_id -1')
     run('python test.py --model pix2pix --name temp_pix2pix --dataroot ./datasets/mini_pix2pix --num_test 1')
 
+    # pix2pix train on a packed folder
+    run('python datasets/pack_dataset.py --dataroot ./datasets/mini_pix2pix --folders train')
+    run('python train.py --model pix2pix --name temp_pix2pix_packed --dataroot ./datasets/mini_pix2pix --dataset_mode aligned_packed --n_epochs 1 --n_epochs_decay 0 --save_latest_freq 10 --display_id -1')
+
+    # pix2pix train on tar shards
+    run('python datasets/make_tar_shards.py --dataroot ./datasets/mini_pix2pix --folders train')
+    run('python train.py --model pix2pix --name temp_pix2pix_tar --dataroot ./datasets/mini_pix2pix --dataset_mode aligned_tar --batched_augment --n_epochs 1 --n_epochs_decay 0 --save_latest_freq 10 --display_id -1')
+
     # template train/test
     run('python train.py --model template --name temp2 --dataroot ./datasets/mini_pix2pix --n_epochs 1 --n_epochs_decay 0 --save_latest_freq 10 --display_id -1')
     run('python test.py --model template --name temp2 --dataroot ./datasets/mini_pix2pix --num_test 1')
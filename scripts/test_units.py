@@ -0,0 +1,784 @@
+# Small checks of the data and model utilities that do not need a dataset,
+# e.g., the batched transforms against their PIL counterparts.
+# Run them with 'python scripts/test_units.py' (or with pytest); scripts/test_before_push.py runs them too.
+import io
+import os
+import sys
+import pickle
+import contextlib
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def make_images(dir, sizes, seed=0):
+    """Write random RGB images of the given (width, height) sizes to <dir>; return their paths."""
+    rng = np.random.RandomState(seed)
+    os.makedirs(dir, exist_ok=True)
+    paths = []
+    for i, (w, h) in enumerate(sizes):
+        paths.append(os.path.join(dir, '%03d.png' % i))
+        Image.fromarray(rng.randint(0, 256, (h, w, 3), dtype=np.uint8)).save(paths[-1])
+    return paths
+
+
+def test_packed_folder():
+    from data.packed_folder import pack_folder, PackedImageFolder
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_images(os.path.join(tmp, 'trainA'), [(500, 500), (31, 17), (500, 500)])
+        assert pack_folder(os.path.join(tmp, 'trainA'), os.path.join(tmp, 'trainA_packed'), shard_size=1) == 3
+        folder = PackedImageFolder(os.path.join(tmp, 'trainA_packed'))
+        assert len(folder.shard_names) == 2  # the third image does not fit in the first 1 MB shard
+        assert folder.paths == paths
+        for i, path in enumerate(paths):
+            assert np.array_equal(folder.get_array(i), np.asarray(Image.open(path).convert('RGB')))
+        folder = pickle.loads(pickle.dumps(folder))  # as sent to the data loading workers: the shards are mapped again
+        assert np.array_equal(np.asarray(folder.get_image(1)), np.asarray(Image.open(paths[1])))
+        assert len(PackedImageFolder(os.path.join(tmp, 'trainA_packed'), max_dataset_size=2)) == 2
+
+
+def transform_opt(**kwargs):
+    """Return the options used by the transforms, with the given values."""
+    opt = dict(preprocess='resize_and_crop', load_size=40, crop_size=32, no_flip=False, no_rotate=True)
+    opt.update(kwargs)
+    return SimpleNamespace(**opt)
+
+
+def pil_batch(opt, imgs, params, grayscale=False):
+    """Transform PIL images one by one with get_transform and the given params, as the datasets without --batched_augment."""
+    from data.base_dataset import get_transform
+    return torch.stack([get_transform(opt, p, grayscale=grayscale)(img) for img, p in zip(imgs, params)])
+
+
+def batched_params(params):
+    """Collate the params of get_params / get_seg_params"""
+    from torch.utils.data.dataloader import default_collate
+    return default_collate(params)
+
+
+def test_batched_transform():
+    """BatchedTransform gives the same images as get_transform: exactly without resizing, closely with resizing (mean error on the [-1, 1] scale)."""
+    from data.base_dataset import BatchedTransform, get_params, to_uint8_tensor
+    rng = np.random.RandomState(0)
+    for preprocess, sizes, tolerance in [('crop', [(48, 40)] * 4, 1e-5),  # grayscale: PIL may round a pixel differently
+                                         ('resize_and_crop', [(60, 50)] * 4, 0.005),
+                                         ('resize_and_crop', [(60, 50), (37, 41), (40, 40), (80, 64)], 0.005),  # a list of images
+                                         ('scale_width', [(50, 30)] * 2, 0.005),
+                                         ('none', [(42, 38)] * 2, 0.005)]:
+        for grayscale in (False, True):
+            opt = transform_opt(preprocess=preprocess)
+            imgs = [Image.fromarray(rng.randint(0, 256, (h, w, 3), dtype=np.uint8)) for w, h in sizes]
+            params = [get_params(opt, img.size) for img in imgs]
+            expected = pil_batch(opt, imgs, params, grayscale)
+            tensors = [to_uint8_tensor(img) for img in imgs]
+            batch = torch.stack(tensors) if len(set(sizes)) == 1 else tensors
+            result = BatchedTransform(opt, grayscale)(batch, batched_params(params))
+            assert result.shape == expected.shape, (preprocess, result.shape, expected.shape)
+            error = (result - expected).abs().mean().item()
+            assert error <= tolerance, (preprocess, grayscale, error)
+
+
+def test_image_cache():
+    """ImageCache evicts the least recently used entries beyond its RAM budget, and beyond its disk budget down to 90% of it;
+    the hit/miss counters are shared with the data loading workers."""
+    import multiprocessing
+    from data.base_dataset import ImageCache
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ImageCache(1, tmp, 1)  # 1 MB each: three entries of 300 KB fit
+        entries = {key: [np.full(300 * 1024, i, dtype=np.uint8)] for i, key in enumerate('abcd')}
+        for key in 'abc':
+            cache.put(key, entries[key])
+        assert cache.get('a') is entries['a']  # a is now more recent than b and c in RAM, but not on disk
+        cache.put('d', entries['d'])
+        assert list(cache.ram) == ['c', 'a', 'd']
+        assert [os.path.exists(cache._disk_path(key)) for key in 'abcd'] == [False, True, True, True]
+        assert cache.disk_used.value <= 0.9 * cache.disk_bytes
+        assert np.array_equal(cache.get('b')[0], entries['b'][0])  # from disk, back in RAM
+        assert list(cache.ram) == ['a', 'd', 'b']
+        assert cache.get('e') is None
+
+        worker = multiprocessing.get_context('fork').Process(target=lambda: [cache.get(key) for key in 'dc'])
+        worker.start()
+        worker.join()
+        assert worker.exitcode == 0
+        stats = cache.stats()
+        assert (stats['ram_hits'], stats['disk_hits'], stats['misses']) == (2, 2, 1) and stats['hit_rate'] == 0.8
+        assert abs(stats['disk_mb'] - sum(os.path.getsize(cache._disk_path(key)) for key in 'bcd') / 1024 / 1024) < 1e-9
+        cache.reset_stats()
+        assert cache.stats()['misses'] == 0 and ImageCache(1, tmp, 1).disk_used.value == cache.disk_used.value
+
+
+def test_mask_bbox_crop_paste():
+    """The batched box crop and paste of cycle_gan_mask_patch match a bilinear F.interpolate of every box."""
+    import torch.nn.functional as F
+    from models.networks import mask_bbox, crop_resize, paste_resized
+    masks = torch.zeros(3, 20, 24, dtype=torch.uint8)
+    masks[0, 3:9, 5:17] = 1
+    masks[1, 12, 2] = masks[1, 4, 20] = 2  # two pixels: the box spans from one to the other
+    boxes = mask_bbox(masks)
+    assert boxes.tolist() == [[5, 3, 16, 8], [2, 4, 20, 12], [0, 0, 23, 19]]  # an empty mask gets the full image
+    imgs = torch.randn(3, 3, 20, 24, requires_grad=True)
+    crops = crop_resize(imgs, boxes, 16)
+    patches = torch.randn(3, 3, 16, 16)
+    pasted = paste_resized(patches, boxes, (20, 24))
+    for i, (xmin, ymin, xmax, ymax) in enumerate(boxes.tolist()):
+        crop = F.interpolate(imgs[i:i + 1, :, ymin:ymax + 1, xmin:xmax + 1], size=(16, 16), mode='bilinear', align_corners=False)
+        assert torch.allclose(crops[i:i + 1], crop, atol=1e-5)
+        expected = torch.zeros(1, 3, 20, 24)
+        expected[:, :, ymin:ymax + 1, xmin:xmax + 1] = F.interpolate(patches[i:i + 1], size=(ymax - ymin + 1, xmax - xmin + 1),
+                                                                      mode='bilinear', align_corners=False)
+        assert torch.allclose(pasted[i:i + 1], expected, atol=1e-5)
+    crops.sum().backward()
+    assert imgs.grad[0, :, 3:9, 5:17].abs().sum() > 0 and imgs.grad[0, :, :3].abs().sum() == 0  # only the box gets gradients
+
+
+def test_pair_sampler():
+    """PairSampler uses every image floor or ceil(max / size) times, splits the pairs between processes, and balances the classes."""
+    from collections import Counter
+    from data.pair_sampler import PairSampler
+    pairs = list(PairSampler(10, 4, seed=3))
+    assert len(pairs) == 10 and sorted(a for a, _ in pairs) == list(range(10))
+    assert sorted(Counter(b for _, b in pairs).values()) == [2, 2, 3, 3]
+    assert pairs == list(PairSampler(10, 4, seed=3))  # reproducible
+    sampler = PairSampler(10, 4, seed=3)
+    sampler.set_epoch(1)
+    assert list(sampler) != pairs
+
+    shards = [list(PairSampler(10, 4, seed=3, num_replicas=3, rank=r)) for r in range(3)]
+    assert [len(shard) for shard in shards] == [4, 4, 4]  # 12 pairs: the last ones are repeated
+    merged = [shards[r][i] for i in range(4) for r in range(3)]  # the processes take every third pair of the same sequence
+    assert sorted(a for a, _ in merged[:10]) == list(range(10))
+
+    B_classes = [0] * 90 + [1] * 10
+    balanced = Counter(B_classes[b] for _, b in PairSampler(1000, 100, 'balanced', B_classes, seed=0))
+    assert abs(balanced[0] - balanced[1]) < 150  # about 500 each
+    stratified = [B_classes[b] for _, b in PairSampler(1000, 100, 'stratified', B_classes, seed=0)]
+    assert Counter(stratified) == {0: 900, 1: 100}
+    assert all(0 < Counter(stratified[i:i + 100])[1] < 20 for i in range(0, 1000, 100))  # spread over the epoch
+
+
+def test_image_manifest():
+    """The manifest of scan_images gives the listing of os.walk, and only directories whose stat changed are listed again."""
+    import json
+    from data.image_folder import make_dataset, get_manifest_path
+    with tempfile.TemporaryDirectory() as tmp:
+        dir, manifest_dir = os.path.join(tmp, 'trainB'), os.path.join(tmp, 'manifests')
+        make_images(os.path.join(dir, 'cats'), [(8, 8)] * 3)
+        make_images(os.path.join(dir, 'dogs'), [(8, 8)] * 2)
+        make_images(dir, [(8, 8)])
+        expected = make_dataset(dir)
+        assert make_dataset(dir, manifest_dir=manifest_dir) == expected
+        stream = make_dataset(dir, manifest_dir=manifest_dir, stream=True)
+        stream.done.wait()
+        assert sorted(stream) == sorted(expected)
+
+        manifest_path = get_manifest_path(dir, manifest_dir)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        manifest['dirs']['cats']['files'].append('listed.png')  # an unchanged directory is not listed again
+        manifest['dirs']['dogs']['files'].append('stale.png')
+        with open(manifest_path, 'w') as f:
+            json.dump(manifest, f)
+        make_images(os.path.join(dir, 'dogs'), [(8, 8)] * 3)  # adds 002.png, and changes the stat of dogs
+        paths = make_dataset(dir, manifest_dir=manifest_dir)
+        assert os.path.join(dir, 'cats', 'listed.png') in paths
+        assert os.path.join(dir, 'dogs', 'stale.png') not in paths and os.path.join(dir, 'dogs', '002.png') in paths
+        assert make_dataset(dir, 4, manifest_dir=manifest_dir) == paths[:4]
+
+
+def test_tar_shards():
+    """Samples written by write_tar_shards are read back in order, and TarShardFolder.split gives every sample to one unit."""
+    from data.tar_shards import write_tar_shards, read_tar_shard, TarShardFolder
+    samples = [{'img.png': os.urandom(300 * 1024), 'path': ('%d.png' % i).encode()} for i in range(7)]
+    with tempfile.TemporaryDirectory() as tmp:
+        assert write_tar_shards(samples, tmp, shard_size=1) == 7  # 3 samples per 1 MB shard
+        folder = TarShardFolder(tmp)
+        assert folder.counts == [3, 3, 1]
+        assert [s for shard in folder.shards for s in read_tar_shard(os.path.join(tmp, shard))] == samples
+        for num_units in (2, 3, 5, 10):  # whole shards, strided samples, fewer samples than units
+            units = folder.split([2, 0, 1], num_units)
+            read = [[s['path'] for s in folder.read(shards, offset, stride)] for shards, offset, stride, _ in units]
+            assert [len(r) for r in read] == [count for _, _, _, count in units]
+            if num_units <= 7:
+                assert sorted(p for r in read for p in r) == sorted(s['path'] for s in samples)
+            else:
+                assert all(len(r) == 7 for r in read)
+        assert len(TarShardFolder(tmp, max_dataset_size=4)) == 4
+        try:
+            TarShardFolder(tmp, max_dataset_size=0)
+            assert False, 'an empty folder is rejected'
+        except AssertionError as e:
+            assert 'no samples' in str(e)
+
+
+def test_mask_bbox_index_transforms():
+    """The boxes of --mask_bbox_index follow resize, crop, flip and rotation: each step bounds the object (exactly for a
+    rectangle), and the box returned with the mask is models.networks.mask_bbox of the transformed mask."""
+    import random
+    import torchvision.transforms.functional as TF
+    from data.base_dataset import get_transform_seg, mask_to_tensor, _resize_bbox, _crop_bbox, _flip_bbox, _rotate_bbox, _exact_bbox, _EMPTY_BBOX
+    from models.networks import mask_bbox
+
+    def box(mask):
+        return mask_bbox(mask_to_tensor(mask)).tolist()[0]
+
+    def bounds(bound, mask):
+        xmin, ymin, xmax, ymax = box(mask)
+        return bound[0] <= xmin and bound[1] <= ymin and xmax <= bound[2] and ymax <= bound[3]
+
+    shapes = {'rectangle': [(5, 12, 8, 20)], 'L': [(2, 28, 3, 7), (23, 28, 3, 33)], 'blobs': [(2, 6, 2, 6), (22, 27, 28, 34)]}
+    for name, rects in shapes.items():
+        array = np.zeros((30, 36), dtype=np.uint8)  # non-square: rotations crop the corners
+        for y0, y1, x0, x1 in rects:
+            array[y0:y1, x0:x1] = 1
+        mask = Image.fromarray(array, mode='L')
+        steps = [(TF.resize(mask, [40, 40], Image.NEAREST), _resize_bbox(box(mask), mask.size, (40, 40)))]
+        steps += [(TF.crop(mask, i, j, 16, 16), _crop_bbox(box(mask), i, j, 16, 16)) for i, j in [(0, 0), (4, 10), (14, 20)]]
+        steps += [(TF.hflip(mask), _flip_bbox(box(mask), mask.size))]
+        steps += [(TF.rotate(mask, angle, fill=(0,)), _rotate_bbox(box(mask), angle, mask.size)) for angle in (90, 180, 270)]
+        for transformed, bbox in steps:
+            if not np.asarray(transformed).any():
+                assert bbox is _EMPTY_BBOX or name != 'rectangle', (name, bbox)
+            elif name == 'rectangle':
+                assert bbox == box(transformed), (name, bbox, box(transformed))
+            else:
+                assert bounds(bbox, transformed), (name, bbox, box(transformed))
+        bound = _crop_bbox(box(mask), 0, 24, 6, 6)  # the crop holds no mask pixel, but the L and the blobs are not bounded by it
+        assert _exact_bbox(mask_to_tensor(TF.crop(mask, 0, 24, 6, 6))[0], bound) == [0, 0, 5, 5]
+
+        for preprocess in ('resize_and_crop', 'crop', 'none'):
+            transform = get_transform_seg(transform_opt(preprocess=preprocess, crop_size=16, no_rotate=False))
+            for seed in range(20):
+                random.seed(seed)
+                _, label, bbox = transform(Image.new('RGB', mask.size), mask, box(mask))
+                assert bbox.tolist() == mask_bbox(label).tolist()[0], (name, preprocess, seed, bbox, mask_bbox(label))
+
+
+def test_batched_mask_transform():
+    """BatchedMaskTransform matches the PIL ops of get_transform_seg (resize, crop, flip, quarter turn) for given params."""
+    import torchvision.transforms.functional as TF
+    from data.base_dataset import BatchedMaskTransform, get_seg_params, to_uint8_tensor, mask_to_tensor
+    rng = np.random.RandomState(0)
+    for preprocess, (w, h) in [('resize_and_crop', (50, 44)), ('crop', (40, 36)), ('none', (36, 28))]:  # 'none': non-square rotations
+        opt = transform_opt(preprocess=preprocess, no_rotate=False)
+        imgs = [Image.fromarray(rng.randint(0, 256, (h, w, 3), dtype=np.uint8)) for _ in range(8)]
+        masks = [Image.fromarray(rng.randint(0, 5, (h, w), dtype=np.uint8), mode='L') for _ in range(8)]
+        params = [get_seg_params(opt, (w, h)) for _ in range(8)]
+        for i, p in enumerate(params):  # every quarter turn, with and without flip
+            p['rot'], p['flip'] = i % 4, i >= 4
+        expected_imgs, expected_masks = [], []
+        for img, mask, p in zip(imgs, masks, params):
+            if 'resize' in preprocess:
+                img, mask = TF.resize(img, [opt.load_size] * 2, Image.BICUBIC), TF.resize(mask, [opt.load_size] * 2, Image.NEAREST)
+            if 'crop' in preprocess:
+                x, y = p['crop_pos']
+                img, mask = TF.crop(img, y, x, opt.crop_size, opt.crop_size), TF.crop(mask, y, x, opt.crop_size, opt.crop_size)
+            if p['flip']:
+                img, mask = TF.hflip(img), TF.hflip(mask)
+            img, mask = TF.rotate(img, 90 * p['rot']), TF.rotate(mask, 90 * p['rot'], fill=(0,))
+            expected_imgs.append(TF.to_tensor(img) * 2 - 1)
+            expected_masks.append(mask_to_tensor(mask))
+        result_imgs, result_masks = BatchedMaskTransform(opt)(torch.stack([to_uint8_tensor(img) for img in imgs]),
+                                                              torch.stack([mask_to_tensor(mask) for mask in masks]), batched_params(params))
+        assert torch.equal(result_masks, torch.stack(expected_masks)), preprocess
+        assert result_masks.dtype == torch.uint8
+        error = (result_imgs - torch.stack(expected_imgs)).abs()
+        assert error.mean() <= (0.005 if 'resize' in preprocess else 1e-6), (preprocess, error.mean())
+
+
+def test_tiled_forward():
+    """Tiles of a network without cross-pixel mixing blend back into its output on the whole image."""
+    from models.networks import tiled_forward
+    torch.manual_seed(0)
+    net = torch.nn.Conv2d(3, 2, 1)
+    with torch.no_grad():
+        for (h, w), tile_size, overlap, tile_batch_size in [((70, 53), 32, 8, 3),  # not multiples of the stride; 3 does not divide 9 tiles
+                                                            ((20, 18), 32, 8, 4),  # smaller than a tile
+                                                            ((20, 50), 16, 4, 1),  # smaller along one axis only
+                                                            ((64, 64), 16, 0, 5),  # no overlap
+                                                            ((45, 45), 16, 0, 2)]:
+            input = torch.randn(2, 3, h, w)
+            output = tiled_forward(net, input, tile_size, overlap, tile_batch_size)
+            assert torch.allclose(output, net(input), atol=1e-5), ((h, w), tile_size, overlap, tile_batch_size)
+
+
+def query_sequential(pool, pool_size, images, swap, slots):
+    """Query a list <pool> of images as the per-image ImagePool did, with the given swap and slot draws of the images
+    that find the pool full."""
+    returned, k = [], 0
+    for image in images:
+        if len(pool) < pool_size:
+            pool.append(image)
+            returned.append(image)
+            continue
+        if swap[k]:
+            returned.append(pool[slots[k]].clone())
+            pool[slots[k]] = image
+        else:
+            returned.append(image)
+        k += 1
+    return torch.stack(returned)
+
+
+def test_image_pool():
+    """ImagePool returns and keeps the images of the sequential algorithm for the same draws, also when several images
+    of a batch swap the same slot or a batch fills the pool, and its state dict restores it."""
+    from util.image_pool import ImagePool
+    pool_size = 4
+    collisions = 0
+    for seed in range(20):
+        image_pool, pool = ImagePool(pool_size), []
+        for step, batch_size in enumerate([3, 3, 6, 6, 1, 8]):  # the second batch fills the last slot and swaps the others
+            images = torch.randn(batch_size, 3, 2, 2)
+            num = batch_size - max(min(pool_size - len(pool), batch_size), 0)
+            torch.manual_seed(seed * 100 + step)
+            swap, slots = torch.rand(num) > 0.5, torch.randint(0, pool_size, (num,))  # the draws of query
+            collisions += len(slots[swap]) - len(set(slots[swap].tolist()))
+            expected = query_sequential(pool, pool_size, images, swap.tolist(), slots.tolist())
+            torch.manual_seed(seed * 100 + step)
+            assert torch.equal(image_pool.query(images), expected), (seed, step)
+            assert torch.equal(image_pool.images[:image_pool.num_imgs], torch.stack(pool)), (seed, step)
+    assert collisions > 0
+
+    for num_imgs in (2, pool_size):  # a pool being filled, and a full one
+        image_pool = ImagePool(pool_size)
+        image_pool.query(torch.randn(num_imgs, 3, 2, 2))
+        restored = ImagePool(pool_size)
+        restored.load_state_dict(image_pool.state_dict())
+        images = torch.randn(5, 3, 2, 2)
+        torch.manual_seed(0)
+        returned = image_pool.query(images)
+        torch.manual_seed(0)
+        assert torch.equal(restored.query(images), returned)
+        assert torch.equal(restored.images[:restored.num_imgs], image_pool.images[:image_pool.num_imgs])
+    assert ImagePool(0).state_dict() == {} and ImagePool(pool_size).state_dict() == {}
+
+
+def test_checkpointer():
+    """Checkpoints are written from the snapshot taken by save, the old iteration checkpoints beyond --checkpoint_keep are
+    deleted, and a failed write keeps the previous file."""
+    from util.checkpoint import Checkpointer
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ('iter_1_net_G.pth', 'iter_1_state.pth', 'latest_net_G.pth'):  # from a previous run
+            torch.save(torch.zeros(1), os.path.join(tmp, name))
+        checkpointer = Checkpointer(tmp, keep=2)
+        weights = torch.zeros(3)
+        for n in (2, 3, 4):
+            weights += 1
+            checkpointer.save({'iter_%d_net_G.pth' % n: weights, 'iter_%d_state.pth' % n: {'total_iters': n}}, 'iter_%d' % n)
+        weights += 1  # after the snapshot
+        checkpointer.save({'latest_net_G.pth': weights})
+        checkpointer.wait()
+        assert sorted(os.listdir(tmp)) == ['iter_3_net_G.pth', 'iter_3_state.pth', 'iter_4_net_G.pth', 'iter_4_state.pth', 'latest_net_G.pth']
+        assert torch.load(os.path.join(tmp, 'iter_4_net_G.pth')).tolist() == [3, 3, 3]
+        assert torch.load(os.path.join(tmp, 'iter_4_state.pth')) == {'total_iters': 4}
+
+        checkpointer.save({'latest_net_G.pth': lambda: None})  # cannot be pickled
+        try:
+            checkpointer.wait()
+            assert False, 'the failed write is reported'
+        except RuntimeError:
+            pass
+        assert torch.load(os.path.join(tmp, 'latest_net_G.pth')).tolist() == [4, 4, 4]
+        checkpointer.close()
+
+
+def quiet():
+    """Silence the prints of the options and the models."""
+    return contextlib.redirect_stdout(io.StringIO())
+
+
+def train_options(*args):
+    """Return the options of train.py for the given command line arguments, on CPU."""
+    from options.train_options import TrainOptions
+    argv = sys.argv
+    sys.argv = ['train.py', '--dataroot', '.', '--gpu_ids', '-1'] + list(args)
+    try:
+        with quiet():
+            return TrainOptions().parse()
+    finally:
+        sys.argv = argv
+
+
+def test_training_state():
+    """The optimizers, schedulers and image pools saved by save_training_state are restored by load_training_state, so
+    that a resumed model takes the same steps as the uninterrupted one."""
+    from models import create_model
+    from util.checkpoint import set_rng_state
+    with tempfile.TemporaryDirectory() as tmp:
+        opt = train_options('--checkpoints_dir', tmp, '--name', 'state', '--model', 'cycle_gan', '--netG', 'resnet_6blocks',
+                            '--ngf', '4', '--ndf', '4', '--crop_size', '32', '--pool_size', '4', '--n_epochs', '1',
+                            '--n_epochs_decay', '2', '--lr_policy', 'linear', '--checkpoint_keep', '1')
+        torch.manual_seed(0)
+        data = [{'A': torch.randn(2, 3, 32, 32), 'B': torch.randn(2, 3, 32, 32), 'A_paths': ['a'] * 2, 'B_paths': ['b'] * 2}
+                for _ in range(4)]
+
+        def step(model, input):
+            model.set_input(input)
+            model.optimize_parameters()
+
+        with quiet():
+            model = create_model(opt)
+            model.setup(opt)
+        for input in data[:2]:
+            step(model, input)
+        with quiet():
+            model.update_learning_rate()
+        model.save_training_state('iter_2', {'epoch': 1, 'epoch_iter': 4, 'total_iters': 4, 'epoch_rng': None})
+        model.checkpointer.wait()
+
+        with quiet():
+            resumed = create_model(opt)
+            resumed.setup(opt)
+            resumed.load_networks('iter_2')
+            state = resumed.load_training_state('iter_2')
+        assert state['total_iters'] == 4 and state['epoch_iter'] == 4
+        assert resumed.schedulers[0].last_epoch == 1
+        assert resumed.optimizers[0].param_groups[0]['lr'] == model.optimizers[0].param_groups[0]['lr'] < opt.lr
+        assert torch.equal(resumed.fake_A_pool.images[:4], model.fake_A_pool.images[:4])
+        assert resumed.optimizer_G.state_dict()['state'][0]['step'] == model.optimizer_G.state_dict()['state'][0]['step']
+        for m in (model, resumed):
+            set_rng_state(state['rng'])
+            for input in data[2:]:
+                step(m, input)
+        for name in ('G_A', 'D_B'):
+            for p, q in zip(getattr(model, 'net' + name).parameters(), getattr(resumed, 'net' + name).parameters()):
+                assert torch.equal(p, q), name
+        model.checkpointer.close()
+        resumed.checkpointer.close()
+
+
+def distributed_process(rank, tmp, world_size):
+    """Process <rank> of test_distributed_training."""
+    import torch.distributed as dist
+    from models import create_model
+    from models.base_model import BaseModel
+    from util.checkpoint import set_rng_state
+    dist.init_process_group('gloo', init_method='file://' + os.path.join(tmp, 'init'), rank=rank, world_size=world_size)
+    torch.manual_seed(rank)
+    model = SimpleNamespace(schedulers=[], save_dir=tmp, device=torch.device('cpu'))
+    state = BaseModel.get_training_state(model, {'epoch': 1, 'epoch_rng': 'epoch %d' % rank})
+    draws = torch.rand(3)
+    if rank == 0:
+        torch.save(state, os.path.join(tmp, 'latest_state.pth'))
+    dist.barrier()
+    with quiet():
+        resumed = BaseModel.load_training_state(model, 'latest')
+    set_rng_state(resumed['rng'])
+    assert torch.equal(torch.rand(3), draws) and resumed['epoch_rng'] == 'epoch %d' % rank
+
+    opt = train_options('--checkpoints_dir', tmp, '--name', 'rank%d' % rank, '--model', 'cycle_gan', '--netG', 'resnet_6blocks',
+                        '--ngf', '4', '--ndf', '4', '--norm', 'batch')
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        model = create_model(opt)
+        model.setup(opt)
+    model.checkpointer.close()
+    assert ('warning: batch normalization is only synchronized' in output.getvalue()) == (rank == 0)
+    dist.destroy_process_group()
+
+
+def test_distributed_training():
+    """In a multi-process training on CPU, a checkpoint restores the random state of every process, and using batch
+    normalization, which is not synchronized on CPU, prints a warning."""
+    import torch.multiprocessing as mp
+    with tempfile.TemporaryDirectory() as tmp:
+        mp.spawn(distributed_process, args=(tmp, 2), nprocs=2)
+
+
+def test_amp():
+    """With --amp on CPU, the networks run in bf16 within autocast, the weights stay in fp32, and the steps are close to fp32 ones;
+    the loss scalers are pass-through and not saved."""
+    from models import create_model
+    with tempfile.TemporaryDirectory() as tmp:
+        models = {}
+        for amp in ([], ['--amp']):
+            opt = train_options('--checkpoints_dir', tmp, '--name', 'amp', '--model', 'cycle_gan', '--netG', 'resnet_6blocks',
+                                '--ngf', '4', '--ndf', '4', '--crop_size', '32', *amp)
+            torch.manual_seed(0)
+            with quiet():
+                models[bool(amp)] = model = create_model(opt)
+                model.setup(opt)
+            torch.manual_seed(1)
+            model.set_input({'A': torch.randn(2, 3, 32, 32), 'B': torch.randn(2, 3, 32, 32), 'A_paths': ['a'] * 2, 'B_paths': ['b'] * 2})
+            model.optimize_parameters()
+            model.checkpointer.close()
+        model, reference = models[True], models[False]
+        with model.autocast():
+            assert model.netG_A(model.real_A).dtype == torch.bfloat16
+        assert all(p.dtype == torch.float32 for p in model.netG_A.parameters())
+        assert (model.fake_B.float() - reference.fake_B).abs().mean() < 0.02
+        losses, reference_losses = model.get_current_losses(), reference.get_current_losses()
+        assert all(abs(losses[name] - reference_losses[name]) < 0.05 * max(abs(reference_losses[name]), 1) for name in losses), losses
+        assert not any(scaler.is_enabled() for scaler in model.scalers.values())
+        assert sorted(model.get_network_files('latest')) == ['latest_net_%s.pth' % name for name in ('D_A', 'D_B', 'G_A', 'G_B')]
+
+
+def test_image_saver():
+    """ImageSaver writes the images and the HTML rows of save_images, one image at a time, for whole batches."""
+    from collections import OrderedDict
+    from util import html
+    from util.visualizer import ImageSaver, save_images
+    torch.manual_seed(0)
+    batches = [(OrderedDict([('real', torch.rand(3, 3, 8, 12) * 2 - 1), ('mask', torch.randint(0, 4, (3, 8, 12)))]),
+                ['dir/img%d_%d.png' % (b, i) for i in range(3)]) for b in range(2)]
+    nums = [5, 2]  # as test.py with --num_test 5: the second batch is saved in part
+    with tempfile.TemporaryDirectory() as tmp:
+        webpages = {}
+        for num_writers in (None, 0, 2):  # None: save_images
+            webpages[num_writers] = webpage = html.HTML(os.path.join(tmp, str(num_writers)), 'test')
+            if num_writers is None:
+                for (visuals, paths), num in zip(batches, nums):
+                    for i in range(len(paths[:num])):
+                        save_images(webpage, OrderedDict((k, v[i:i + 1]) for k, v in visuals.items()), paths[i:i + 1])
+            else:
+                saver = ImageSaver(webpage, num_writers=num_writers)
+                for (visuals, paths), num in zip(batches, nums):
+                    saver.save(visuals, paths, num=num)
+                saver.close()
+            webpage.save()
+        expected = sorted(os.listdir(webpages[None].get_image_dir()))
+        assert len(expected) == 10
+        for num_writers in (0, 2):
+            image_dir = webpages[num_writers].get_image_dir()
+            assert sorted(os.listdir(image_dir)) == expected
+            for name in expected:
+                assert np.array_equal(np.asarray(Image.open(os.path.join(image_dir, name))),
+                                      np.asarray(Image.open(os.path.join(webpages[None].get_image_dir(), name))))
+            with open(os.path.join(tmp, str(num_writers), 'index.html')) as f, open(os.path.join(tmp, 'None', 'index.html')) as g:
+                assert f.read() == g.read()
+
+
+def test_display_mask():
+    """display_mask colors every pixel of non-square masks and batches of masks, as a per-pixel loop over the palette."""
+    from util.util import display_mask, mask_palette, tensor2im, MASK_COLORS
+    rng = np.random.RandomState(0)
+    for shape in [(3, 5), (5, 3), (2, 4, 6)]:
+        mask = rng.randint(0, len(MASK_COLORS), shape)
+        expected = np.zeros(shape + (3,), dtype=np.uint8)
+        for index in np.ndindex(*shape):
+            expected[index] = MASK_COLORS[mask[index]]
+        assert np.array_equal(display_mask(mask), expected), shape
+        colors = display_mask(torch.from_numpy(mask).to(torch.uint8))
+        assert colors.dtype == torch.uint8 and np.array_equal(colors.numpy(), expected), shape
+    assert np.array_equal(tensor2im(torch.from_numpy(mask)), expected[0])  # the first mask of a batch, as an image
+
+    mask = np.array([[0, 1], [25, 30]])  # classes beyond the fixed colors get the same colors at every call
+    assert np.array_equal(display_mask(mask)[1], mask_palette(40)[[25, 30]])
+    assert np.array_equal(display_mask(mask), display_mask(torch.from_numpy(mask)).numpy())
+
+
+def test_display_async():
+    """With --display_async, the background display process writes the images and the HTML page of a synchronous Visualizer."""
+    from collections import OrderedDict
+    from util.visualizer import Visualizer
+    torch.manual_seed(0)
+    results = [(OrderedDict([('real_A', torch.rand(2, 3, 8, 8) * 2 - 1), ('mask', torch.randint(0, 4, (2, 8, 8)))]), epoch, save)
+               for epoch, save in [(1, False), (1, True), (2, False), (3, True)]]
+    with tempfile.TemporaryDirectory() as tmp:
+        for display_async in (False, True):
+            opt = SimpleNamespace(isTrain=True, no_html=False, display_id=-1, display_winsize=256, name='display',
+                                  display_port=8097, display_async=display_async, checkpoints_dir=os.path.join(tmp, str(display_async)))
+            with quiet():
+                visualizer = Visualizer(opt)
+                for visuals, epoch, save in results:
+                    if epoch == 2:
+                        visualizer.reset()
+                    visualizer.display_current_results(visuals, epoch, save)
+                visualizer.close()
+        web_dirs = [os.path.join(tmp, str(display_async), 'display', 'web') for display_async in (False, True)]
+        names = sorted(os.listdir(os.path.join(web_dirs[0], 'images')))
+        assert names == ['epoch%.3d_%s.png' % (epoch, label) for epoch in (1, 2, 3) for label in ('mask', 'real_A')]
+        assert sorted(os.listdir(os.path.join(web_dirs[1], 'images'))) == names
+        for name in names:
+            images = [np.asarray(Image.open(os.path.join(web_dir, 'images', name))) for web_dir in web_dirs]
+            assert np.array_equal(*images), name
+        pages = []
+        for web_dir in web_dirs:
+            with open(os.path.join(web_dir, 'index.html')) as f:
+                pages.append(f.read())
+        assert pages[0] == pages[1]
+
+
+def test_forward_fused():
+    """forward_fused gives the outputs and gradients of separate calls, and runs the batches separately when the network
+    has batch norm layers in training mode or the images have different sizes."""
+    from models.base_model import BaseModel
+    from models.networks import define_G
+    torch.manual_seed(0)
+    calls = []
+    with quiet():
+        nets = {norm: define_G(3, 3, 4, 'resnet_6blocks', norm) for norm in ('instance', 'batch')}
+    for norm, net in nets.items():
+        net.register_forward_pre_hook(lambda module, input: calls.append(len(input[0])))
+        for sizes, fused in [((32, 32, 32), norm == 'instance'), ((32, 32, 48), False)]:
+            inputs = [torch.randn(n, 3, size, size, requires_grad=True) for n, size in zip((2, 1, 2), sizes)]
+            calls.clear()
+            outputs = BaseModel.forward_fused(None, net, inputs)
+            assert calls == ([5] if fused else [2, 1, 2]), (norm, sizes, calls)
+            grads = torch.autograd.grad(sum((o * o).sum() for o in outputs), inputs)
+            for x, output, grad in zip(inputs, outputs, grads):
+                expected = net(x)
+                assert output.shape == expected.shape and torch.allclose(output, expected, atol=1e-5), (norm, sizes)
+                assert torch.allclose(grad, torch.autograd.grad((expected * expected).sum(), x)[0], atol=1e-4), (norm, sizes)
+    nets['batch'].eval()  # running statistics: the samples are independent
+    calls.clear()
+    BaseModel.forward_fused(None, nets['batch'], [torch.randn(1, 3, 32, 32), torch.randn(1, 3, 32, 32)])
+    assert calls == [2]
+
+
+def test_loss_averaging():
+    """get_current_losses averages the losses accumulated on the device since the last call, or returns the current ones."""
+    from models.base_model import BaseModel
+    model = SimpleNamespace(loss_names=['G', 'D', 'idt'], device=torch.device('cpu'), loss_sums=None, loss_count=0)
+    model.accumulate_losses = lambda: BaseModel.accumulate_losses(model)
+    for G, D in [(1.0, 4.0), (2.0, 5.0), (6.0, 6.0)]:
+        model.loss_G, model.loss_D, model.loss_idt = torch.tensor(G, requires_grad=True) * 1, D, 0  # tensors, floats and 0
+        model.accumulate_losses()
+    assert model.loss_sums.device.type == 'cpu' and not model.loss_sums.requires_grad
+    assert BaseModel.get_current_losses(model) == {'G': 3.0, 'D': 5.0, 'idt': 0.0}
+    assert model.loss_count == 0
+    assert BaseModel.get_current_losses(model) == {'G': 6.0, 'D': 6.0, 'idt': 0.0}  # nothing accumulated since
+
+
+def test_sem_gate_threshold():
+    """The semantic losses of cycle_gan_semantic are used once the classifier loss is below --sem_gate_threshold."""
+    from models import create_model
+    with tempfile.TemporaryDirectory() as tmp:
+        for threshold in (0, 100):
+            opt = train_options('--checkpoints_dir', tmp, '--name', 'gate', '--model', 'cycle_gan_semantic', '--netG', 'resnet_6blocks',
+                                '--ngf', '4', '--ndf', '4', '--crop_size', '32', '--semantic_nclasses', '3',
+                                '--sem_gate_threshold', str(threshold))
+            with quiet():
+                model = create_model(opt)
+                model.setup(opt)
+            torch.manual_seed(0)
+            for step in range(2):
+                model.set_input({'A': torch.randn(2, 3, 32, 32), 'B': torch.randn(2, 3, 32, 32), 'A_paths': ['a'] * 2,
+                                 'B_paths': ['b'] * 2, 'A_label': torch.tensor([0, 2])})
+                model.optimize_parameters()
+                used = model.loss_sem_AB.item() > 0 and model.loss_sem_BA.item() > 0
+                assert used == (step == 1 and threshold == 100), (threshold, step)  # no classifier loss at the first step
+            model.checkpointer.close()
+
+
+def test_semantic_classifier_reuse():
+    """The classifier loss of cycle_gan_semantic backpropagates through the prediction of real_A made in forward, so that
+    each image goes through the classifier once, and equals the loss of a separate call of the classifier."""
+    import copy
+    from models import create_model
+    with tempfile.TemporaryDirectory() as tmp:
+        opt = train_options('--checkpoints_dir', tmp, '--name', 'semantic', '--model', 'cycle_gan_semantic', '--netG', 'resnet_6blocks',
+                            '--ngf', '4', '--ndf', '4', '--crop_size', '32', '--semantic_nclasses', '3')
+        with quiet():
+            model = create_model(opt)
+            model.setup(opt)
+        calls = []
+        model.netCLS.register_forward_pre_hook(lambda module, input: calls.append(len(input[0])))
+        torch.manual_seed(0)
+        for _ in range(2):
+            model.set_input({'A': torch.randn(2, 3, 32, 32), 'B': torch.randn(2, 3, 32, 32), 'A_paths': ['a'] * 2,
+                             'B_paths': ['b'] * 2, 'A_label': torch.tensor([0, 2])})
+            netCLS = copy.deepcopy(model.netCLS)
+            calls.clear()
+            model.optimize_parameters()
+            assert sum(calls) == 4 * 2  # real_A, real_B, fake_A and fake_B
+            assert torch.equal(model.loss_CLS, model.criterionCLS(netCLS(model.real_A), model.input_A_label))
+        model.checkpointer.close()
+
+
+def test_data_loader_options():
+    """The data loader options reach the DataLoader, which only gets prefetch_factor and persistent_workers with worker
+    processes, and a loader with workers, --drop_last and --device_prefetch returns the batches of a sequential one."""
+    from data import create_dataset
+    with tempfile.TemporaryDirectory() as tmp:
+        make_images(os.path.join(tmp, 'trainA'), [(40, 40)] * 5)
+        make_images(os.path.join(tmp, 'trainB'), [(40, 40)] * 3, seed=1)
+
+        def loader(*args):
+            opt = train_options('--dataroot', tmp, '--checkpoints_dir', tmp, '--dataset_mode', 'unaligned', '--load_size', '32',
+                                '--crop_size', '32', '--serial_batches', '--no_flip', '--batch_size', '2', *args)
+            with quiet():
+                return create_dataset(opt)
+
+        sequential = loader('--num_threads', '0', '--prefetch_factor', '3', '--persistent_workers')
+        assert sequential.dataloader.num_workers == 0 and not sequential.dataloader.persistent_workers
+        parallel = loader('--num_threads', '2', '--prefetch_factor', '3', '--persistent_workers', '--pin_memory', '--drop_last',
+                          '--device_prefetch')
+        assert parallel.dataloader.prefetch_factor == 3 and parallel.dataloader.persistent_workers
+        assert not parallel.dataloader.pin_memory  # only with a GPU
+        assert len(sequential) == 5 and len(parallel) == 4
+        expected = list(sequential)[:2]
+        for epoch in range(2):  # the persistent workers serve the second epoch
+            batches = list(parallel)
+            assert len(batches) == 2
+            for batch, expected_batch in zip(batches, expected):
+                assert torch.equal(batch['A'], expected_batch['A']) and batch['A_paths'] == expected_batch['A_paths']
+
+
+def test_skip_sampler():
+    """A resumed epoch skips the indices already done, with the same order as the interrupted one."""
+    from data import SkipSampler
+    sampler = SkipSampler(torch.utils.data.RandomSampler(range(10)))
+    torch.manual_seed(0)
+    full = list(sampler)
+    calls = []
+    sampler.skip(4, lambda: calls.append(len(calls)))
+    torch.manual_seed(0)
+    assert list(sampler) == full[4:] and calls == [0]
+    assert len(list(sampler)) == 10  # only the next epoch is skipped
+
+
+def test_pseudo_label_cache():
+    from util.pseudo_label_cache import PseudoLabelCache
+    cache = PseudoLabelCache(2, max_age=1)
+    label = torch.zeros(4, 4, dtype=torch.uint8)
+    assert cache.get([('a.png', 0, 0, 0, 0)], 0) == [None]
+    cache.put([('a.png', 0, 0, 0, 0)], [label], 0)
+    assert cache.get([('a.png', 0, 0, 0, 0)], 1)[0] is label      # hit
+    assert cache.get([('a.png', 0, 0, 1, 0)], 1) == [None]        # another view of the image
+    assert cache.get([('a.png', 0, 0, 0, 0)], 2) == [None]        # stale
+    cache.put([('b.png',), ('c.png',), ('d.png',)], [label] * 3, 2)
+    assert list(cache.entries) == [('c.png',), ('d.png',)]        # least recently used entries dropped
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+
+def test_pseudo_labels_B_cache_hit():
+    """The pseudo-labels of cycle_gan_semantic_mask are served by the cache, with keys from set_input."""
+    from models.cycle_gan_semantic_mask_model import CycleGANSemanticMaskModel
+    from util.pseudo_label_cache import PseudoLabelCache
+    calls = []
+
+    def f_s(imgs):
+        calls.append(len(imgs))
+        return imgs[:, :2]  # 2 classes
+
+    model = SimpleNamespace(opt=SimpleNamespace(direction='AtoB', semantic_nclasses=2), isTrain=True, device=torch.device('cpu'),
+                            netf_s=f_s, pseudo_label_cache=PseudoLabelCache(8), f_s_updates=0, visual_names=['real_B', 'input_B_label'])
+    imgs = torch.randn(2, 3, 4, 4)
+    params = {'crop_pos': (torch.tensor([0, 1]), torch.tensor([0, 0])), 'flip': torch.tensor([False, True])}  # get_params: no 'rot'
+    batch = {'A': imgs, 'B': imgs, 'A_paths': ['a0', 'a1'], 'B_paths': ['b0', 'b1'], 'A_label': torch.zeros(2, 1, 4, 4), 'B_params': params}
+    CycleGANSemanticMaskModel.set_input(model, batch)
+    assert model.B_keys == [('b0', 0, 0, False, 0), ('b1', 1, 0, True, 0)]
+    assert 'input_B_label' not in model.visual_names  # no B labels to display
+    labels = CycleGANSemanticMaskModel.get_pseudo_labels_B(model)
+    assert calls == [2]
+    batch['B_paths'] = ['b1', 'b2']
+    batch['B_params'] = {'crop_pos': (torch.tensor([1, 0]), torch.tensor([0, 0])), 'flip': torch.tensor([True, False])}
+    CycleGANSemanticMaskModel.set_input(model, batch)
+    assert CycleGANSemanticMaskModel.get_pseudo_labels_B(model)[0].equal(labels[1])
+    assert calls == [2, 1]  # b1 is a hit
+    assert model.pseudo_label_cache.stats()['hits'] == 1
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            print(name)
+            test()
+    print('all checks passed')
@@ -30,15 +30,15 @@ import os
 from options.test_options import TestOptions
 from data import create_dataset
 from models import create_model
-from util.visualizer import save_images
+from util.visualizer import ImageSaver
 from util import html
 
 
 if __name__ == '__main__':
     opt = TestOptions().parse()  # get test options
     # hard-code some parameters for test
-    opt.num_threads = 0   # test code only supports num_threads = 1
-    opt.batch_size = 1    # test code only supports batch_size = 1
+    opt.num_threads = opt.test_num_threads  # threads for loading the test data
+    opt.batch_size = opt.test_batch_size    # images per forward pass
     opt.serial_batches = True  # disable data shuffling; comment this line if results on randomly chosen images are needed.
     opt.no_flip = True    # no flip; comment this line if results on flipped images are needed.
     opt.display_id = -1   # no visdom display; the test code saves the results to a HTML file.
@@ -56,14 +56,18 @@ if __name__ == '__main__':
     # For [CycleGAN]: It should not affect CycleGAN as CycleGAN uses instancenorm without dropout.
     if opt.eval:
         model.eval()
+    saver = ImageSaver(webpage, aspect_ratio=opt.aspect_ratio, width=opt.display_winsize, num_writers=opt.num_writers)
+    num_done = 0  # the number of test images processed so far
     for i, data in enumerate(dataset):
-        if i >= opt.num_test:  # only apply our model to opt.num_test images.
+        if num_done >= opt.num_test:  # only apply our model to opt.num_test images.
             break
         model.set_input(data)  # unpack data from data loader
         model.test()           # run inference
         visuals = model.get_current_visuals()  # get image results
         img_path = model.get_image_paths()     # get image paths
         if i % 5 == 0:  # save images to an HTML file
-            print('processing (%04d)-th image... %s' % (i, img_path))
-        save_images(webpage, visuals, img_path, aspect_ratio=opt.aspect_ratio, width=opt.display_winsize)
+            print('processing (%04d)-th image... %s' % (num_done, img_path))
+        saver.save(visuals, img_path, num=opt.num_test - num_done)  # images are encoded and written by background threads
+        num_done += len(img_path)
+    saver.close()   # wait for the images still being written
     webpage.save()  # save the HTML
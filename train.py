@@ -7,6 +7,9 @@ You need to specify the dataset ('--dataroot'), experiment name ('--name'), and
 It first creates model, dataset, and visualizer given the option.
 It then does standard network training. During the training, it also visualize/save the images, print/save the loss plot, and save models.
 The script supports continue/resume training. Use '--continue_train' to resume your previous training.
+Use '--resume' to also restore the optimizers, schedulers, image pools, random generators and counters,
+and continue exactly from the iteration where the checkpoint was saved.
+To train with several processes (e.g., one per GPU), start the script with torchrun; see util/distributed.py.
 
 Example:
     Train a CycleGAN model:
@@ -23,56 +26,103 @@ from options.train_options import TrainOptions
 from data import create_dataset
 from models import create_model
 from util.visualizer import Visualizer
+from util.checkpoint import get_rng_state, set_rng_state
+from util.distributed import init_distributed, is_main_process
 
 if __name__ == '__main__':
     opt = TrainOptions().parse()   # get training options
+    init_distributed(opt)          # join the process group when started with torchrun
+    is_main = is_main_process()    # only the first process displays the results and saves the checkpoints
     dataset = create_dataset(opt)  # create a dataset given opt.dataset_mode and other options
     dataset_size = len(dataset)    # get the number of images in the dataset.
     print('The number of training images = %d' % dataset_size)
 
     model = create_model(opt)      # create a model given opt.model and other options
     model.setup(opt)               # regular setup: load and print networks; create schedulers
-    visualizer = Visualizer(opt)   # create a visualizer that display/save images and plots
+    visualizer = Visualizer(opt) if is_main else None  # create a visualizer that display/save images and plots
     total_iters = 0                # the total number of training iterations
+    t_data = 0                     # the data loading time per iteration, measured every <print_freq> iterations
+    start_epoch = opt.epoch_count  # the first epoch to run
+    resume_state = None
+    if opt.resume:                 # restore the training state saved with the loaded networks
+        resume_state = model.load_training_state('iter_%d' % opt.load_iter if opt.load_iter > 0 else opt.epoch)
+        start_epoch, total_iters = resume_state['epoch'], resume_state['total_iters']  # the schedulers keep counting from <epoch_count>
 
-    for epoch in range(opt.epoch_count, opt.n_epochs + opt.n_epochs_decay + 1):    # outer loop for different epochs; we save the model by <epoch_count>, <epoch_count>+<save_latest_freq>
+    for epoch in range(start_epoch, opt.n_epochs + opt.n_epochs_decay + 1):    # outer loop for different epochs; we save the model by <epoch_count>, <epoch_count>+<save_latest_freq>
         epoch_start_time = time.time()  # timer for entire epoch
         iter_data_time = time.time()    # timer for data loading per iteration
         epoch_iter = 0                  # the number of training iterations in current epoch, reset to 0 every epoch
-        visualizer.reset()              # reset the visualizer: make sure it saves the results to HTML at least once every epoch
+        dataset.set_epoch(epoch)        # draw different pairs and shards (multi-process training) at every epoch
+        if is_main:
+            visualizer.reset()          # reset the visualizer: make sure it saves the results to HTML at least once every epoch
+        epoch_rng = get_rng_state()     # the random state that determines the data order of this epoch
+        if resume_state is not None:
+            if resume_state['epoch_iter'] > 0:  # replay the data order of the interrupted epoch and skip its first batches
+                epoch_rng = resume_state['epoch_rng']
+                set_rng_state(epoch_rng)
+                epoch_iter = resume_state['epoch_iter']
+                # the sampler skips the batches already done without loading them, then we continue with the random state of the saved iteration
+                saved_rng = resume_state['rng']
+                dataset.skip(epoch_iter // opt.batch_size, lambda: set_rng_state(saved_rng))
+            else:
+                set_rng_state(resume_state['rng'])
+            resume_state = None
 
         for i, data in enumerate(dataset):  # inner loop within one epoch
             iter_start_time = time.time()  # timer for computation per iteration
             if total_iters % opt.print_freq == 0:
                 t_data = iter_start_time - iter_data_time
+            if model.profiler is not None:
+                model.profiler.start()
 
             total_iters += opt.batch_size
             epoch_iter += opt.batch_size
-            model.set_input(data)         # unpack data from dataset and apply preprocessing
+            with model.timed('set_input'):
+                model.set_input(data)     # unpack data from dataset and apply preprocessing
             model.optimize_parameters()   # calculate loss functions, get gradients, update network weights
+            if is_main:
+                model.accumulate_losses()  # running sums of the losses, printed (averaged) every <print_freq> iterations
 
-            if total_iters % opt.display_freq == 0:   # display images on visdom and save images to a HTML file
+            if is_main and total_iters % opt.display_freq == 0:   # display images on visdom and save images to a HTML file
                 save_result = total_iters % opt.update_html_freq == 0
-                model.compute_visuals()
-                visualizer.display_current_results(model.get_current_visuals(), epoch, save_result)
+                with model.timed('display'):
+                    model.compute_visuals()
+                    visualizer.display_current_results(model.get_current_visuals(), epoch, save_result)
 
-            if total_iters % opt.print_freq == 0:    # print training losses and save logging information to the disk
+            if is_main and total_iters % opt.print_freq == 0:    # print training losses and save logging information to the disk
                 losses = model.get_current_losses()
                 t_comp = (time.time() - iter_start_time) / opt.batch_size
                 visualizer.print_current_losses(epoch, epoch_iter, losses, t_comp, t_data)
                 if opt.display_id > 0:
                     visualizer.plot_current_losses(epoch, float(epoch_iter) / dataset_size, losses)
 
-            if total_iters % opt.save_latest_freq == 0:   # cache our latest model every <save_latest_freq> iterations
-                print('saving the latest model (epoch %d, total_iters %d)' % (epoch, total_iters))
+            if total_iters % opt.save_latest_freq == 0:   # cache our latest model every <save_latest_freq> iterations (written by the first process)
+                if is_main:
+                    print('saving the latest model (epoch %d, total_iters %d)' % (epoch, total_iters))
                 save_suffix = 'iter_%d' % total_iters if opt.save_by_iter else 'latest'
-                model.save_networks(save_suffix)
+                with model.timed('checkpoint'):
+                    model.save_training_state(save_suffix, {'epoch': epoch, 'epoch_iter': epoch_iter, 'total_iters': total_iters, 'epoch_rng': epoch_rng})
 
+            if model.profiler is not None:  # close the profiled iteration; report the statistics every <print_freq> iterations
+                model.profiler.step(opt.batch_size, iter_start_time - iter_data_time)
+                if is_main and total_iters % opt.print_freq == 0:
+                    model.profiler.report(epoch, total_iters)
             iter_data_time = time.time()
-        if epoch % opt.save_epoch_freq == 0:              # cache our model every <save_epoch_freq> epochs
-            print('saving the model at the end of epoch %d, iters %d' % (epoch, total_iters))
-            model.save_networks('latest')
-            model.save_networks(epoch)
+        model.update_learning_rate()                     # update learning rates at the end of every epoch.
+        if epoch % opt.save_epoch_freq == 0:              # cache our model every <save_epoch_freq> epochs (written by the first process)
+            if is_main:
+                print('saving the model at the end of epoch %d, iters %d' % (epoch, total_iters))
+            model.save_training_state('latest', {'epoch': epoch + 1, 'epoch_iter': 0, 'total_iters': total_iters, 'epoch_rng': None})
+            if is_main:
+                model.save_networks(epoch)
 
         print('End of epoch %d / %d \t Time Taken: %d sec' % (epoch, opt.n_epochs + opt.n_epochs_decay, time.time() - epoch_start_time))
-        model.update_learning_rate()                     # update learning rates at the end of every epoch.
+        if dataset.dataset.image_cache is not None:       # print the hit/miss counters of the image cache for this epoch
+            print('image cache: %s' % ', '.join('%s: %.3g' % (k, v) for k, v in dataset.dataset.image_cache.stats().items()))
+            dataset.dataset.image_cache.reset_stats()
+        if getattr(model, 'pseudo_label_cache', None) is not None:  # same for the pseudo-label cache of cycle_gan_semantic_mask
+            print('pseudo-label cache: %s' % ', '.join('%s: %.3g' % (k, v) for k, v in model.pseudo_label_cache.stats().items()))
+            model.pseudo_label_cache.reset_stats()
+    model.checkpointer.close()                           # wait for the checkpoints still being written
+    if is_main:
+        visualizer.close()                               # wait for the results still being displayed
@@ -0,0 +1,158 @@
+"""This module implements asynchronous, atomic checkpoint writing and helpers to save and restore the training state.
+
+The <Checkpointer> snapshots the tensors to (pinned) host memory in the training thread, then serializes them
+in a background thread, so that training only waits for the device-to-host copies.
+Every file is written to a temporary file first and renamed, so that an interrupted write never leaves a corrupted checkpoint.
+"""
+import os
+import re
+import queue
+import atexit
+import random
+import threading
+import numpy as np
+import torch
+
+
+def get_rng_state():
+    """Return the states of the python, numpy and torch (CPU and CUDA) random number generators."""
+    state = {'python': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """Restore the random number generators from a state returned by <get_rng_state>."""
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def move_to(obj, device):
+    """Move all the tensors of a nested structure (dict, list, tuple) to a device."""
+    if torch.is_tensor(obj):
+        return obj.to(device)
+    if isinstance(obj, dict):
+        return {k: move_to(v, device) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(move_to(v, device) for v in obj)
+    return obj
+
+
+def save_atomic(obj, path):
+    """Save an object with torch.save through a temporary file, so that <path> is either complete or absent."""
+    tmp_path = path + '.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class Checkpointer():
+    """Write checkpoints from a background thread.
+
+    Usage:
+        checkpointer.save({'latest_net_G.pth': net.state_dict(), ...})   # returns once the tensors are copied
+        checkpointer.close()                                               # wait for the pending writes
+    """
+
+    def __init__(self, save_dir, keep=0):
+        """Initialize the checkpointer.
+
+        Parameters:
+            save_dir (str) -- the directory of the checkpoint files
+            keep (int)     -- the number of iteration checkpoints ('iter_<n>_*' files) to keep; 0 keeps all of them
+        """
+        self.save_dir = save_dir
+        self.keep = keep
+        # iteration checkpoints already on disk (e.g., from a previous run), from the oldest to the newest
+        groups = set()
+        for name in os.listdir(save_dir) if os.path.isdir(save_dir) else []:
+            match = re.match(r'^iter_(\d+)_', name)
+            if match:
+                groups.add(int(match.group(1)))
+        self.groups = ['iter_%d' % n for n in sorted(groups)]
+        self.error = None
+        self.jobs = queue.Queue(maxsize=1)  # at most one snapshot waits while another one is written
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def save(self, files, group=None):
+        """Snapshot some objects and write them in the background.
+
+        Parameters:
+            files (dict) -- {file name: object}; files are written in this order
+            group (str)  -- the name of an iteration checkpoint (e.g., 'iter_5000'), subject to the retention window
+        """
+        self._check_error()
+        snapshot = {name: self._snapshot(obj) for name, obj in files.items()}
+        event = None
+        if torch.cuda.is_available() and torch.cuda.is_initialized():
+            event = torch.cuda.Event()
+            event.record()  # the writer waits for the device-to-host copies, not the training thread
+        self.jobs.put((snapshot, group, event))
+
+    def wait(self):
+        """Block until all the pending checkpoints are written."""
+        self.jobs.join()
+        self._check_error()
+
+    def close(self):
+        """Wait for the pending checkpoints and stop the background thread."""
+        if self.thread.is_alive():
+            self.jobs.join()
+            self.jobs.put(None)
+            self.thread.join()
+        self._check_error()
+
+    def _check_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('failed to write a checkpoint') from error
+
+    def _snapshot(self, obj):
+        """Copy the tensors of a nested structure to host memory (pinned for GPU tensors, so that the copy is asynchronous)."""
+        if torch.is_tensor(obj):
+            if obj.is_cuda:
+                buffer = torch.empty(obj.shape, dtype=obj.dtype, pin_memory=True)
+                return buffer.copy_(obj.detach(), non_blocking=True)
+            return obj.detach().clone()
+        if isinstance(obj, dict):
+            return type(obj)((k, self._snapshot(v)) for k, v in obj.items())
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self._snapshot(v) for v in obj)
+        if isinstance(obj, np.ndarray):
+            return obj.copy()
+        return obj
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                return
+            snapshot, group, event = job
+            try:
+                if event is not None:
+                    event.synchronize()
+                for name, obj in snapshot.items():
+                    save_atomic(obj, os.path.join(self.save_dir, name))
+                if group is not None:
+                    self._retain(group)
+            except Exception as e:  # reported to the training thread at the next call
+                self.error = e
+            finally:
+                self.jobs.task_done()
+
+    def _retain(self, group):
+        """Record a new iteration checkpoint and delete the files of the ones beyond the retention window."""
+        if group in self.groups:
+            self.groups.remove(group)
+        self.groups.append(group)
+        while self.keep > 0 and len(self.groups) > self.keep:
+            old = self.groups.pop(0)
+            for name in os.listdir(self.save_dir):
+                if name.startswith(old + '_'):
+                    os.remove(os.path.join(self.save_dir, name))
@@ -0,0 +1,91 @@
+"""This module implements helpers for multi-process data-parallel training with torch.distributed.
+
+Start one process per GPU (or several CPU processes) with torchrun, e.g.
+    torchrun --nproc_per_node 4 train.py --dataroot ./datasets/maps --name maps_cyclegan --gpu_ids 0,1,2,3
+Every process trains on its own shard of the dataset, with its own image pools,
+and the gradients are averaged across the processes before every optimizer step (see <BaseModel.step_optimizer>).
+Only the process of rank 0 displays the results and saves the checkpoints; the checkpoints keep the random
+number generator states of all the processes.
+"""
+import os
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(opt):
+    """Join the process group of a torchrun launch, if any; select the GPU of this process.
+
+    Parameters:
+        opt (Option class) -- stores all the experiment flags; needs to be a subclass of BaseOptions
+
+    With N processes per node, the process of local rank i uses the GPU gpu_ids[i].
+    The backend is --dist_backend, by default nccl with GPUs and gloo on CPU.
+    """
+    world_size = int(os.environ.get('WORLD_SIZE', 1))
+    if world_size == 1 or is_distributed():
+        return opt
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    if len(opt.gpu_ids) > 0:
+        opt.gpu_ids = [opt.gpu_ids[local_rank % len(opt.gpu_ids)]]
+        torch.cuda.set_device(opt.gpu_ids[0])
+    backend = opt.dist_backend or ('nccl' if len(opt.gpu_ids) > 0 else 'gloo')
+    dist.init_process_group(backend)  # the rank, world size and address come from the environment set by torchrun
+    print('process %d / %d joined the %s process group' % (get_rank(), get_world_size(), backend))
+    return opt
+
+
+def is_distributed():
+    """Return True in a multi-process training"""
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    """Return the rank of this process (0 without multi-process training)"""
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    """Return the number of processes (1 without multi-process training)"""
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    """Return True in the process in charge of the display, the logs and the checkpoints"""
+    return get_rank() == 0
+
+
+def all_gather_object(obj):
+    """Return the list of the objects <obj> of all the processes, by rank ([obj] without multi-process training)."""
+    if not is_distributed():
+        return [obj]
+    objs = [None] * get_world_size()
+    dist.all_gather_object(objs, obj)
+    return objs
+
+
+def broadcast_module(net):
+    """Copy the parameters and buffers of a network from the process of rank 0 to all the processes."""
+    for tensor in list(net.parameters()) + list(net.buffers()):
+        dist.broadcast(tensor.data, 0)
+
+
+def all_reduce_gradients(params):
+    """Average the gradients of <params> across the processes, with one all-reduce per data type.
+
+    Parameters:
+        params (list) -- parameters, in the same order in every process
+
+    Parameters without gradient get a zero gradient, so that all the processes exchange the same tensors.
+    """
+    world_size = get_world_size()
+    buckets = {}
+    for p in params:
+        if p.grad is None:
+            p.grad = torch.zeros_like(p)
+        buckets.setdefault(p.grad.dtype, []).append(p.grad)
+    for grads in buckets.values():
+        flat = torch.cat([g.reshape(-1) for g in grads])
+        dist.all_reduce(flat)
+        flat /= world_size
+        for g, reduced in zip(grads, flat.split([g.numel() for g in grads])):
+            g.copy_(reduced.view_as(g))
@@ -1,5 +1,6 @@
 import dominate
 from dominate.tags import meta, h3, table, tr, td, p, a, img, br
+from dominate.util import raw
 import os
 
 
@@ -53,24 +54,35 @@ class HTML:
             txts (str list)  -- a list of image names shown on the website
             links (str list) --  a list of hyperref links; when you click an image, it will redirect you to a new page
         """
-        self.t = table(border=1, style="table-layout: fixed;")  # Insert a table
+        self.t = images_table(ims, txts, links, width)  # Insert a table
         self.doc.add(self.t)
-        with self.t:
-            with tr():
-                for im, txt, link in zip(ims, txts, links):
-                    with td(style="word-wrap: break-word;", halign="center", valign="top"):
-                        with p():
-                            with a(href=os.path.join('images', link)):
-                                img(style="width:%dpx" % width, src=os.path.join('images', im))
-                            br()
-                            p(txt)
+
+    def add_html(self, text):
+        """Insert already rendered HTML (e.g., from <images_table>) to the HTML file"""
+        self.doc.add(raw(text))
 
     def save(self):
         """save the current content to the HMTL file"""
         html_file = '%s/index.html' % self.web_dir
-        f = open(html_file, 'wt')
+        f = open(html_file + '.tmp', 'wt')  # replaced at once, so that a browser never loads a partial file
         f.write(self.doc.render())
         f.close()
+        os.replace(html_file + '.tmp', html_file)
+
+
+def images_table(ims, txts, links, width=400):
+    """Return a table showing a row of images (see <HTML.add_images>)"""
+    t = table(border=1, style="table-layout: fixed;")
+    with t:
+        with tr():
+            for im, txt, link in zip(ims, txts, links):
+                with td(style="word-wrap: break-word;", halign="center", valign="top"):
+                    with p():
+                        with a(href=os.path.join('images', link)):
+                            img(style="width:%dpx" % width, src=os.path.join('images', im))
+                        br()
+                        p(txt)
+    return t
 
 
 if __name__ == '__main__':  # we show an example usage here.
@@ -1,4 +1,3 @@
-import random
 import torch
 
 
@@ -7,6 +6,9 @@ class ImagePool():
 
     This buffer enables us to update discriminators using a history of generated images
     rather than the ones produced by the latest generators.
+
+    The buffer is a preallocated tensor (pool_size x C x H x W) on the device of the images,
+    so that a query is a few tensor operations on the whole batch.
     """
 
     def __init__(self, pool_size):
@@ -18,7 +20,7 @@ class ImagePool():
         self.pool_size = pool_size
         if self.pool_size > 0:  # create an empty pool
             self.num_imgs = 0
-            self.images = []
+            self.images = None  # allocated at the first query, once the image size is known
 
     def query(self, images):
         """Return an image from the pool.
@@ -34,21 +36,48 @@ class ImagePool():
         """
         if self.pool_size == 0:  # if the buffer size is 0, do nothing
             return images
-        return_images = []
-        for image in images:
-            image = torch.unsqueeze(image.data, 0)
-            if self.num_imgs < self.pool_size:   # if the buffer is not full; keep inserting current images to the buffer
-                self.num_imgs = self.num_imgs + 1
-                self.images.append(image)
-                return_images.append(image)
-            else:
-                p = random.uniform(0, 1)
-                if p > 0.5:  # by 50% chance, the buffer will return a previously stored image, and insert the current image into the buffer
-                    random_id = random.randint(0, self.pool_size - 1)  # randint is inclusive
-                    tmp = self.images[random_id].clone()
-                    self.images[random_id] = image
-                    return_images.append(tmp)
-                else:       # by another 50% chance, the buffer will return the current image
-                    return_images.append(image)
-        return_images = torch.cat(return_images, 0)   # collect all the images and return
-        return return_images
+        images = images.detach()
+        if self.images is None:
+            # one extra slot receives the writes that must be discarded (see below)
+            self.images = images.new_empty((self.pool_size + 1,) + images.shape[1:])
+        assert self.images.shape[1:] == images.shape[1:], \
+            'ImagePool stores images of size %s, got %s; use a fixed --crop_size or --pool_size 0' % (tuple(self.images.shape[1:]), tuple(images.shape[1:]))
+
+        # if the buffer is not full; keep inserting current images to the buffer
+        num_fill = min(self.pool_size - self.num_imgs, images.size(0))
+        if num_fill > 0:
+            self.images[self.num_imgs:self.num_imgs + num_fill] = images[:num_fill]
+            self.num_imgs += num_fill
+            if num_fill == images.size(0):
+                return images
+        fill_images, images = images[:num_fill], images[num_fill:]
+
+        # by 50% chance, the buffer will return a previously stored image, and insert the current image into the buffer
+        num = images.size(0)
+        per_image = (num,) + (1,) * (images.dim() - 1)  # broadcast a per-image value over C x H x W
+        swap = torch.rand(num, device=images.device) > 0.5
+        random_ids = torch.randint(0, self.pool_size, (num,), device=images.device)
+        # images are processed in order: when several of them swap the same slot, an image gets the one inserted just before it
+        order = torch.arange(num, device=images.device)
+        same_slot = (random_ids[:, None] == random_ids[None, :]) & swap[None, :] & (order[None, :] < order[:, None])
+        previous = (same_slot * order[None, :]).argmax(1)
+        stored = torch.where(same_slot.any(1).view(per_image), images[previous], self.images[random_ids].to(images.dtype))
+        return_images = torch.where(swap.view(per_image), stored, images)
+        # only the last image swapping a slot stays in the buffer; the other writes go to the extra slot
+        last = swap & ~(same_slot & swap[:, None]).any(0)
+        self.images.index_copy_(0, torch.where(last, random_ids, self.pool_size), images.to(self.images.dtype))
+        return torch.cat((fill_images, return_images), 0) if num_fill > 0 else return_images
+
+    def state_dict(self):
+        """Return the content of the buffer, to be saved with the training state."""
+        if self.pool_size == 0 or self.images is None:
+            return {}
+        return {'num_imgs': self.num_imgs, 'images': self.images[:self.num_imgs]}
+
+    def load_state_dict(self, state_dict):
+        """Restore the content of the buffer from <state_dict>."""
+        if self.pool_size > 0 and state_dict:
+            images = state_dict['images']
+            self.images = images.new_empty((self.pool_size + 1,) + images.shape[1:])
+            self.images[:len(images)] = images
+            self.num_imgs = state_dict['num_imgs']
@@ -0,0 +1,95 @@
+"""This module implements a lightweight profiler of the phases of a training step (see --profile).
+
+Phases are timed with a device synchronization before and after them, so that the time of asynchronous
+CUDA kernels is attributed to the phase that launched them. The synchronizations slow training down a little:
+only enable the profiler to find the bottlenecks.
+"""
+import json
+import time
+from collections import OrderedDict, deque
+import numpy as np
+import torch
+
+
+class StepProfiler():
+    """Time the phases of the training steps and report rolling statistics.
+
+    Usage:
+        with profiler.phase('forward_G'):
+            ...
+        profiler.step(batch_size, t_data)          # at the end of every training iteration
+        profiler.report(epoch, total_iters)        # print and log the statistics of the last iterations
+    """
+
+    def __init__(self, log_name, device, window=100):
+        """Initialize the profiler.
+
+        Parameters:
+            log_name (str)         -- the JSON lines file receiving the reports
+            device (torch.device)  -- the device to synchronize before and after every phase
+            window (int)           -- the number of recent iterations used by the statistics
+        """
+        self.log_name = log_name
+        self.sync = torch.cuda.synchronize if device.type == 'cuda' else (lambda: None)
+        self.phases = OrderedDict()            # phase name -> deque of the per-iteration times
+        self.current = {}                      # phase name -> time spent in the current iteration
+        self.steps = deque(maxlen=window)      # (batch_size, data time, iteration time)
+        self.window = window
+        self.step_start = time.time()          # see <start>
+
+    def phase(self, name):
+        """Return a context manager timing its content as phase <name> (phases may be nested and repeated)."""
+        return _Phase(self, name)
+
+    def step(self, batch_size, t_data):
+        """Close the current training iteration.
+
+        Parameters:
+            batch_size (int) -- the number of images of the iteration
+            t_data (float)   -- the time spent waiting for the data loader before the iteration
+        """
+        self.steps.append((batch_size, t_data, time.time() - self.step_start))
+        for name in list(self.current) + [name for name in self.phases if name not in self.current]:
+            self.phases.setdefault(name, deque(maxlen=self.window)).append(self.current.get(name, 0.0))
+        self.current = {}
+
+    def start(self):
+        """Mark the start of an iteration, once its data is loaded."""
+        self.step_start = time.time()
+
+    def report(self, epoch, total_iters):
+        """Print and log the statistics of the last <window> iterations; return them as a dictionary.
+
+        The statistics are the 50th/90th/99th percentiles of every phase (in ms), the throughput (images/sec)
+        and the data stall ratio: the fraction of the time spent waiting for the data loader.
+        """
+        if not self.steps:
+            return {}
+        batch_sizes, t_data, t_iter = [np.array(v, dtype=np.float64) for v in zip(*self.steps)]
+        total = t_data.sum() + t_iter.sum()
+        stats = OrderedDict([('epoch', epoch), ('iters', total_iters), ('images_per_sec', batch_sizes.sum() / total),
+                             ('data_stall_ratio', t_data.sum() / total), ('phases', OrderedDict())])
+        for name, times in [('data', t_data), ('iteration', t_iter)] + [(k, np.array(v)) for k, v in self.phases.items()]:
+            p50, p90, p99 = np.percentile(times * 1000, [50, 90, 99])
+            stats['phases'][name] = OrderedDict([('p50', p50), ('p90', p90), ('p99', p99)])
+        message = '(profile) %.1f img/s, data stall %.1f%%, p50/p90 ms: ' % (stats['images_per_sec'], 100 * stats['data_stall_ratio'])
+        message += ' '.join('%s: %.1f/%.1f' % (k, v['p50'], v['p90']) for k, v in stats['phases'].items())
+        print(message)
+        with open(self.log_name, 'a') as log_file:
+            log_file.write(json.dumps(stats) + '\n')
+        return stats
+
+
+class _Phase():
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler.sync()
+        self.start = time.time()
+
+    def __exit__(self, *exc):
+        self.profiler.sync()
+        self.profiler.current[self.name] = self.profiler.current.get(self.name, 0.0) + time.time() - self.start
+        return False
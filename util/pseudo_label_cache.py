@@ -0,0 +1,65 @@
+from collections import OrderedDict
+
+
+class PseudoLabelCache():
+    """This class stores the pseudo-labels predicted by a segmentation network on augmented real images.
+
+    An entry is keyed by the image (e.g., its path) and its augmentation params, so that a cached pseudo-label
+    is only reused for the same view of the same image. It records the version of the network that predicted it
+    (its number of updates): entries older than <max_age> updates are predicted again, and once the network
+    is frozen, the entries never expire. The least recently used entries are dropped beyond <size> entries.
+    """
+
+    def __init__(self, size, max_age=0):
+        """Initialize the PseudoLabelCache class
+
+        Parameters:
+            size (int)    -- the maximum number of cached pseudo-labels
+            max_age (int) -- the maximum number of updates of the network since a pseudo-label was predicted
+        """
+        self.size = size
+        self.max_age = max_age
+        self.entries = OrderedDict()  # key -> (pseudo-label tensor, version)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, keys, version):
+        """Return the cached pseudo-labels of a batch, as a list with None for the missing or stale ones.
+
+        Parameters:
+            keys (list)   -- the key of every image of the batch
+            version (int) -- the current version of the network
+        """
+        labels = []
+        for key in keys:
+            entry = self.entries.get(key)
+            if entry is not None and version - entry[1] <= self.max_age:
+                self.entries.move_to_end(key)
+                labels.append(entry[0])
+                self.hits += 1
+            else:
+                labels.append(None)
+                self.misses += 1
+        return labels
+
+    def put(self, keys, labels, version):
+        """Store the pseudo-labels of some images, predicted by the given version of the network."""
+        for key, label in zip(keys, labels):
+            self.entries[key] = (label, version)
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """Drop all the cached pseudo-labels"""
+        self.entries.clear()
+
+    def stats(self):
+        """Return a dictionary of the hit/miss counters."""
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / max(self.hits + self.misses, 1),
+                'entries': len(self.entries)}
+
+    def reset_stats(self):
+        """Reset the hit/miss counters (e.g., at the beginning of every epoch)."""
+        self.hits = 0
+        self.misses = 0
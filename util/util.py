@@ -5,58 +5,60 @@ import numpy as np
 from PIL import Image
 import os
 
+# colors of the first classes of a mask; the next ones get reproducible random colors (see <mask_palette>)
+MASK_COLORS = np.array(
+    [
+        [0, 0, 0],  # black
+        [0, 255, 0],  # green
+        [255, 0, 0],  # red
+        [0, 0, 255],  # blue
+        [0, 255, 255],  # cyan
+        [255, 255, 255],  # white
+        [96, 96, 96],  # grey
+        [255, 255, 0],  # yellow
+        [237, 127, 16],  # orange
+        [102, 0, 153],  # purple
+        [88, 41, 0],  # brown
+        [253, 108, 158],  # pink
+        [128, 0, 0],  # maroon
+        [255, 0, 255],
+        [255, 0, 127],
+        [0, 128, 255],
+        [0, 102, 51],
+        [192, 192, 192],
+        [128, 128, 0],
+        [84, 151, 120],
+    ], dtype=np.uint8)
+
+
+def mask_palette(nclasses):
+    """Return a (nclasses x 3) uint8 color lookup table for masks.
+
+    Parameters:
+        nclasses (int) -- the number of classes
+
+    Classes beyond the fixed MASK_COLORS get random colors, which are the same for every call.
+    """
+    if nclasses <= len(MASK_COLORS):
+        return MASK_COLORS[:max(nclasses, 1)]
+    extra = np.random.RandomState(0).randint(0, 256, (nclasses - len(MASK_COLORS), 3)).astype(np.uint8)
+    return np.concatenate([MASK_COLORS, extra])
+
+
 def display_mask(mask):
-    dict_col =np.array(
-        [
-            [0,0,0],
-            [0,255,0],
-            [255,0,0],
-            [0,0,255],
-            [255,255,255],
-            [96,96,96],
-            [253,96,96],
-            [255,255,0],
-            [237,127,16],
-            [102,0,153],
-        ]
-    )
-
-    dict_col =np.array(
-        [
-            [0,0,0], #black        
-            [0,255,0],#green
-            [255,0,0],#red
-            [0,0,255],#blue
-            [0,255,255],#cyan
-            [255,255,255],#white
-            [96,96,96], #grey
-            [255,255,0],#yellow
-            [237,127,16],#orange
-            [102,0,153],#purple
-            [88,41,0], #brown
-            [253,108,158],#pink
-            [128,0,0],#maroon
-            [255,0,255],
-            [255,0,127],
-            [0,128,255],
-            [0,102,51],#17
-            [192,192,192],
-            [128,128,0],
-            [84, 151, 120]
-
-        ]
-    )
-    
-    try :
-        len(mask.shape)==2
-    except AssertionError:
-        print('Mask\'s shape is not 2')
-    mask_dis = np.zeros((mask.shape[0],mask.shape[1],3))
-    #print('mask_dis shape',mask_dis.shape)
-    for i in range(mask.shape[0]):
-        for j in range(mask.shape[0]):
-            mask_dis[i,j,:] = dict_col[mask[i,j]]
-    return mask_dis
+    """Color the classes of a mask with a lookup in <mask_palette>.
+
+    Parameters:
+        mask (numpy array or tensor) -- integer class labels, of any shape (e.g., H x W or N x H x W)
+
+    Returns the colors, with an extra last dimension of size 3 (uint8, on the device of the mask for a tensor).
+    """
+    if isinstance(mask, torch.Tensor):
+        mask = mask.long()
+        palette = torch.from_numpy(mask_palette(int(mask.max()) + 1 if mask.numel() > 0 else 1)).to(mask.device)
+        return palette[mask]
+    mask = np.asarray(mask).astype(np.int64, copy=False)
+    return mask_palette(int(mask.max()) + 1 if mask.size > 0 else 1)[mask]
 
 
 def tensor2im(input_image, imtype=np.uint8):
@@ -77,8 +79,7 @@ def tensor2im(input_image, imtype=np.uint8):
         if len(image_numpy.shape)!=2: # it is an image
             image_numpy = (np.transpose(image_numpy, (1, 2, 0)) + 1) / 2.0 * 255.0  # post-processing: tranpose and scaling
         else : # it is  a mask
-            image_numpy = image_numpy.astype(np.uint8)
-            image_numpy = display_mask(image_numpy)
+            image_numpy = display_mask(image_numpy.astype(np.int64))
     else:  # if it is a numpy array, do nothing
         image_numpy = input_image
     return image_numpy.astype(imtype)
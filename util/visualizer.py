@@ -3,6 +3,10 @@ import os
 import sys
 import ntpath
 import time
+import torch
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from . import util, html
 from subprocess import Popen, PIPE
 
@@ -43,19 +47,88 @@ def save_images(webpage, visuals, image_path, aspect_ratio=1.0, width=256):
     webpage.add_images(ims, txts, links, width=width)
 
 
+class ImageSaver():
+    """This class saves the test results of whole batches to the disk, encoding the images in a pool of threads.
+
+    Usage:
+        saver.save(model.get_current_visuals(), model.get_image_paths())  # returns before the images are written
+        saver.close()                                                     # wait for the pending images
+    The HTML rows are added in the order of the calls, as with <save_images>.
+    """
+
+    def __init__(self, webpage, aspect_ratio=1.0, width=256, num_writers=4):
+        """Initialize the ImageSaver class
+
+        Parameters:
+            webpage (the HTML class) -- the HTML webpage class that stores these images (see html.py for more details)
+            aspect_ratio (float)     -- the aspect ratio of saved images
+            width (int)              -- the images will be resized to width x width
+            num_writers (int)        -- the number of writer threads; 0 writes the images synchronously
+        """
+        self.webpage = webpage
+        self.aspect_ratio = aspect_ratio
+        self.width = width
+        self.executor = ThreadPoolExecutor(num_writers) if num_writers > 0 else None
+        self.max_pending = 8 * num_writers  # bound the memory held by the images waiting to be written
+        self.pending = deque()
+
+    def save(self, visuals, image_paths, num=None):
+        """Save the images of a batch and add them to the HTML file.
+
+        Parameters:
+            visuals (OrderedDict)    -- an ordered dictionary that stores (name, images (either tensor or numpy) ) pairs
+            image_paths (str list)   -- the paths of the input images of the batch, used to create image paths
+            num (int)                -- save only the first <num> images of the batch
+        """
+        visuals = [(label, im.detach().cpu() if isinstance(im, torch.Tensor) else im) for label, im in visuals.items()]  # one device-to-host copy per visual
+        image_dir = self.webpage.get_image_dir()
+        for i, image_path in enumerate(image_paths[:num]):
+            name = os.path.splitext(ntpath.basename(image_path))[0]
+            self.webpage.add_header(name)
+            ims, txts, links = [], [], []
+            for label, im_data in visuals:
+                if isinstance(im_data, torch.Tensor):
+                    im_data = im_data[i:i + 1]
+                image_name = '%s_%s.png' % (name, label)
+                self._submit(im_data, os.path.join(image_dir, image_name))
+                ims.append(image_name)
+                txts.append(label)
+                links.append(image_name)
+            self.webpage.add_images(ims, txts, links, width=self.width)
+
+    def close(self):
+        """Wait until all the images are written."""
+        while self.pending:
+            self.pending.popleft().result()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def _submit(self, im_data, save_path):
+        if self.executor is None:
+            self._write(im_data, save_path)
+            return
+        while len(self.pending) >= self.max_pending:
+            self.pending.popleft().result()  # also raises the errors of the writer threads
+        self.pending.append(self.executor.submit(self._write, im_data, save_path))
+
+    def _write(self, im_data, save_path):
+        util.save_image(util.tensor2im(im_data), save_path, aspect_ratio=self.aspect_ratio)
+
+
 class Visualizer():
     """This class includes several functions that can display/save images and print/save logging information.
 
     It uses a Python library 'visdom' for display, and a Python library 'dominate' (wrapped in 'HTML') for creating HTML files with images.
     """
 
-    def __init__(self, opt):
+    def __init__(self, opt, display_process=False):
         """Initialize the Visualizer class
 
         Parameters:
             opt -- stores all the experiment flags; needs to be a subclass of BaseOptions
+            display_process (bool) -- if True, this visualizer runs in the background process of --display_async and only displays the results
         Step 1: Cache the training/test options
-        Step 2: connect to a visdom server
+        Step 2: connect to a visdom server (or start the background display process with --display_async)
         Step 3: create an HTML object for saveing HTML filters
         Step 4: create a logging file to store training losses
         """
@@ -66,7 +139,14 @@ class Visualizer():
         self.name = opt.name
         self.port = opt.display_port
         self.saved = False
-        if self.display_id > 0:  # connect to a visdom server given <display_port> and <display_server>
+        self.html_rows = {}  # rendered HTML of the results of every epoch, so that the page is not rebuilt from scratch
+        self.queue = None    # requests to the background display process
+        if opt.display_async and not display_process and (self.display_id > 0 or self.use_html):
+            # the display process converts, encodes and sends the results, while training continues
+            self.queue = multiprocessing.Queue(maxsize=4)
+            self.process = multiprocessing.Process(target=_display_loop, args=(opt, self.queue), daemon=True)
+            self.process.start()
+        elif self.display_id > 0:  # connect to a visdom server given <display_port> and <display_server>
             import visdom
             self.ncols = opt.display_ncols
             self.vis = visdom.Visdom(server=opt.display_server, port=opt.display_port, env=opt.display_env)
@@ -78,6 +158,8 @@ class Visualizer():
             self.img_dir = os.path.join(self.web_dir, 'images')
             print('create web directory %s...' % self.web_dir)
             util.mkdirs([self.web_dir, self.img_dir])
+        if display_process:
+            return
         # create a logging file to store training losses
         self.log_name = os.path.join(opt.checkpoints_dir, opt.name, 'loss_log.txt')
         with open(self.log_name, "a") as log_file:
@@ -88,6 +170,13 @@ class Visualizer():
         """Reset the self.saved status"""
         self.saved = False
 
+    def close(self):
+        """Wait until the background display process has handled all the results, and stop it."""
+        if self.queue is not None:
+            self.queue.put(None)
+            self.process.join()
+            self.queue = None
+
     def create_visdom_connections(self):
         """If the program could not connect to Visdom server, this function will start a new server at port < self.port > """
         cmd = sys.executable + ' -m visdom.server -p %d &>/dev/null &' % self.port
@@ -102,7 +191,27 @@ class Visualizer():
             visuals (OrderedDict) - - dictionary of images to display or save
             epoch (int) - - the current epoch
             save_result (bool) - - if save the current results to an HTML file
+
+        With --display_async, it only copies the first image of every visual to the CPU, and returns.
         """
+        save_result = self.use_html and (save_result or not self.saved)  # save images to an HTML file if they haven't been saved.
+        if save_result:
+            self.saved = True
+        if self.queue is not None:
+            visuals = OrderedDict((label, image.detach()[:1].cpu() if isinstance(image, torch.Tensor) else image)
+                                  for label, image in visuals.items())
+            self._request('show_results', visuals, epoch, save_result)
+        else:
+            self.show_results(visuals, epoch, save_result)
+
+    def _request(self, name, *args):
+        """Call the method <name> of the visualizer of the background display process"""
+        if not self.process.is_alive():
+            raise RuntimeError('the display process of --display_async exited with code %s' % self.process.exitcode)
+        self.queue.put((name, args))
+
+    def show_results(self, visuals, epoch, save_result):
+        """Display results on visdom and save them to the HTML file; see <display_current_results>."""
         if self.display_id > 0:  # show images in the browser using visdom
             ncols = self.ncols
             if ncols > 0:        # show all the images in one visdom panel
@@ -153,27 +262,21 @@ class Visualizer():
                 except VisdomExceptionBase:
                     self.create_visdom_connections()
 
-        if self.use_html and (save_result or not self.saved):  # save images to an HTML file if they haven't been saved.
-            self.saved = True
+        if save_result:
             # save images to the disk
             for label, image in visuals.items():
                 image_numpy = util.tensor2im(image)
                 img_path = os.path.join(self.img_dir, 'epoch%.3d_%s.png' % (epoch, label))
                 util.save_image(image_numpy, img_path)
 
-            # update website
+            # update website: only the rows of new epochs are rendered; earlier epochs (e.g., before --continue_train) use the current labels
+            for n in range(1, epoch + 1):
+                if n == epoch or n not in self.html_rows:
+                    img_paths = ['epoch%.3d_%s.png' % (n, label) for label in visuals]
+                    table = html.images_table(img_paths, list(visuals), img_paths, width=self.win_size)
+                    self.html_rows[n] = '<h3>epoch [%d]</h3>\n%s' % (n, table.render())
             webpage = html.HTML(self.web_dir, 'Experiment name = %s' % self.name, refresh=1)
-            for n in range(epoch, 0, -1):
-                webpage.add_header('epoch [%d]' % n)
-                ims, txts, links = [], [], []
-
-                for label, image_numpy in visuals.items():
-                    image_numpy = util.tensor2im(image)
-                    img_path = 'epoch%.3d_%s.png' % (n, label)
-                    ims.append(img_path)
-                    txts.append(label)
-                    links.append(img_path)
-                webpage.add_images(ims, txts, links, width=self.win_size)
+            webpage.add_html('\n'.join(self.html_rows[n] for n in sorted(self.html_rows, reverse=True)))
             webpage.save()
 
     def plot_current_losses(self, epoch, counter_ratio, losses):
@@ -195,13 +298,20 @@ class Visualizer():
             self.plot_data['Y'].append([losses[k] for k in self.plot_data['legend']])
             X=np.stack([np.array(self.plot_data['X'])] * len(self.plot_data['legend']), 1)
             Y=np.array(self.plot_data['Y'])
+        if self.queue is not None:
+            self._request('plot_losses', X, Y, self.plot_data['legend'])
+        else:
+            self.plot_losses(X, Y, self.plot_data['legend'])
+
+    def plot_losses(self, X, Y, legend):
+        """Plot the loss curves on visdom; see <plot_current_losses>."""
         try:
             self.vis.line(
                 Y,
                 X,
                 opts={
                     'title': self.name + ' loss over time',
-                    'legend': self.plot_data['legend'],
+                    'legend': legend,
                     'xlabel': 'epoch',
                     'ylabel': 'loss'},
                 win=self.display_id)
@@ -226,3 +336,11 @@ class Visualizer():
         print(message)  # print the message
         with open(self.log_name, "a") as log_file:
             log_file.write('%s\n' % message)  # save the message
+
+
+def _display_loop(opt, queue):
+    """Run the requests of a <Visualizer> in the background display process of --display_async"""
+    visualizer = Visualizer(opt, display_process=True)
+    for request in iter(queue.get, None):
+        name, args = request
+        getattr(visualizer, name)(*args)